@@ -1,48 +1,11 @@
+import re
+import time
 import streamlit as st
-import sqlite3
-import cv2
-import os
-import tempfile
-
-# Create a connection to the database
-conn = sqlite3.connect('healthcare.db')
-c = conn.cursor()
-
-# Create the users table if it doesn't exist
-c.execute('''CREATE TABLE IF NOT EXISTS users
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             username TEXT UNIQUE NOT NULL,
-             password TEXT NOT NULL,
-             name TEXT NOT NULL,
-             age INTEGER NOT NULL,
-             gender TEXT NOT NULL,
-             profile_picture TEXT,
-             address TEXT NOT NULL,
-             user_type TEXT NOT NULL)''')
-
-# Create the consultations table if it doesn't exist
-c.execute('''CREATE TABLE IF NOT EXISTS consultations
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             patient_id INTEGER NOT NULL,
-             consultation_type TEXT NOT NULL,
-             symptoms TEXT,
-             history_of_illness TEXT,
-             blood_group TEXT,
-             comments TEXT,
-             status TEXT NOT NULL,
-             doctor_comments TEXT,
-             FOREIGN KEY (patient_id) REFERENCES users (id))''')
-
-# Create the chat_messages table if it doesn't exist
-c.execute('''CREATE TABLE IF NOT EXISTS chat_messages
-             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             consultation_id INTEGER NOT NULL,
-             sender TEXT NOT NULL,
-             message TEXT NOT NULL,
-             timestamp TEXT NOT NULL,
-             FOREIGN KEY (consultation_id) REFERENCES consultations (id))''')
-
-conn.commit()
+from healthcare import analytics, archive, auth, cache, consultations as consultation_store, db, media, metrics, migrations, search, triage, ui, users, writer
+
+# Create or upgrade the database schema
+migrations.migrate()
+metrics.configure("admin")
 
 # Admin Signup
 def admin_signup():
@@ -57,24 +20,23 @@ def admin_signup():
 
     if st.button("Sign Up"):
         # Check if the username already exists
-        c.execute("SELECT * FROM users WHERE username = ?", (username,))
-        existing_user = c.fetchone()
+        existing_user = db.query_one("SELECT * FROM users WHERE username = ?", (username,))
 
         if existing_user:
             st.error("Username already exists. Please choose a different username.")
         else:
-            # Save the profile picture to a file
+            # Store resized copies of the profile picture
             if profile_picture:
-                profile_picture_path = f"profile_{username}.jpg"
-                with open(profile_picture_path, "wb") as file:
-                    file.write(profile_picture.getbuffer())
+                try:
+                    profile_picture_path = media.save_avatar(profile_picture.getvalue())
+                except ValueError:
+                    st.error("The profile picture could not be read. Please upload a JPG or PNG image.")
+                    return
             else:
                 profile_picture_path = None
 
             # Insert the admin data into the users table
-            c.execute("INSERT INTO users (username, password, name, age, gender, profile_picture, address, user_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                      (username, password, name, age, gender, profile_picture_path, address, "admin"))
-            conn.commit()
+            users.add_user(username, password, name, age, gender, profile_picture_path, address, "admin")
             st.success("Admin account created successfully!")
 
 # Admin Login
@@ -85,9 +47,7 @@ def admin_login():
 
     if st.button("Login"):
         # Check if the username and password match an admin user
-        c.execute("SELECT * FROM users WHERE username = ? AND password = ? AND user_type = ?",
-                  (username, password, "admin"))
-        admin_user = c.fetchone()
+        admin_user = auth.authenticate(username, password, "admin")
 
         if admin_user:
             st.success("Logged in as an admin!")
@@ -97,74 +57,139 @@ def admin_login():
         else:
             st.error("Invalid username or password.")
 
+# Keyset pagination: remember the cursor that starts each visited page
+def paginate(key, fetch):
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    rows, next_cursor = fetch(cursors[-1])
+
+    previous_column, next_column = st.columns(2)
+    previous_column.button("Previous page", key=f"{key}_previous", disabled=len(cursors) == 1,
+                           on_click=cursors.pop)
+    next_column.button("Next page", key=f"{key}_next", disabled=next_cursor is None,
+                       on_click=cursors.append, args=(next_cursor,))
+    return rows
+
+# Filters for the consultation lists, applied in SQL
+def consultation_filters(consultation_type):
+    status_column, patient_column, since_column, until_column, order_column, mine_column = st.columns(6)
+    status = status_column.selectbox("Status", ["All", "Processing", "Available", "Unavailable"],
+                                     key=f"{consultation_type}_filter_status")
+    patient_id = patient_column.number_input("Patient ID", min_value=0, step=1,
+                                             key=f"{consultation_type}_filter_patient")
+    since = since_column.date_input("Submitted from", value=None, key=f"{consultation_type}_filter_since")
+    until = until_column.date_input("Submitted until", value=None, key=f"{consultation_type}_filter_until")
+    order = order_column.selectbox("Sort", ["Newest first", "Oldest first"], key=f"{consultation_type}_filter_order")
+    mine = mine_column.checkbox("Assigned to me", key=f"{consultation_type}_filter_mine")
+
+    filters = {
+        "status": None if status == "All" else status,
+        "patient_id": patient_id or None,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+        "newest_first": order == "Newest first",
+        "doctor_id": st.session_state.user[0] if mine else None,
+    }
+    # Changing a filter starts again from the first page
+    key = f"{consultation_type}_" + "_".join(str(value) for value in filters.values())
+    return key, filters
+
+# List one page of consultations of the given type in a single table
+@metrics.timed("render.consultation_list")
+def consultation_page(consultation_type):
+    key, filters = consultation_filters(consultation_type)
+    consultations = paginate(key, lambda cursor: consultation_store.list_consultations(
+        consultation_type, after_id=cursor, **filters))
+
+    if consultations:
+        st.dataframe(consultations, hide_index=True, use_container_width=True, column_config={
+            "id": "Consultation ID",
+            "patient_id": "Patient ID",
+            "status": "Status",
+            "priority": "Priority",
+            "created_at": "Submitted",
+            "symptoms": "Symptoms",
+            "history_of_illness": "History of Illness",
+            "blood_group": "Blood Group",
+            "comments": "Comments",
+            "doctor_comments": "Doctor Comments",
+        })
+    else:
+        st.info("No consultations match these filters.")
+    return consultations
+
+# Charts from the analytics rollups; every chart reads a few rows per day
+@metrics.timed("render.analytics")
+def analytics_overview():
+    periods = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "Last 365 days": 365}
+    days = periods[st.selectbox("Period", list(periods), index=1)]
+    overview = analytics.overview(days)
+    columns = st.columns(5)
+    columns[0].metric("Consultations", overview["consultations"])
+    columns[1].metric("Waiting", overview["waiting"])
+    columns[2].metric("Mean response", "-" if overview["mean_response_minutes"] is None
+                      else f"{overview['mean_response_minutes']} min")
+    columns[3].metric("Messages per chat", overview["messages_per_conversation"] or "-")
+    columns[4].metric("Patients", overview["patients"])
+
+    charts = {
+        "Consultations per day": (analytics.consultations_per_day(days), "day", "consultations", "consultation_type"),
+        "Status": (analytics.status_totals(days), "status", "consultations", "consultation_type"),
+        "Response time (minutes)": (analytics.response_times(days), "day", "mean_minutes", "consultation_type"),
+        "Chat messages per day": (analytics.message_activity(days), "day", "messages", None),
+        "Patients": (analytics.patient_mix(), "age_group", "patients", "gender"),
+    }
+    for (title, (rows, x, y, color)), tab in zip(charts.items(), st.tabs(list(charts))):
+        with tab:
+            if rows:
+                st.bar_chart(rows, x=x, y=y, color=color)
+                st.download_button("Download as Parquet", analytics.parquet_bytes(rows),
+                                   file_name=f"{title.split(' (')[0].lower().replace(' ', '_')}.parquet",
+                                   key=f"download_{x}_{y}")
+            else:
+                st.info("No data for this period.")
+
 # Admin Dashboard
 def admin_dashboard():
-    st.subheader(f"Welcome, {st.session_state.user[3]}!")
-
-    # Fetch all registered patients
-    c.execute("SELECT * FROM users WHERE user_type = 'patient'")
-    patients = c.fetchall()
-
-    # Display registered patients
-    for patient in patients:
-        st.write(f"Patient ID: {patient[0]}")
-        st.write(f"Name: {patient[3]}")
-        st.write(f"Age: {patient[4]}")
-        st.write(f"Gender: {patient[5]}")
-        st.write(f"Address: {patient[7]}")
-        st.write("---")
+    ui.welcome(st.session_state.user)
+    analytics_overview()
+
+    # Display one page of registered patients
+    patients = paginate("patients", lambda cursor: users.list_patients(after_id=cursor))
+    patients = [dict(patient, profile_picture=media.avatar_data_url(patient["profile_picture"])) for patient in patients]
+    st.dataframe(patients, hide_index=True, use_container_width=True, column_config={
+        "id": "Patient ID",
+        "profile_picture": st.column_config.ImageColumn("Picture"),
+        "name": "Name",
+        "age": "Age",
+        "gender": "Gender",
+        "address": "Address",
+    })
 
 # Chat Consultation
 def chat_consultation():
     st.subheader("Chat Consultations")
 
-    # Fetch chat consultations
-    c.execute("SELECT * FROM consultations WHERE consultation_type = 'chat'")
-    consultations = c.fetchall()
+    # Fetch one page of chat consultations
+    consultations = consultation_page("chat")
+
+    # Fetch the recent message history of every newly opened chat in one query;
+    # chats already on screen only poll for new messages
+    open_chats = [consultation["id"] for consultation in consultations
+                  if st.session_state.get(f"status_{consultation['id']}") == "Available"
+                  and f"chat_history_{consultation['id']}" not in st.session_state]
+    messages = consultation_store.recent_messages(open_chats)
 
-    # Display chat consultations
+    # Actions for each consultation on the page
     for consultation in consultations:
-        st.write(f"Consultation ID: {consultation[0]}")
-        st.write(f"Patient ID: {consultation[1]}")
-        st.write(f"Symptoms: {consultation[3]}")
-        st.write(f"History of Illness: {consultation[4]}")
-        st.write(f"Blood Group: {consultation[5]}")
-        st.write(f"Comments: {consultation[6]}")
-        st.write(f"Status: {consultation[7]}")
-        st.write(f"Doctor Comments: {consultation[8]}")
+        consultation_id = consultation["id"]
+        st.write(f"**Consultation {consultation_id}** ({consultation['status']})")
 
         # Update consultation status and initiate chat
-        new_status = st.selectbox("Update Status", ["Processing", "Available", "Unavailable"], key=f"status_{consultation[0]}")
-        doctor_comments = st.text_area("Doctor Comments", key=f"comments_{consultation[0]}")
-
-        if st.button("Update", key=f"update_{consultation[0]}"):
-            c.execute("UPDATE consultations SET status = ?, doctor_comments = ? WHERE id = ?",
-                      (new_status, doctor_comments, consultation[0]))
-            conn.commit()
-            st.success("Consultation updated successfully!")
+        new_status = ui.consultation_actions(consultation_id)
 
         if new_status == "Available":
             # Real-time chat functionality
-            chat_section = st.empty()
-            message_input = st.text_input("Enter your message", key=f"message_{consultation[0]}")
-            send_button = st.button("Send", key=f"send_{consultation[0]}")
-
-            # Fetch chat messages for the consultation
-            c.execute("SELECT * FROM chat_messages WHERE consultation_id = ?", (consultation[0],))
-            chat_messages = c.fetchall()
-
-            # Display chat messages
-            with chat_section.container():
-                for message in chat_messages:
-                    st.write(f"{message[2]}: {message[3]} ({message[4]})")
-
-            # Send chat message
-            if send_button:
-                if message_input:
-                    c.execute("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) VALUES (?, ?, ?, datetime('now'))",
-                              (consultation[0], "Doctor", message_input))
-                    conn.commit()
-                    st.experimental_rerun()
+            ui.chat_thread(consultation_id, "Doctor", messages.get(consultation_id))
 
         st.write("---")
 
@@ -172,72 +197,158 @@ def chat_consultation():
 def video_consultation():
     st.subheader("Video Consultations")
 
-    # Fetch video consultations
-    c.execute("SELECT * FROM consultations WHERE consultation_type = 'video'")
-    consultations = c.fetchall()
+    # Fetch one page of video consultations
+    consultations = consultation_page("video")
+    recordings = media.list_recordings(consultation["id"] for consultation in consultations)
 
-    # Display video consultations
+    # Actions for each consultation on the page
     for consultation in consultations:
-        st.write(f"Consultation ID: {consultation[0]}")
-        st.write(f"Patient ID: {consultation[1]}")
-        st.write(f"Symptoms: {consultation[3]}")
-        st.write(f"History of Illness: {consultation[4]}")
-        st.write(f"Blood Group: {consultation[5]}")
-        st.write(f"Comments: {consultation[6]}")
-        st.write(f"Status: {consultation[7]}")
-        st.write(f"Doctor Comments: {consultation[8]}")
+        consultation_id = consultation["id"]
+        st.write(f"**Consultation {consultation_id}** ({consultation['status']})")
 
         # Update consultation status and view/record video
-        new_status = st.selectbox("Update Status", ["Processing", "Available", "Unavailable"], key=f"status_{consultation[0]}")
-        doctor_comments = st.text_area("Doctor Comments", key=f"comments_{consultation[0]}")
-
-        if st.button("Update", key=f"update_{consultation[0]}"):
-            c.execute("UPDATE consultations SET status = ?, doctor_comments = ? WHERE id = ?",
-                      (new_status, doctor_comments, consultation[0]))
-            conn.commit()
-            st.success("Consultation updated successfully!")
-
-        # Check if a video exists for the consultation
-        doctor_video_path = f"consultation_{consultation[0]}_doctor.mp4"
-        patient_video_path = f"consultation_{consultation[0]}_patient.mp4"
-
-        if os.path.exists(doctor_video_path):
-            # Display the doctor's video
-            doctor_video_file = open(doctor_video_path, 'rb')
-            doctor_video_bytes = doctor_video_file.read()
-            st.video(doctor_video_bytes)
-
-        if os.path.exists(patient_video_path):
-            # Display the patient's video
-            patient_video_file = open(patient_video_path, 'rb')
-            patient_video_bytes = patient_video_file.read()
-            st.video(patient_video_bytes)
+        ui.consultation_actions(consultation_id)
 
-        # Record and save doctor's video
-        if st.button("Record Video", key=f"record_{consultation[0]}"):
-            # Open the default camera
-            cap = cv2.VideoCapture(0)
-
-            # Define the codec and create VideoWriter object
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(doctor_video_path, fourcc, 20.0, (640, 480))
-
-            # Record the video for 1 minute
-            start_time = cv2.getTickCount()
-            while (cv2.getTickCount() - start_time) / cv2.getTickFrequency() < 60:
-                ret, frame = cap.read()
-                if ret:
-                    out.write(frame)
-                else:
-                    break
+        # Display the doctor's and patient's videos on request
+        ui.consultation_videos(consultation_id, recordings)
 
-            # Release the camera and close the output file
-            cap.release()
-            out.release()
-            st.success("Video recorded successfully!")
+        # Record and save doctor's video
+        ui.recording_controls(consultation_id, "doctor")
 
         st.write("---")
 
+# Queue of unclaimed consultations, most urgent first. Doctors claim the
+# next one in a single atomic update, so several can work the queue at once.
+def triage_queue():
+    st.subheader("Triage")
+    doctor_id = st.session_state.user[0]
+
+    for consultation_type, tab in zip(["chat", "video"], st.tabs(["Chat", "Video"])):
+        with tab:
+            waiting_column, claim_column = st.columns([3, 1])
+            # Claim before counting so the numbers below include this claim
+            if claim_column.button("Claim next", key=f"claim_{consultation_type}"):
+                consultation_id = triage.claim_next(doctor_id, consultation_type)
+                if consultation_id is None:
+                    st.info("The queue is empty.")
+                else:
+                    st.success(f"Consultation {consultation_id} is now assigned to you.")
+            waiting_column.metric("Waiting", triage.queue_length(consultation_type))
+
+            queue = triage.queue(consultation_type)
+            if queue:
+                st.dataframe(queue, hide_index=True, use_container_width=True, column_config={
+                    "id": "Consultation ID",
+                    "patient_id": "Patient ID",
+                    "priority": "Priority",
+                    "created_at": "Submitted",
+                    "symptoms": "Symptoms",
+                })
+
+            # Consultations this doctor claimed and has not closed
+            assigned = triage.doctor_consultations(doctor_id, consultation_type)
+            if assigned:
+                st.write("**Assigned to you**")
+                for consultation in assigned:
+                    details_column, release_column = st.columns([4, 1])
+                    details_column.write(f"Consultation {consultation['id']} ({consultation['status']}, "
+                                         f"priority {consultation['priority']}): {consultation['symptoms']}")
+                    release_column.button("Release", key=f"release_{consultation['id']}",
+                                          on_click=triage.release, args=(consultation["id"],))
+
+# Search snippet as markdown: the text is escaped, the matched words bold
+def snippet_markdown(snippet):
+    escaped = re.sub(r"([\\`*_{}\[\]()#+\-.!|<>~$])", r"\\\1", snippet or "")
+    return escaped.replace(search.MATCH_START, "**").replace(search.MATCH_END, "**")
+
+# Full-text search over consultations and chat history, best matches first
+def search_page():
+    st.subheader("Search")
+    text_column, scope_column, type_column = st.columns([4, 2, 1])
+    text = text_column.text_input("Search for", placeholder="e.g. chest pain")
+    scope = scope_column.radio("In", ["Consultations", "Chat messages"], horizontal=True)
+    consultation_type = type_column.selectbox("Type", ["All", "chat", "video"], disabled=scope != "Consultations")
+    if not search.match_expression(text):
+        return
+
+    # A new search starts again from the first page
+    key = f"search_{scope}_{consultation_type}_{text}"
+    if scope == "Consultations":
+        results = paginate(key, lambda cursor: search.search_consultations(
+            text, None if consultation_type == "All" else consultation_type, cursor=cursor))
+        for result in results:
+            st.markdown(f"**Consultation {result['id']}** · {result['consultation_type']} · {result['status']} · "
+                        f"patient {result['patient_id']} · {result['created_at'] or ''}  \n"
+                        f"{snippet_markdown(result['snippet'])}")
+    else:
+        results = paginate(key, lambda cursor: search.search_messages(text, cursor=cursor))
+        for result in results:
+            st.markdown(f"**Consultation {result['consultation_id']}** · {result['sender']} · "
+                        f"{result['timestamp']}  \n{snippet_markdown(result['snippet'])}")
+    if not results:
+        st.info("Nothing matches this search.")
+
+# Retention policy, an on-demand archival run and lookups in the archive
+def archive_page():
+    st.subheader("Archive")
+    st.write(f"Closed consultations are archived {archive.CLOSED_RETENTION_DAYS} days after submission, "
+             f"all others after {archive.MAX_AGE_DAYS} days. Their chat history goes to compressed Parquet "
+             f"files in {archive.ARCHIVE_DIR} and their videos to {archive.COLD_VIDEO_DIR}.")
+    archived_column, due_column, run_column = st.columns([2, 2, 1])
+    archived_column.metric("Archived consultations", archive.archived_count())
+    due_column.metric("Due for archiving", archive.due_count())
+    # Runs before the numbers above are drawn, so they include this run
+    run_column.button("Archive now", on_click=lambda: st.session_state.__setitem__("archive_run", archive.run()))
+    if "archive_run" in st.session_state:
+        totals = st.session_state.pop("archive_run")
+        st.success(f"Archived {totals['consultations']} consultations, {totals['messages']} messages and "
+                   f"{totals['videos']} video files in {totals['seconds']}s; "
+                   f"{totals['freed_bytes'] / 1e6:.1f} MB freed.")
+
+    if not archive.incremental():
+        st.caption("Freed space is reused but not returned to the disk until `python -m healthcare.archive "
+                   "--vacuum` has been run once with the apps stopped.")
+
+    consultation_id = st.number_input("Open archived consultation", min_value=0, step=1)
+    if consultation_id:
+        ui.archived_consultation(int(consultation_id))
+
+# Timings, query cache and database contention, with on-demand profiling
+def diagnostics():
+    st.subheader("Diagnostics")
+
+    # This app's live numbers, or the last export of the other one
+    sources = {"admin (live)": metrics.snapshot()}
+    for app, exported in metrics.load_exported().items():
+        if app != "admin":
+            sources[f"{app} (exported {time.strftime('%H:%M:%S', time.localtime(exported['written_at']))})"] = exported["pages"]
+    source = st.selectbox("Source", list(sources))
+
+    for page_name, spans in sources[source].items():
+        st.write(f"**{page_name}**")
+        st.dataframe([{"span": name, **{key: value for key, value in summary.items() if key != "buckets"}}
+                      for name, summary in spans.items()], hide_index=True, use_container_width=True)
+
+    st.write("**Query cache**")
+    st.dataframe(cache.stats(), hide_index=True, use_container_width=True)
+    st.write("**Database contention**")
+    st.dataframe([db.stats()], hide_index=True, use_container_width=True)
+    st.write("**Write queue**")
+    st.dataframe([writer.stats()], hide_index=True, use_container_width=True)
+
+    # Profile the next rerun of one page
+    profile_column, button_column = st.columns([3, 1])
+    profile_page = profile_column.selectbox("Page to profile", [f"admin/{choice}" for choice in MENU if choice != "Diagnostics"])
+    button_column.button("Profile its next rerun", on_click=st.session_state.__setitem__,
+                         args=("profile_next_rerun", profile_page))
+    for page_name, profile in metrics.last_profile.items():
+        with st.expander(f"Last profile of {page_name}"):
+            st.caption(profile["path"])
+            st.code(profile["text"])
+
+# Pages of the logged-in admin app
+MENU = ["Dashboard", "Triage", "Chat Consultation", "Video Consultation", "Search", "Archive", "Diagnostics"]
+
 # Main App
 def main():
     st.title("Healthcare Application - Admin")
@@ -249,20 +360,29 @@ def main():
         menu = ["Login", "Signup"]
         choice = st.sidebar.selectbox("Select an option", menu)
 
-        if choice == "Login":
-            admin_login()
-        elif choice == "Signup":
-            admin_signup()
+        with ui.page(f"admin/{choice}"):
+            if choice == "Login":
+                admin_login()
+            elif choice == "Signup":
+                admin_signup()
     else:
-        menu = ["Dashboard", "Chat Consultation", "Video Consultation"]
-        choice = st.sidebar.selectbox("Select an option", menu)
-
-        if choice == "Dashboard":
-            admin_dashboard()
-        elif choice == "Chat Consultation":
-            chat_consultation()
-        elif choice == "Video Consultation":
-            video_consultation()
+        choice = st.sidebar.selectbox("Select an option", MENU)
+
+        with ui.page(f"admin/{choice}"):
+            if choice == "Dashboard":
+                admin_dashboard()
+            elif choice == "Triage":
+                triage_queue()
+            elif choice == "Chat Consultation":
+                chat_consultation()
+            elif choice == "Video Consultation":
+                video_consultation()
+            elif choice == "Search":
+                search_page()
+            elif choice == "Archive":
+                archive_page()
+            elif choice == "Diagnostics":
+                diagnostics()
 
         # Logout button
         if st.sidebar.button("Logout"):
@@ -0,0 +1,158 @@
+# Knowledge base retrieval benchmark
+#
+#   python benchmarks/knowledge_base_benchmark.py --sizes 1000 10000 100000
+#
+# For each corpus size a throwaway database is filled with the labelled
+# questions from kb_queries.jsonl plus synthetic distractors, and every
+# labelled query is run one at a time and as a single batch. Reports
+# queries/sec, p50/p99 latency and recall@k; --min-recall makes the run fail
+# when retrieval quality regresses.
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from healthcare import db, knowledge_base, migrations  # noqa: E402
+
+QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb_queries.jsonl")
+
+TEMPLATES = [
+    "What are the symptoms of {}?",
+    "What causes {}?",
+    "How is {} treated?",
+    "What are the risk factors for {}?",
+    "What are the complications of {}?",
+    "How is {} diagnosed?",
+]
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "su", "to", "vi", "ze", "pha", "dro", "gli", "ter", "mon", "sar"]
+
+
+def load_labelled_queries(path=QUERIES_PATH):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def condition_name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5))) + "itis"
+
+
+def synthetic_questions(count, rng):
+    for _ in range(count):
+        yield rng.choice(TEMPLATES).format(condition_name(rng))
+
+
+def synthetic_query(question, rng):
+    # Drop a word and shuffle the rest, keeping the condition name
+    words = question.rstrip("?").split()
+    condition = words[-1]
+    others = words[:-1]
+    if len(others) > 2:
+        others.pop(rng.randrange(len(others)))
+    rng.shuffle(others)
+    return " ".join(others + [condition])
+
+
+def build_corpus(size, labelled, rng, synthetic_labels):
+    migrations.migrate()
+
+    questions = sorted({row["question"] for row in labelled})
+    knowledge_base.add_entries((question, "") for question in questions)
+
+    distractors = max(size - len(questions), 0)
+    knowledge_base.add_entries((question, "") for question in synthetic_questions(distractors, rng))
+
+    ids = dict(db.query("SELECT question, id FROM knowledge_base"))
+    queries = [(row["query"], ids[row["question"]]) for row in labelled]
+
+    # Extra labels drawn from the synthetic part of the corpus
+    if distractors:
+        sampled = rng.sample(sorted(ids.values())[len(questions):], min(synthetic_labels, distractors))
+        questions_by_id = {entry_id: question for question, entry_id in ids.items()}
+        queries.extend((synthetic_query(questions_by_id[entry_id], rng), entry_id) for entry_id in sampled)
+    return queries
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(size, labelled, k, repeat, synthetic_labels, seed):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        db.configure(os.path.join(directory, "kb.db"))
+        queries = build_corpus(size, labelled, rng, synthetic_labels)
+
+        start = time.perf_counter()
+        index = knowledge_base.KnowledgeBaseIndex.build()
+        build_seconds = time.perf_counter() - start
+
+        texts = [query for query, _ in queries]
+        expected = [entry_id for _, entry_id in queries]
+
+        latencies = []
+        hits = 0
+        for _ in range(repeat):
+            for text, entry_id in queries:
+                start = time.perf_counter()
+                matches = index.search_ids(text, k)
+                latencies.append(time.perf_counter() - start)
+                hits += any(match_id == entry_id for match_id, _ in matches)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            batch_matches = index.search_ids_batch(texts, k)
+        batch_seconds = (time.perf_counter() - start) / repeat
+        batch_hits = sum(any(match_id == entry_id for match_id, _ in matches)
+                         for matches, entry_id in zip(batch_matches, expected))
+        db.configure()
+
+    return {
+        "corpus_size": size,
+        "queries": len(queries),
+        "build_seconds": round(build_seconds, 3),
+        "qps": round(len(latencies) / sum(latencies), 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "batch_qps": round(len(queries) / batch_seconds, 1),
+        f"recall@{k}": round(hits / len(latencies), 3),
+        f"batch_recall@{k}": round(batch_hits / len(queries), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge base retrieval")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--k", type=int, default=knowledge_base.DEFAULT_K)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--synthetic-labels", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", default=QUERIES_PATH, help="labelled JSONL query set")
+    parser.add_argument("--min-recall", type=float, default=None,
+                        help="exit non-zero if recall@k drops below this value")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    labelled = load_labelled_queries(args.queries)
+    failed = False
+    for size in args.sizes:
+        result = run(size, labelled, args.k, args.repeat, args.synthetic_labels, args.seed)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("  ".join(f"{key}={value}" for key, value in result.items()))
+        if args.min_recall is not None and result[f"recall@{args.k}"] < args.min_recall:
+            failed = True
+
+    if failed:
+        sys.exit(f"recall@{args.k} fell below {args.min_recall}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# End-to-end load benchmark for the consultation workflow
+#
+#   python benchmarks/load_benchmark.py --patients 10000 --concurrency 16 --seconds 20
+#   python benchmarks/load_benchmark.py --check load_baseline.json
+#
+# Fills a throwaway database with patients, consultations and chat history,
+# then runs `concurrency` threads that act as patients and doctors: they
+# submit consultations, page through the admin lists, claim consultations
+# from the triage queue, update statuses, open chats, poll and send messages. Every action goes through the same
+# healthcare functions the Streamlit apps call (including the query cache).
+# Reports throughput, latency percentiles per action and SQLite write-lock
+# and connection-pool contention. --check compares against a baseline file
+# and fails when throughput drops or p99 latency grows by more than the
+# tolerance, or when a consultation was claimed by two doctors; --save
+# writes a new baseline. --remote runs everything through a local
+# healthcare.dbserver, the way app replicas reach a shared database.
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from healthcare import auth, cache, consultations, db, dbserver, migrations, triage, users  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_baseline.json")
+
+# Relative frequency of each action in the mix
+ACTIONS = {
+    "submit consultation": 2,
+    "patient consultations": 10,
+    "admin consultation page": 10,
+    "admin patient page": 3,
+    "update status": 3,
+    "claim next": 2,
+    "chat history": 8,
+    "poll messages": 40,
+    "send message": 10,
+}
+
+STATUSES = ["Processing", "Available", "Unavailable"]
+
+
+def fill(patients, consultations_per_patient, messages_per_consultation, rng):
+    migrations.migrate()
+    # One shared hash: signing everybody up through scrypt would dominate the setup
+    password = auth.hash_password("password")
+    db.executemany("INSERT INTO users (username, password, name, age, gender, address, user_type) "
+                   "VALUES (?, ?, ?, ?, 'Other', 'Address', 'patient')",
+                   ((f"patient{number}", password, f"Patient {number}", rng.randint(1, 99))
+                    for number in range(patients)))
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, priority, created_at) "
+                   "VALUES (?, ?, 'Symptoms', ?, ?, datetime('now', ?))",
+                   ((patient_id, rng.choice(["chat", "video"]), rng.choice(STATUSES), rng.randint(0, 10),
+                     f"-{rng.randint(0, 365)} days")
+                    for patient_id in range(1, patients + 1) for _ in range(consultations_per_patient)))
+    consultation_count = patients * consultations_per_patient
+    # Load the symptom scorer now; its one-off import is not part of the steady state
+    triage.urgency("Symptoms")
+    db.executemany("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) "
+                   "VALUES (?, ?, 'Message', datetime('now'))",
+                   ((rng.randint(1, consultation_count), rng.choice(["Patient", "Doctor"]))
+                    for _ in range(consultation_count * messages_per_consultation)))
+    return consultation_count
+
+
+class Worker:
+    def __init__(self, seed, patients, consultation_count):
+        self.rng = random.Random(seed)
+        self.patients = patients
+        self.consultation_count = consultation_count
+        self.last_seen = {}
+        self.claimed = []
+        self.latencies = {action: [] for action in ACTIONS}
+        self.errors = {}
+
+    def act(self, action, doctor_id):
+        rng = self.rng
+        patient_id = rng.randint(1, self.patients)
+        consultation_id = rng.randint(1, self.consultation_count)
+        if action == "submit consultation":
+            consultations.add_consultation(patient_id, rng.choice(["chat", "video"]), "Symptoms", None, None, None)
+        elif action == "patient consultations":
+            consultations.patient_consultations(patient_id, rng.choice(["chat", "video"]))
+        elif action == "admin consultation page":
+            # Mostly the unfiltered first page, sometimes filtered or deeper
+            status = rng.choice([None, None, "Processing"])
+            after_id = rng.choice([None, None, rng.randint(1, self.consultation_count)])
+            consultations.list_consultations(rng.choice(["chat", "video"]), status=status, after_id=after_id)
+        elif action == "admin patient page":
+            users.list_patients(after_id=rng.choice([None, rng.randint(1, self.patients)]))
+        elif action == "claim next":
+            claimed = triage.claim_next(doctor_id, rng.choice(["chat", "video"]))
+            if claimed is not None:
+                self.claimed.append(claimed)
+        elif action == "update status":
+            consultations.update_status(consultation_id, rng.choice(STATUSES), "Doctor comments")
+        elif action == "chat history":
+            page, _ = consultations.list_consultations("chat")
+            consultations.recent_messages(consultation["id"] for consultation in page)
+        elif action == "poll messages":
+            consultation_id = rng.choice(list(self.last_seen) or [consultation_id])
+            messages = consultations.messages_since(consultation_id, self.last_seen.get(consultation_id, 0))
+            if messages:
+                self.last_seen[consultation_id] = messages[-1][0]
+        elif action == "send message":
+            self.last_seen.setdefault(consultation_id, 0)
+            consultations.add_message(consultation_id, rng.choice(["Patient", "Doctor"]), "Message")
+
+    def run(self, deadline, doctor_id):
+        actions, weights = list(ACTIONS), list(ACTIONS.values())
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            start = time.perf_counter()
+            try:
+                self.act(action, doctor_id)
+            except db.sqlite3.OperationalError as error:
+                self.errors[str(error)] = self.errors.get(str(error), 0) + 1
+                continue
+            self.latencies[action].append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "load.db")
+        server = None
+        if args.remote:
+            server, path = dbserver.start(path)
+        db.configure(path, size=args.pool_size)
+        consultation_count = fill(args.patients, args.consultations, args.messages, rng)
+        cache.clear()
+        db.reset_stats()
+
+        workers = [Worker(args.seed + number, args.patients, consultation_count) for number in range(args.concurrency)]
+        deadline = time.perf_counter() + args.seconds
+        threads = [threading.Thread(target=worker.run, args=(deadline, number + 1))
+                   for number, worker in enumerate(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        contention = db.stats()
+        db.configure()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    actions = {}
+    for action in ACTIONS:
+        latencies = [latency for worker in workers for latency in worker.latencies[action]]
+        if latencies:
+            actions[action] = {
+                "count": len(latencies),
+                "p50_ms": round(statistics.median(latencies) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            }
+    errors = {}
+    for worker in workers:
+        for error, count in worker.errors.items():
+            errors[error] = errors.get(error, 0) + count
+
+    claimed = [consultation_id for worker in workers for consultation_id in worker.claimed]
+
+    total = sum(action["count"] for action in actions.values())
+    transactions = contention.get("lock_waits", 0)
+    return {
+        "config": {key: getattr(args, key) for key in ("patients", "consultations", "messages", "concurrency",
+                                                       "pool_size", "seconds", "seed")},
+        "ops_per_sec": round(total / elapsed, 1),
+        "actions": actions,
+        "write_transactions": transactions,
+        "mean_lock_wait_ms": round(contention.get("lock_wait_seconds", 0) / max(transactions, 1) * 1000, 3),
+        "max_lock_wait_ms": round(contention.get("max_lock_wait_seconds", 0) * 1000, 2),
+        "lock_timeouts": contention.get("lock_timeouts", 0),
+        "pool_waits": contention.get("pool_waits", 0),
+        "max_pool_wait_ms": round(contention.get("max_pool_wait_seconds", 0) * 1000, 2),
+        "errors": errors,
+        "double_claims": len(claimed) - len(set(claimed)),
+        "cache": [row for row in cache.stats() if row["hits"] or row["misses"]],
+    }
+
+
+def regressions(result, baseline, tolerance):
+    problems = []
+    if result["errors"]:
+        problems.append(f"errors: {result['errors']}")
+    if result["double_claims"]:
+        problems.append(f"{result['double_claims']} consultations were claimed twice")
+    if result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - tolerance):
+        problems.append(f"throughput {result['ops_per_sec']} ops/s, baseline {baseline['ops_per_sec']}")
+    for action, expected in baseline["actions"].items():
+        measured = result["actions"].get(action)
+        if measured and measured["p99_ms"] > expected["p99_ms"] * (1 + tolerance):
+            problems.append(f"{action} p99 {measured['p99_ms']} ms, baseline {expected['p99_ms']} ms")
+    return problems
+
+
+def print_report(result):
+    print(f"{result['ops_per_sec']} ops/s with {result['config']['concurrency']} threads")
+    for action, numbers in result["actions"].items():
+        print(f"  {action:24} " + "  ".join(f"{key}={value}" for key, value in numbers.items()))
+    print("  " + "  ".join(f"{key}={result[key]}" for key in ("write_transactions", "mean_lock_wait_ms",
+                                                              "max_lock_wait_ms", "lock_timeouts", "pool_waits",
+                                                              "max_pool_wait_ms", "double_claims")))
+    for row in result["cache"]:
+        print(f"  cache {row['query']}: hit_rate={row['hit_rate']}")
+    if result["errors"]:
+        print(f"  errors: {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the consultation workflow")
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--consultations", type=int, default=5, help="per patient")
+    parser.add_argument("--messages", type=int, default=10, help="per consultation")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=db.POOL_SIZE)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--remote", action="store_true", help="go through a local database server")
+    parser.add_argument("--check", nargs="?", const=BASELINE_PATH,
+                        help="fail on regressions against this baseline (settings are taken from it)")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative drop in throughput / growth in p99 for --check")
+    parser.add_argument("--save", nargs="?", const=BASELINE_PATH, help="write the result as the new baseline")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.check:
+        with open(args.check, encoding="utf-8") as file:
+            baseline = json.load(file)
+        for key, value in baseline["config"].items():
+            setattr(args, key, value)
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump({key: result[key] for key in ("config", "ops_per_sec", "actions")}, file, indent=2)
+            file.write("\n")
+
+    if baseline is not None:
+        problems = regressions(result, baseline, args.tolerance)
+        if problems:
+            sys.exit("Regressions against the baseline:\n  " + "\n  ".join(problems))
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Login latency benchmark
+#
+#   python benchmarks/login_benchmark.py --costs 4096 16384 32768 --concurrency 1 8 32
+#
+# For each scrypt cost (N) a throwaway database gets users hashed at that
+# cost, then `concurrency` threads sign in at once, over and over, through
+# auth.authenticate. Reports logins/sec and p50/p99 latency, i.e. what a
+# burst of simultaneous sign-ins costs at each setting, and the memory each
+# hash needs while it runs.
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from healthcare import auth, db, migrations  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(cost, concurrency, logins_per_thread, directory):
+    auth.SCRYPT_N = cost
+    db.configure(os.path.join(directory, f"login_{cost}_{concurrency}.db"), size=concurrency)
+    migrations.migrate()
+    db.executemany("INSERT INTO users (username, password, name, age, gender, address, user_type) "
+                   "VALUES (?, ?, 'User', 30, 'Other', 'Address', 'patient')",
+                   [(f"user{number}", auth.hash_password(PASSWORD)) for number in range(concurrency)])
+
+    latencies = []
+    failures = []
+    start_together = threading.Barrier(concurrency)
+
+    def sign_in(number):
+        start_together.wait()
+        for _ in range(logins_per_thread):
+            start = time.perf_counter()
+            user = auth.authenticate(f"user{number}", PASSWORD, "patient")
+            latencies.append(time.perf_counter() - start)
+            if user is None:
+                failures.append(number)
+
+    threads = [threading.Thread(target=sign_in, args=(number,)) for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    db.configure()
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} logins failed")
+    return {
+        "scrypt_n": cost,
+        "memory_mb": round(128 * cost * auth.SCRYPT_R * auth.SCRYPT_P / 2 ** 20, 1),
+        "concurrency": concurrency,
+        "logins_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login latency at each password hashing cost")
+    parser.add_argument("--costs", type=int, nargs="+", default=[2 ** 12, 2 ** 14, 2 ** 15])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--logins", type=int, default=10, help="sign-ins per thread")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for cost in args.costs:
+            for concurrency in args.concurrency:
+                result = run(cost, concurrency, args.logins, directory)
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print("  ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
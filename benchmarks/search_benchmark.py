@@ -0,0 +1,121 @@
+# Full-text search benchmark
+#
+#   python benchmarks/search_benchmark.py --messages 1000000
+#
+# Fills a throwaway database with consultations and synthetic chat messages
+# (so the FTS5 indexes are built by the same triggers the apps rely on),
+# then runs a set of searches of different selectivity through
+# healthcare.search, bypassing the query cache. Reports the insert rate
+# with the triggers in place, the index size, and p50/p99 latency per
+# search, next to one run of the LIKE '%...%' scan it replaces. Matches are
+# ranked search.RANK_WINDOW at a time, so broad searches should cost about
+# the same at any table size.
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from healthcare import db, migrations, search  # noqa: E402
+
+COMMON_WORDS = ("the i have my it is and a to of for in been since day days feel feeling still now "
+                "more after when pain not but with at night morning doctor thank you yes no").split()
+SYMPTOM_WORDS = ("fever cough headache nausea dizziness rash fatigue chest breath throat stomach back "
+                 "swelling bleeding vomiting diarrhea insomnia anxiety itching sneezing wheezing "
+                 "numbness tingling cramps chills sweating palpitations migraine allergy infection").split()
+RARE_WORDS = [f"drug{number}" for number in range(5000)]
+
+# Searches from broad to narrow
+QUERIES = {
+    "common word": "pain",
+    "symptom": "fever",
+    "two words": "chest pain",
+    "three words": "fever cough night",
+    "prefix": "palpit*",
+    "rare word": "drug1234",
+    "no match": "appendectomy",
+}
+
+BATCH_SIZE = 50000
+
+
+def message(rng):
+    words = rng.choices(COMMON_WORDS, k=rng.randint(4, 12)) + rng.choices(SYMPTOM_WORDS, k=rng.randint(0, 3))
+    if rng.random() < 0.01:
+        words.append(rng.choice(RARE_WORDS))
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def fill(consultations, messages, rng):
+    migrations.migrate()
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, 'chat', ?, 'Available', datetime('now'))",
+                   ((message(rng),) for _ in range(consultations)))
+    start = time.perf_counter()
+    for offset in range(0, messages, BATCH_SIZE):
+        db.executemany("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) "
+                       "VALUES (?, 'Patient', ?, datetime('now'))",
+                       ((rng.randint(1, consultations), message(rng))
+                        for _ in range(min(BATCH_SIZE, messages - offset))))
+    return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "search.db")
+        db.configure(path)
+        insert_seconds = fill(args.consultations, args.messages, rng)
+        print(f"{args.messages} messages inserted in {insert_seconds:.1f}s "
+              f"({args.messages / insert_seconds:.0f}/s with the FTS triggers)")
+        start = time.perf_counter()
+        search.optimize()
+        print(f"index optimized in {time.perf_counter() - start:.1f}s, "
+              f"database {os.path.getsize(path) / 1e6:.0f} MB")
+
+        # Straight to the queries, not the cached results
+        search_messages = search.search_messages.__wrapped__
+        search_consultations = search.search_consultations.__wrapped__
+        for name, text in QUERIES.items():
+            latencies = []
+            for repeat in range(args.repeat):
+                start = time.perf_counter()
+                rows, _ = search_messages(text, cursor=(search.MAX_ROWID, (repeat % 3) * search.PAGE_SIZE))
+                latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            search_consultations(text)
+            consultation_ms = (time.perf_counter() - start) * 1000
+
+            line = (f"  {name:12} {text!r:22} p50={statistics.median(latencies) * 1000:.2f}ms "
+                    f"p99={percentile(latencies, 0.99) * 1000:.2f}ms consultations={consultation_ms:.2f}ms")
+            if args.like:
+                start = time.perf_counter()
+                # Ranking needs every match, so the scan cannot stop early
+                db.query("SELECT id, message FROM chat_messages WHERE message LIKE ?", (f"%{text.rstrip('*')}%",))
+                line += f" like={(time.perf_counter() - start) * 1000:.1f}ms"
+            print(line)
+        db.configure()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full-text search over chat messages")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--consultations", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=50, help="runs of each search")
+    parser.add_argument("--no-like", dest="like", action="store_false", help="skip the LIKE comparison")
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
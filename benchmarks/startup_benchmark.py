@@ -0,0 +1,123 @@
+# App startup benchmark
+#
+#   python benchmarks/startup_benchmark.py --runs 5
+#
+# Each scenario runs one of the Streamlit apps headless (streamlit.testing)
+# in a fresh interpreter against a throwaway database: the first run is the
+# cold start, including every import the script pulls in, and the runs after
+# it are what each user interaction costs. Also lists which heavy libraries
+# the page ended up importing.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HEAVY_MODULES = ["cv2", "sklearn", "scipy", "pandas", "requests", "bs4", "joblib"]
+
+# (name, app, logged in, page picked from the sidebar after the first run)
+SCENARIOS = [
+    ("patient login", "patient", False, None),
+    ("patient chat", "patient", True, None),
+    ("patient video", "patient", True, "Video Consultations"),
+    ("patient knowledge base", "patient", True, "Knowledge Base"),
+    ("admin login", "admin", False, None),
+    ("admin dashboard", "admin", True, None),
+    ("admin video", "admin", True, "Video Consultation"),
+]
+
+PATIENT = (1, "patient", "password", "Patient", 30, "Female", None, "Address", "patient")
+ADMIN = (2, "doctor", "password", "Doctor", 40, "Male", None, "Address", "admin")
+
+
+def prepare_database(path):
+    from healthcare import db, migrations
+
+    db.configure(path)
+    migrations.migrate()
+    db.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [PATIENT, ADMIN])
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, ?, 'Cough', 'Available', datetime('now'))", [("chat",), ("video",)])
+    db.configure()
+
+
+def child(app, logged_in, page, reruns):
+    # Runs inside the fresh interpreter
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(ROOT)
+    at = AppTest.from_file(os.path.join(ROOT, f"{app}.py.py"), default_timeout=120)
+    if logged_in:
+        at.session_state.logged_in = True
+        at.session_state.user = PATIENT if app == "patient" else ADMIN
+
+    start = time.perf_counter()
+    at.run()
+    if page:
+        at.sidebar.selectbox[0].select(page).run()
+    cold_seconds = time.perf_counter() - start
+
+    rerun_seconds = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        rerun_seconds.append(time.perf_counter() - start)
+
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return {
+        "cold_ms": cold_seconds * 1000,
+        "rerun_ms": statistics.median(rerun_seconds) * 1000,
+        "heavy_modules": [module for module in HEAVY_MODULES if module in sys.modules],
+    }
+
+
+def run(scenario, runs, reruns, directory):
+    name, app, logged_in, page = scenario
+    results = []
+    for _ in range(runs):
+        run_directory = tempfile.mkdtemp(dir=directory)
+        database = os.path.join(run_directory, "healthcare.db")
+        prepare_database(database)
+        env = dict(os.environ, HEALTHCARE_DB=database, KB_INDEX_PATH=os.path.join(run_directory, "kb_index.joblib"))
+        output = subprocess.run([sys.executable, __file__, "--child", app, str(logged_in), page or "",
+                                 str(reruns)], env=env, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    return {
+        "scenario": name,
+        "cold_ms": round(statistics.median(result["cold_ms"] for result in results), 1),
+        "rerun_ms": round(statistics.median(result["rerun_ms"] for result in results), 1),
+        "heavy_modules": ",".join(results[0]["heavy_modules"]) or "-",
+    }
+
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        app, logged_in, page, reruns = sys.argv[2:6]
+        print(json.dumps(child(app, logged_in == "True", page or None, int(reruns))))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark Streamlit app start-up and rerun cost")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per scenario")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in SCENARIOS:
+            result = run(scenario, args.runs, args.reruns, directory)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print("  ".join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Write path benchmark: commit per click against the write-behind queue
+#
+#   python benchmarks/write_benchmark.py --concurrency 1 8 32 --writes 2000
+#
+# Runs the same write mix (new consultations, status updates, chat messages,
+# all through healthcare.consultations) against a fresh database in each of
+# these modes:
+#
+#   direct/NORMAL       every write its own transaction, as before the queue
+#   direct/FULL         the same, with a sync on every commit
+#   write-behind/FULL   batched by healthcare.writer, a sync per batch
+#   write-behind/NORMAL batched, no sync on commit
+#
+# and reports writes per second, p50/p99 latency until the write was
+# acknowledged, and the number of transactions it took. The database is
+# created next to this file unless --directory says otherwise, so syncs hit
+# a real disk rather than a RAM-backed temp directory.
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from healthcare import cache, consultations, db, migrations, writer  # noqa: E402
+
+MODES = {
+    "direct/NORMAL": (False, "NORMAL"),
+    "direct/FULL": (False, "FULL"),
+    "write-behind/FULL": (True, "FULL"),
+    "write-behind/NORMAL": (True, "NORMAL"),
+}
+
+# Relative frequency of each write in the mix
+WRITES = {"submit consultation": 1, "update status": 2, "send message": 7}
+
+STATUSES = ["Processing", "Available", "Unavailable"]
+
+SEED_CONSULTATIONS = 1000
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def worker(seed, writes, latencies, errors):
+    rng = random.Random(seed)
+    names = list(WRITES)
+    weights = list(WRITES.values())
+    for _ in range(writes):
+        action = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            if action == "submit consultation":
+                consultations.add_consultation(rng.randint(1, 100), "chat", "Symptoms", None, None, None, priority=0)
+            elif action == "update status":
+                consultations.update_status(rng.randint(1, SEED_CONSULTATIONS), rng.choice(STATUSES), "Comments")
+            else:
+                consultations.add_message(rng.randint(1, SEED_CONSULTATIONS), "Patient", "Message")
+        except Exception as error:
+            errors.append(repr(error))
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def run_mode(directory, mode, concurrency, writes, delay=None):
+    enabled, synchronous = MODES[mode]
+    path = os.path.join(directory, f"write-{mode.replace('/', '-')}-{concurrency}.db")
+    db.SYNCHRONOUS = synchronous
+    db.configure(path, size=concurrency + 1)
+    writer.configure(enabled=enabled, max_delay=delay, synchronous=synchronous)
+    migrations.migrate()
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, 'chat', 'Symptoms', 'Processing', datetime('now'))",
+                   ((),) * SEED_CONSULTATIONS)
+    cache.clear()
+    db.reset_stats()
+
+    latencies = []
+    errors = []
+    per_thread = writes // concurrency
+    threads = [threading.Thread(target=worker, args=(number, per_thread, latencies, errors))
+               for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    transactions = writer.stats().get("batches", 0) if enabled else db.stats().get("lock_waits", 0)
+    writer.configure()
+    db.configure()
+    return {
+        "writes_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else 0,
+        "transactions": transactions,
+        "writes": len(latencies),
+        "errors": errors,
+    }
+
+
+def run(args):
+    directory = args.directory or os.path.dirname(os.path.abspath(__file__))
+    synchronous = db.SYNCHRONOUS
+    with tempfile.TemporaryDirectory(dir=directory) as temporary:
+        for concurrency in args.concurrency:
+            print(f"concurrency {concurrency}, {args.writes} writes")
+            for mode in args.modes:
+                result = run_mode(temporary, mode, concurrency, args.writes, args.delay)
+                print(f"  {mode:20} {result['writes_per_second']:8.0f} writes/s  p50={result['p50_ms']:.2f}ms "
+                      f"p99={result['p99_ms']:.2f}ms  {result['transactions']} transactions"
+                      f"{'  errors=' + str(len(result['errors'])) if result['errors'] else ''}")
+    db.SYNCHRONOUS = synchronous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark commit per click against the write-behind queue")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--writes", type=int, default=2000, help="writes per mode and concurrency level")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--delay", type=float, help="seconds the writer waits to fill a batch, see writer.MAX_DELAY")
+    parser.add_argument("--directory", help="where the throwaway databases are created")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Shared code for the admin and patient Streamlit apps
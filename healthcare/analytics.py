@@ -0,0 +1,153 @@
+import argparse
+import io
+import os
+
+from healthcare import cache, db, migrations
+
+# Summary tables kept by the triggers of migration 8. Dashboard reads touch
+# only these, a few rows per day, however large the base tables grow.
+ROLLUP_TABLES = ("consultation_stats", "response_stats", "message_stats", "patient_stats")
+
+AGE_GROUPS = ("0-17", "18-29", "30-44", "45-64", "65+")
+
+# Days shown on the dashboard by default
+DEFAULT_DAYS = 30
+
+
+def _since(days):
+    return db.query_one("SELECT date('now', ?)", (f"-{days - 1} days",))[0]
+
+
+@cache.cached("consultations")
+def consultations_per_day(days=DEFAULT_DAYS):
+    rows = db.query('''SELECT day, consultation_type, SUM(consultations) FROM consultation_stats
+                       WHERE day >= ? GROUP BY day, consultation_type ORDER BY day''', (_since(days),))
+    return [{"day": day, "consultation_type": consultation_type, "consultations": count}
+            for day, consultation_type, count in rows]
+
+
+@cache.cached("consultations")
+def status_totals(days=DEFAULT_DAYS):
+    # Current status of the consultations submitted in the period
+    rows = db.query('''SELECT consultation_type, status, SUM(consultations) FROM consultation_stats
+                       WHERE day >= ? GROUP BY consultation_type, status''', (_since(days),))
+    return [{"consultation_type": consultation_type, "status": status, "consultations": count}
+            for consultation_type, status, count in rows]
+
+
+@cache.cached("consultations")
+def response_times(days=DEFAULT_DAYS):
+    # Minutes from submission until a doctor first made a consultation available
+    rows = db.query('''SELECT day, consultation_type, responses, total_seconds / responses / 60, max_seconds / 60
+                       FROM response_stats WHERE day >= ? ORDER BY day''', (_since(days),))
+    return [{"day": day, "consultation_type": consultation_type, "responses": responses,
+             "mean_minutes": round(mean, 1), "max_minutes": round(longest, 1)}
+            for day, consultation_type, responses, mean, longest in rows]
+
+
+@cache.cached("chat_messages")
+def message_activity(days=DEFAULT_DAYS):
+    rows = db.query('''SELECT day, messages, conversations FROM message_stats
+                       WHERE day >= ? ORDER BY day''', (_since(days),))
+    return [{"day": day, "messages": messages, "conversations": conversations} for day, messages, conversations in rows]
+
+
+@cache.cached("users")
+def patient_mix():
+    rows = db.query("SELECT age_group, gender, patients FROM patient_stats WHERE patients > 0")
+    order = {age_group: position for position, age_group in enumerate(AGE_GROUPS)}
+    return sorted(({"age_group": age_group, "gender": gender, "patients": patients}
+                   for age_group, gender, patients in rows), key=lambda row: (order[row["age_group"]], row["gender"]))
+
+
+def overview(days=DEFAULT_DAYS):
+    # Headline numbers for the period
+    totals = status_totals(days)
+    consultations = sum(row["consultations"] for row in totals)
+    waiting = sum(row["consultations"] for row in totals if row["status"] == "Processing")
+    responses = response_times(days)
+    responded = sum(row["responses"] for row in responses)
+    activity = message_activity(days)
+    conversations = sum(row["conversations"] for row in activity)
+    return {
+        "consultations": consultations,
+        "waiting": waiting,
+        "mean_response_minutes": round(sum(row["mean_minutes"] * row["responses"] for row in responses) / responded, 1)
+        if responded else None,
+        "messages_per_conversation": round(sum(row["messages"] for row in activity) / conversations, 1)
+        if conversations else None,
+        "patients": sum(row["patients"] for row in patient_mix()),
+    }
+
+
+def rebuild():
+    # Recount the rollups from the base tables, e.g. after editing the
+    # database by hand. Response times cannot be recounted before migration 8
+    # recorded first_available_at, and counts of deleted rows are lost.
+    with db.transaction() as conn:
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute('''INSERT INTO consultation_stats
+                        SELECT COALESCE(date(created_at), date('now')), consultation_type, status, COUNT(*)
+                        FROM consultations GROUP BY 1, 2, 3''')
+        conn.execute('''INSERT INTO response_stats
+                        SELECT date(first_available_at), consultation_type, COUNT(*), SUM(seconds), MAX(seconds)
+                        FROM (SELECT first_available_at, consultation_type,
+                                     (julianday(first_available_at) - julianday(created_at)) * 86400 AS seconds
+                              FROM consultations WHERE first_available_at IS NOT NULL AND created_at IS NOT NULL)
+                        GROUP BY 1, 2''')
+        conn.execute('''INSERT INTO message_stats
+                        SELECT COALESCE(date(timestamp), date('now')), COUNT(*), SUM(first)
+                        FROM (SELECT timestamp, id = MIN(id) OVER (PARTITION BY consultation_id) AS first
+                              FROM chat_messages)
+                        GROUP BY 1''')
+        conn.execute(f'''INSERT INTO patient_stats
+                         SELECT {migrations.AGE_GROUP.format(row="users")}, gender, COUNT(*) FROM users
+                         WHERE user_type = 'patient' GROUP BY 1, 2''')
+    cache.invalidate("consultations", "chat_messages", "users")
+
+
+def parquet_bytes(rows):
+    # A list of dicts as a Parquet file, for download buttons
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist(rows), buffer)
+    return buffer.getvalue()
+
+
+def export(directory):
+    # Every rollup table as <directory>/<table>.parquet; returns the paths
+    from healthcare import transfer
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for table in ROLLUP_TABLES:
+        path = os.path.join(directory, f"{table}.parquet")
+        transfer.export_table(table, path)
+        paths.append(path)
+    return paths
+
+
+# python -m healthcare.analytics rebuild|export [directory] [--database path]
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard rollups")
+    parser.add_argument("command", choices=["rebuild", "export"])
+    parser.add_argument("directory", nargs="?", default="analytics", help="where export writes the Parquet files")
+    parser.add_argument("--database", help="defaults to HEALTHCARE_DB")
+    args = parser.parse_args()
+
+    if args.database:
+        db.configure(args.database)
+    migrations.migrate()
+    if args.command == "rebuild":
+        rebuild()
+        print(f"Rebuilt {', '.join(ROLLUP_TABLES)}")
+    else:
+        for path in export(args.directory):
+            print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
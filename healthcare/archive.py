@@ -0,0 +1,299 @@
+import argparse
+import io
+import os
+import time
+import uuid
+
+from healthcare import cache, db, media, migrations, search, storage, transfer
+
+# Archived rows are kept as zstd-compressed Parquet in the media store, one
+# directory per table and submission month:
+# <ARCHIVE_DIR>/<table>/<YYYY-MM>/part-*.parquet
+ARCHIVE_DIR = os.environ.get("HEALTHCARE_ARCHIVE_DIR", "archive")
+# Videos of archived consultations move here, one directory per month
+COLD_VIDEO_DIR = os.environ.get("HEALTHCARE_COLD_VIDEO_DIR", os.path.join(ARCHIVE_DIR, "videos"))
+COMPRESSION = "zstd"
+
+# Retention policy: closed (Unavailable) consultations are archived this many
+# days after submission, all other consultations after MAX_AGE_DAYS
+CLOSED_RETENTION_DAYS = int(os.environ.get("HEALTHCARE_CLOSED_RETENTION_DAYS", "30"))
+MAX_AGE_DAYS = int(os.environ.get("HEALTHCARE_MAX_AGE_DAYS", "365"))
+
+# Consultations moved per transaction, so the write lock is only held briefly
+BATCH_SIZE = 500
+
+# Tables whose rows follow their consultation into the archive, and the
+# column that ties them to it
+ARCHIVED_TABLES = {"consultations": "id", "chat_messages": "consultation_id", "recordings": "consultation_id"}
+
+INDEX_COLUMNS = ("id", "patient_id", "consultation_type", "status", "created_at", "partition", "archived_at")
+
+
+def partition(created_at):
+    # Submission month, e.g. "2024-03"
+    return created_at[:7] if created_at else "unknown"
+
+
+def candidates(closed_days=CLOSED_RETENTION_DAYS, max_age_days=MAX_AGE_DAYS, limit=BATCH_SIZE):
+    # Ids of consultations the policy says should be archived, found through
+    # the created_at index
+    return [row[0] for row in db.query('''SELECT id FROM consultations
+                                          WHERE created_at < datetime('now', ?)
+                                          AND (status = 'Unavailable' OR created_at < datetime('now', ?))
+                                          LIMIT ?''', (f"-{closed_days} days", f"-{max_age_days} days", limit))]
+
+
+@cache.cached("consultations")
+def due_count(closed_days=CLOSED_RETENTION_DAYS, max_age_days=MAX_AGE_DAYS):
+    # How many consultations candidates() would return without a limit
+    return db.query_one('''SELECT COUNT(*) FROM consultations
+                           WHERE created_at < datetime('now', ?)
+                           AND (status = 'Unavailable' OR created_at < datetime('now', ?))''',
+                        (f"-{closed_days} days", f"-{max_age_days} days"))[0]
+
+
+def _rows(conn, table, consultation_ids):
+    columns = transfer.table_columns(table)
+    placeholders = ", ".join("?" * len(consultation_ids))
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {ARCHIVED_TABLES[table]} IN ({placeholders})",
+                          consultation_ids)
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def _contents(rows):
+    # Everything stored for each consultation, to tell whether it changed
+    found = {}
+    for table, table_rows in rows.items():
+        for row in table_rows:
+            found.setdefault(row[ARCHIVED_TABLES[table]], set()).add((table, *row.values()))
+    return found
+
+
+def _write_part(table, partition_name, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = os.path.join(ARCHIVE_DIR, table, partition_name, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+    schema = transfer.parquet_schema(table, list(rows[0]))
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema), buffer, compression=COMPRESSION)
+    # The store never shows half an object
+    storage.get_store().put(path, buffer.getvalue())
+    return path
+
+
+def _cold_copy(path, partition_name):
+    # Copy a video to cold storage and return its new path; the hot copy is
+    # only removed once its rows are gone from the hot tables
+    destination = os.path.join(COLD_VIDEO_DIR, partition_name, os.path.basename(path))
+    storage.get_store().copy(path, destination)
+    return destination
+
+
+def archive_batch(consultation_ids):
+    # Move these consultations, their messages and recordings to the archive.
+    # Videos are copied and part files written first, without the write
+    # lock. One short transaction then deletes the rows, skipping any
+    # consultation that changed in the meantime (a later run archives it),
+    # and the copies are removed again if it fails. A part file that repeats
+    # rows is harmless: readers keep the last copy of each row.
+    store = storage.get_store()
+    with db.connection() as conn:
+        rows = {table: _rows(conn, table, consultation_ids) for table in ARCHIVED_TABLES}
+    contents = _contents(rows)
+    partitions = {consultation["id"]: partition(consultation["created_at"]) for consultation in rows["consultations"]}
+
+    # Transcoded recordings and raw recordings that were never transcoded,
+    # by consultation
+    hot_videos = {}
+    cold_videos = {}
+    recorded = {(recording["consultation_id"], recording["role"]) for recording in rows["recordings"]}
+    for recording in rows["recordings"]:
+        consultation_id = recording["consultation_id"]
+        for column in ("path", "preview_path", "thumbnail_path"):
+            if recording[column] and store.exists(recording[column]):
+                hot_videos.setdefault(consultation_id, []).append(recording[column])
+                recording[column] = _cold_copy(recording[column], partitions[consultation_id])
+                cold_videos.setdefault(consultation_id, []).append(recording[column])
+    for consultation_id in partitions:
+        for role in ("doctor", "patient"):
+            path = media.video_path(consultation_id, role)
+            if not store.exists(path):
+                continue
+            hot_videos.setdefault(consultation_id, []).append(path)
+            # A raw file left next to its transcoded copy is simply removed
+            if (consultation_id, role) not in recorded:
+                rows["recordings"].append({"consultation_id": consultation_id, "role": role,
+                                           "path": _cold_copy(path, partitions[consultation_id])})
+                cold_videos.setdefault(consultation_id, []).append(rows["recordings"][-1]["path"])
+
+    parts = []
+    try:
+        for table, table_rows in rows.items():
+            by_partition = {}
+            for row in table_rows:
+                by_partition.setdefault(partitions[row[ARCHIVED_TABLES[table]]], []).append(row)
+            for partition_name, partition_rows in by_partition.items():
+                parts.append(_write_part(table, partition_name,
+                                         [{column: row.get(column) for column in transfer.table_columns(table)}
+                                          for row in partition_rows]))
+
+        with db.transaction() as conn:
+            current = _contents({table: _rows(conn, table, consultation_ids) for table in ARCHIVED_TABLES})
+            archived = [consultation_id for consultation_id in partitions
+                        if current.get(consultation_id) == contents[consultation_id]]
+            if archived:
+                conn.executemany('''INSERT OR REPLACE INTO archived_consultations
+                                    VALUES (?, ?, ?, ?, ?, ?, datetime('now'))''',
+                                 [(consultation["id"], consultation["patient_id"], consultation["consultation_type"],
+                                   consultation["status"], consultation["created_at"], partitions[consultation["id"]])
+                                  for consultation in rows["consultations"] if consultation["id"] in archived])
+                placeholders = ", ".join("?" * len(archived))
+                for table, column in ARCHIVED_TABLES.items():
+                    conn.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", archived)
+    except BaseException:
+        for path in parts + [path for paths in cold_videos.values() for path in paths]:
+            store.delete(path)
+        raise
+
+    # The hot copies of what was archived, the cold copies of what was not
+    archived = set(archived)
+    for consultation_id in partitions:
+        for path in (hot_videos if consultation_id in archived else cold_videos).get(consultation_id, []):
+            store.delete(path)
+    cache.invalidate("consultations", "chat_messages", "recordings", "archive", "media")
+    return {"consultations": len(archived),
+            "messages": sum(message["consultation_id"] in archived for message in rows["chat_messages"]),
+            "videos": sum(len(hot_videos.get(consultation_id, [])) for consultation_id in archived)}
+
+
+def incremental():
+    # True once the database frees pages with incremental_vacuum
+    return db.query_one("PRAGMA auto_vacuum")[0] == 2
+
+
+def compact():
+    # Give the space of archived rows back and refresh the planner statistics.
+    # Safe on the live database: pages are only freed incrementally. A
+    # database created before auto_vacuum was turned on keeps its free pages
+    # for reuse until vacuum() converts it.
+    search.optimize()
+    with db.connection() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # Frees one page per step, so it has to be run to the end
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+    return max(before - after, 0) * page_size
+
+
+def vacuum(path):
+    # Rebuild a database file with one full VACUUM, which also switches it to
+    # incremental auto_vacuum. It rewrites the whole file under the write
+    # lock, so run it with the apps stopped (python -m healthcare.archive
+    # --vacuum), on the database host. Returns the bytes freed.
+    conn = db.connect(path)
+    try:
+        before = os.path.getsize(path)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return max(before - os.path.getsize(path), 0)
+
+
+def run(closed_days=CLOSED_RETENTION_DAYS, max_age_days=MAX_AGE_DAYS, batch_size=BATCH_SIZE, compact_after=True):
+    # Archive everything the policy selects, batch by batch, then compact
+    start = time.perf_counter()
+    totals = {"consultations": 0, "messages": 0, "videos": 0}
+    while True:
+        consultation_ids = candidates(closed_days, max_age_days, batch_size)
+        if not consultation_ids:
+            break
+        batch = archive_batch(consultation_ids)
+        for key, count in batch.items():
+            totals[key] += count
+        if not batch["consultations"]:
+            # All of them changed while being archived; the next run retries
+            break
+    if compact_after:
+        totals["freed_bytes"] = compact()
+    totals["seconds"] = round(time.perf_counter() - start, 2)
+    return totals
+
+
+# Reading the archive
+
+@cache.cached("archive")
+def archived_consultations(patient_id, consultation_type):
+    rows = db.query(f'''SELECT {", ".join(INDEX_COLUMNS)} FROM archived_consultations
+                        WHERE patient_id = ? AND consultation_type = ? ORDER BY id''', (patient_id, consultation_type))
+    return [dict(zip(INDEX_COLUMNS, row)) for row in rows]
+
+
+@cache.cached("archive")
+def archived_count():
+    return db.query_one("SELECT COUNT(*) FROM archived_consultations")[0]
+
+
+@cache.cached("archive")
+def load(consultation_id):
+    # An archived consultation with its messages and recordings, read from
+    # its month's partition; None when it was never archived
+    row = db.query_one("SELECT partition FROM archived_consultations WHERE id = ?", (consultation_id,))
+    if row is None:
+        return None
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    store = storage.get_store()
+    found = {}
+    for table, column in ARCHIVED_TABLES.items():
+        found[table] = []
+        for path in store.keys(os.path.join(ARCHIVE_DIR, table, row[0])):
+            if path.endswith(".parquet"):
+                found[table].extend(pq.read_table(pa.BufferReader(store.get(path)),
+                                                  filters=[(column, "=", consultation_id)]).to_pylist())
+
+    # Later parts win, should a row have been archived twice
+    consultation = found["consultations"][-1] if found["consultations"] else None
+    messages = sorted({message["id"]: message for message in found["chat_messages"]}.values(),
+                      key=lambda message: message["id"])
+    recordings = {(recording["consultation_id"], recording["role"]): recording for recording in found["recordings"]}
+    return {"consultation": consultation, "messages": messages, "recordings": recordings}
+
+
+# python -m healthcare.archive [--database path] [--closed-days N] [--max-age-days N] [--dry-run]
+# python -m healthcare.archive --vacuum [--database path]   (offline, with the apps stopped)
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed and old consultations")
+    parser.add_argument("--database", help="defaults to HEALTHCARE_DB")
+    parser.add_argument("--closed-days", type=int, default=CLOSED_RETENTION_DAYS)
+    parser.add_argument("--max-age-days", type=int, default=MAX_AGE_DAYS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be archived")
+    parser.add_argument("--no-compact", dest="compact", action="store_false",
+                        help="skip the incremental vacuum and ANALYZE")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="only rebuild the database file with a full VACUUM; stop the apps first")
+    args = parser.parse_args()
+
+    if args.database:
+        db.configure(args.database)
+    if args.vacuum:
+        print(f"{vacuum(db.DB_PATH) / 1e6:.1f} MB freed")
+        return
+    migrations.migrate()
+    if args.dry_run:
+        print(f"{due_count(args.closed_days, args.max_age_days)} consultations would be archived")
+        return
+    totals = run(args.closed_days, args.max_age_days, args.batch_size, args.compact)
+    print(", ".join(f"{key}={value}" for key, value in totals.items()))
+
+
+if __name__ == "__main__":
+    main()
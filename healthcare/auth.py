@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import hmac
+import ipaddress
+import os
+import socket
+
+from healthcare import db
+
+# scrypt cost; raising any of these rehashes each password at its next login.
+# Each hash needs about 128 * N * r bytes of memory.
+SCRYPT_N = int(os.environ.get("HEALTHCARE_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("HEALTHCARE_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("HEALTHCARE_SCRYPT_P", "1"))
+SALT_BYTES = 16
+HASH_BYTES = 32
+PREFIX = "scrypt"
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES,
+                          maxmem=256 * n * r * p)
+
+
+def _encode(data):
+    return base64.b64encode(data).decode()
+
+
+def hash_password(password, n=None, r=None, p=None):
+    # Stored as scrypt$N$r$p$salt$hash, so the cost can change over time
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    return f"{PREFIX}${n}${r}${p}${_encode(salt)}${_encode(_scrypt(password, salt, n, r, p))}"
+
+
+def verify_password(password, stored):
+    # Returns (matches, needs_rehash). Passwords saved before hashing was
+    # introduced are plain text; they still match and get rehashed.
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != PREFIX:
+        return hmac.compare_digest(stored.encode(), password.encode()), True
+
+    n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+    expected = base64.b64decode(parts[5])
+    matches = hmac.compare_digest(_scrypt(password, base64.b64decode(parts[4]), n, r, p), expected)
+    return matches, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# Verified against when the username does not exist, so unknown and known
+# usernames take the same time to reject
+_dummy_hash = None
+
+
+def authenticate(username, password, user_type):
+    # The users row for valid credentials, otherwise None. The lookup goes
+    # through the unique username index; the slow hashing runs without
+    # holding a database connection.
+    global _dummy_hash
+    user = db.query_one("SELECT * FROM users WHERE username = ?", (username,))
+    if user is None:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password("")
+        verify_password(password, _dummy_hash)
+        return None
+
+    matches, needs_rehash = verify_password(password, user[2])
+    if not matches or user[8] != user_type:
+        return None
+
+    if needs_rehash:
+        new_hash = hash_password(password)
+        # Only replace the hash this login verified, in case it changed meanwhile
+        db.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?", (new_hash, user[0], user[2]))
+        user = (*user[:2], new_hash, *user[3:])
+    return user
+
+
+# Shared-secret checks for the database and media servers
+
+def bearer_matches(header, token):
+    # Constant-time check of an Authorization header against the shared token
+    return hmac.compare_digest((header or "").encode(), f"Bearer {token}".encode())
+
+
+def sign(token, name, expires):
+    # Signature of a link to one object that stays valid until `expires`
+    return hmac.new(token.encode(), f"{name}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def signature_matches(token, name, expires, signature):
+    return hmac.compare_digest(sign(token, name, expires).encode(), (signature or "").encode())
+
+
+def check_listen(host, token, setting):
+    # A server without a token only listens on loopback, where just the
+    # local machine can reach it
+    if token:
+        return
+    try:
+        loopback = ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        loopback = False
+    if not loopback:
+        raise ValueError(f"Set {setting} to serve on {host}; without a token only loopback addresses are allowed")
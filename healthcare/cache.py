@@ -0,0 +1,98 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from healthcare import db
+
+# Seconds a cached read is served before it is queried again. Writes made
+# through this package invalidate at once; the TTL bounds how long a change
+# made by the other app (a separate process) can take to show up.
+DEFAULT_TTL = float(os.environ.get("HEALTHCARE_CACHE_TTL", "10"))
+MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+# Bumped by invalidate(); an entry is only valid while the generations of
+# its tags match the ones seen when it was loaded
+_generations = {}
+_caches = {}
+
+
+def invalidate(*tags):
+    # Call after a write to the tables behind these tags has committed
+    with _lock:
+        for tag in tags:
+            _generations[tag] = _generations.get(tag, 0) + 1
+
+
+class QueryCache:
+    # LRU cache of one query function's results, shared by every session
+
+    def __init__(self, name, tags, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        self.name = name
+        self.tags = tags
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, load):
+        now = time.monotonic()
+        with _lock:
+            # Taken before loading, so a write that lands while the query
+            # runs leaves the new entry already stale
+            generations = tuple(_generations.get(tag, 0) for tag in self.tags)
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now and entry[2] == generations:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = load()
+        with _lock:
+            self.entries[key] = (value, now + self.ttl, generations)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with _lock:
+            self.entries.clear()
+
+
+def cached(*tags, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+    # Cache a read function by its (hashable) arguments. Results are shared
+    # between callers, so treat them as read-only.
+    def decorator(function):
+        name = f"{function.__module__}.{function.__name__}"
+        cache = _caches[name] = QueryCache(name, tags, ttl, max_entries)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (db.DB_PATH, args, tuple(sorted(kwargs.items())))
+            return cache.get_or_load(key, lambda: function(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def stats():
+    # Hit/miss counters of every cached query
+    with _lock:
+        return [{
+            "query": cache.name,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_rate": round(cache.hits / (cache.hits + cache.misses), 3) if cache.hits + cache.misses else None,
+            "entries": len(cache.entries),
+        } for cache in _caches.values()]
+
+
+def clear():
+    for cache in _caches.values():
+        cache.clear()
@@ -0,0 +1,115 @@
+from healthcare import cache, db, triage, writer
+
+# Most recent messages shown per chat thread
+MESSAGE_HISTORY_LIMIT = 50
+
+# Keeps IN (...) lists well under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+
+def recent_messages(consultation_ids, limit=MESSAGE_HISTORY_LIMIT):
+    # Last `limit` messages of every given consultation, oldest first, fetched
+    # in one query per chunk instead of one query per consultation
+    return _recent_messages(tuple(consultation_ids), limit)
+
+
+@cache.cached("chat_messages")
+def _recent_messages(consultation_ids, limit):
+    messages = {consultation_id: [] for consultation_id in consultation_ids}
+
+    for start in range(0, len(consultation_ids), CHUNK_SIZE):
+        chunk = consultation_ids[start:start + CHUNK_SIZE]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = db.query(f'''SELECT id, consultation_id, sender, message, timestamp
+                            FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY consultation_id ORDER BY id DESC) AS rank
+                                  FROM chat_messages
+                                  WHERE consultation_id IN ({placeholders}))
+                            WHERE rank <= ?
+                            ORDER BY consultation_id, id''', (*chunk, limit))
+        for row in rows:
+            messages[row[1]].append(row)
+    return messages
+
+
+@cache.cached("consultations")
+def patient_consultations(patient_id, consultation_type):
+    return db.query("SELECT * FROM consultations WHERE patient_id = ? AND consultation_type = ?",
+                    (patient_id, consultation_type))
+
+
+def add_consultation(patient_id, consultation_type, symptoms, history_of_illness, blood_group, comments,
+                     priority=None):
+    # Queued with a priority scored from the symptoms unless one is given
+    if priority is None:
+        priority = triage.urgency(symptoms)
+    # Returns once the write queue has committed it
+    return writer.execute('''INSERT INTO consultations (patient_id, consultation_type, symptoms, history_of_illness,
+                                                         blood_group, comments, status, priority, created_at)
+                               VALUES (?, ?, ?, ?, ?, ?, 'Processing', ?, datetime('now'))''',
+                          (patient_id, consultation_type, symptoms, history_of_illness, blood_group, comments, priority),
+                          tags=("consultations",))
+
+
+def update_status(consultation_id, status, doctor_comments):
+    writer.execute("UPDATE consultations SET status = ?, doctor_comments = ? WHERE id = ?",
+                   (status, doctor_comments, consultation_id), tags=("consultations",))
+
+
+# Rows per page in the admin consultation lists
+PAGE_SIZE = 20
+
+LIST_COLUMNS = ("id", "patient_id", "status", "priority", "created_at", "symptoms", "history_of_illness",
+                "blood_group", "comments", "doctor_comments")
+
+
+@cache.cached("consultations")
+def list_consultations(consultation_type, status=None, patient_id=None, since=None, until=None,
+                       newest_first=True, after_id=None, limit=PAGE_SIZE, doctor_id=None):
+    # One keyset page of consultations, returned with the cursor for the next
+    # page (None on the last page). since/until are 'YYYY-MM-DD' dates,
+    # both inclusive.
+    conditions = ["consultation_type = ?"]
+    params = [consultation_type]
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if patient_id:
+        conditions.append("patient_id = ?")
+        params.append(patient_id)
+    if doctor_id:
+        conditions.append("assigned_doctor_id = ?")
+        params.append(doctor_id)
+    # Filtered on created_at itself: imported and backfilled rows are not
+    # numbered in submission order
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if until:
+        conditions.append("created_at < date(?, '+1 day')")
+        params.append(until)
+    if after_id is not None:
+        conditions.append("id < ?" if newest_first else "id > ?")
+        params.append(after_id)
+
+    order = "DESC" if newest_first else "ASC"
+    rows = db.query(f'''SELECT {", ".join(LIST_COLUMNS)} FROM consultations
+                        WHERE {" AND ".join(conditions)}
+                        ORDER BY id {order} LIMIT ?''', (*params, limit + 1))
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return [dict(zip(LIST_COLUMNS, row)) for row in rows[:limit]], next_cursor
+
+
+def messages_since(consultation_id, after_id=0, limit=MESSAGE_HISTORY_LIMIT):
+    # Messages newer than after_id, oldest first; an index range read, so a
+    # poll with nothing new costs a single seek
+    rows = db.query('''SELECT id, consultation_id, sender, message, timestamp FROM chat_messages
+                       WHERE consultation_id = ? AND id > ?
+                       ORDER BY id DESC LIMIT ?''', (consultation_id, after_id, limit))
+    return rows[::-1]
+
+
+def add_message(consultation_id, sender, message):
+    return writer.execute("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) "
+                          "VALUES (?, ?, ?, datetime('now'))", (consultation_id, sender, message),
+                          tags=("chat_messages",))
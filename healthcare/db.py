@@ -0,0 +1,227 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from healthcare import metrics
+
+# Database location and connection settings, overridable per deployment.
+# An http:// or https:// URL of a healthcare.dbserver instead of a file lets
+# several app replicas share one database.
+DB_PATH = os.environ.get("HEALTHCARE_DB", "healthcare.db")
+POOL_SIZE = int(os.environ.get("HEALTHCARE_DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT = float(os.environ.get("HEALTHCARE_DB_BUSY_TIMEOUT", "5.0"))
+# NORMAL: a commit in WAL mode is safe from app crashes but not power loss
+SYNCHRONOUS = os.environ.get("HEALTHCARE_DB_SYNCHRONOUS", "NORMAL")
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+# Contention counters: time spent waiting for the write lock and for a free
+# pooled connection
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _count(name, seconds):
+    with _stats_lock:
+        _stats[f"{name}s"] = _stats.get(f"{name}s", 0) + 1
+        _stats[f"{name}_seconds"] = _stats.get(f"{name}_seconds", 0.0) + seconds
+        _stats[f"max_{name}_seconds"] = max(_stats.get(f"max_{name}_seconds", 0.0), seconds)
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def connect(path=None):
+    # Autocommit mode: reads never hold a transaction open, writes go
+    # through transaction() which takes the write lock up front
+    path = path or DB_PATH
+    if path.startswith(("http://", "https://")):
+        # The server opens its own connections with the settings below
+        from healthcare import dbserver
+
+        return dbserver.RemoteConnection(path)
+    new = not os.path.exists(path)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    if new:
+        # Only possible before the file's first page is written; space freed
+        # by archiving can then be given back without a full VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(f"PRAGMA synchronous = {SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+    # Rows removed by INSERT OR REPLACE fire the delete triggers too, which
+    # keep the search index and the rollups in step
+    conn.execute("PRAGMA recursive_triggers = ON")
+    return conn
+
+
+class ConnectionPool:
+    # Bounded pool of connections, each used by one thread at a time
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return connect(self.path)
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+
+        start = time.perf_counter()
+        try:
+            return self.idle.get(timeout=BUSY_TIMEOUT)
+        except queue.Empty:
+            _count("pool_timeout", time.perf_counter() - start)
+            raise sqlite3.OperationalError("Timed out waiting for a database connection") from None
+        finally:
+            _count("pool_wait", time.perf_counter() - start)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.closed:
+            conn.close()
+        else:
+            self.idle.put(conn)
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def configure(path=None, size=None):
+    # Point the shared pool at another database file (used by tools and benchmarks)
+    global _pool, DB_PATH, POOL_SIZE
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        if path:
+            DB_PATH = path
+        if size:
+            POOL_SIZE = size
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+    return _pool
+
+
+@contextmanager
+def connection():
+    # Borrow a pooled connection; nested calls on the same thread reuse it
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        pool.release(conn)
+
+
+@contextmanager
+def using(conn):
+    # Run connection() and transaction() on this thread with a connection the
+    # caller owns instead of a pooled one (long-lived worker threads)
+    previous = getattr(_local, "conn", None)
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = previous
+
+
+def in_transaction():
+    # True inside transaction() on this thread
+    conn = getattr(_local, "conn", None)
+    return conn is not None and conn.in_transaction
+
+
+@contextmanager
+def transaction():
+    # Short write transaction; joins the enclosing one if already inside it
+    with connection() as conn:
+        if conn.in_transaction:
+            yield conn
+            return
+
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Still locked after busy_timeout
+            _count("lock_timeout", time.perf_counter() - start)
+            raise
+        finally:
+            _count("lock_wait", time.perf_counter() - start)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def query(sql, params=()):
+    with metrics.span("sql.read"), connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def query_one(sql, params=()):
+    with metrics.span("sql.read"), connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def execute(sql, params=()):
+    with metrics.span("sql.write"), transaction() as conn:
+        return conn.execute(sql, params)
+
+
+def executemany(sql, rows):
+    with metrics.span("sql.write"), transaction() as conn:
+        return conn.executemany(sql, rows)
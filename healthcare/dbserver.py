@@ -0,0 +1,355 @@
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from healthcare import auth, db, migrations
+
+# A small SQL server for running several app replicas on one database. It
+# owns the SQLite file and runs the statements replicas send over HTTP, so
+# the SQL, migrations, triggers and FTS indexes stay exactly as they are.
+# Point HEALTHCARE_DB at http://host:port to use it instead of a local file.
+HOST = os.environ.get("HEALTHCARE_DB_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("HEALTHCARE_DB_SERVER_PORT", "8765"))
+# Shared secret sent by every client. Required unless the server only
+# listens on a loopback address.
+TOKEN = os.environ.get("HEALTHCARE_DB_TOKEN")
+# Seconds an idle session is kept. A session lives as long as its HTTP
+# connection; when a replica dies, its open transaction is rolled back.
+SESSION_TIMEOUT = float(os.environ.get("HEALTHCARE_DB_SESSION_TIMEOUT", "300"))
+# Seconds a client waits for one statement (VACUUM and ANALYZE can be slow)
+REQUEST_TIMEOUT = float(os.environ.get("HEALTHCARE_DB_REQUEST_TIMEOUT", "600"))
+# Seconds a write transaction may stay open. Every other replica waits for
+# it, so one that stalls is rolled back and disconnected.
+WRITE_TIMEOUT = float(os.environ.get("HEALTHCARE_DB_WRITE_TIMEOUT", "5"))
+
+# Rows sent per response; larger results are fetched in pages, so streaming
+# exports still never hold a whole table in memory
+FETCH_SIZE = 1000
+# Rows sent per executemany request
+EXECUTEMANY_CHUNK = 1000
+# Unfinished result sets a session keeps open
+MAX_CURSORS = 16
+
+# PRAGMAs a client may pass a value to; any other PRAGMA can only be read.
+# Schema changes and database-wide settings are made on the server host.
+CLIENT_PRAGMAS = {"synchronous", "table_info", "incremental_vacuum", "wal_checkpoint"}
+
+ERRORS = ("OperationalError", "IntegrityError", "ProgrammingError", "DataError", "NotSupportedError",
+          "InterfaceError", "InternalError", "DatabaseError")
+
+
+# JSON has no bytes, so BLOB values travel as {"b64": "..."}
+
+def _encode(value):
+    return {"b64": base64.b64encode(value).decode()} if isinstance(value, (bytes, memoryview)) else value
+
+
+def _decode(value):
+    return base64.b64decode(value["b64"]) if isinstance(value, dict) else value
+
+
+def _encode_rows(rows):
+    return [[_encode(value) for value in row] for row in rows]
+
+
+def _encode_params(params):
+    if isinstance(params, dict):
+        return {name: _encode(value) for name, value in params.items()}
+    return [_encode(value) for value in params]
+
+
+def _decode_params(params):
+    if isinstance(params, dict):
+        return {name: _decode(value) for name, value in params.items()}
+    return [_decode(value) for value in params]
+
+
+# Server
+
+def _authorize(action, name, value, database, source):
+    # Clients cannot open other files (ATTACH, VACUUM INTO) or change settings
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA and value is not None and name.lower() not in CLIENT_PRAGMAS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+class Session(BaseHTTPRequestHandler):
+    # One client connection: its own SQLite connection and open result sets
+    protocol_version = "HTTP/1.1"
+    timeout = SESSION_TIMEOUT
+    # Headers and body go out in separate writes; without this every reply
+    # waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.conn = None
+        self.cursors = {}
+        self.cursor_ids = itertools.count(1)
+        self.writing = False
+        self.write_deadline = None
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            if self.conn is not None:
+                # Rolls back whatever the client left open
+                self.conn.close()
+            self._end_write()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if TOKEN and not auth.bearer_matches(self.headers.get("Authorization"), TOKEN):
+            self._reply(401, {"error": ["OperationalError", "Not authorized"]})
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        try:
+            if self.conn is None:
+                self.conn = db.connect(self.server.path)
+                self.conn.set_authorizer(_authorize)
+            if self.writing and time.monotonic() > self.write_deadline:
+                self.conn.rollback()
+                raise sqlite3.OperationalError(f"Write transaction open longer than {WRITE_TIMEOUT:g}s, rolled back")
+            response = OPERATIONS[request["op"]](self, request)
+        except sqlite3.Error as error:
+            response = {"error": [type(error).__name__, str(error)]}
+        response["in_transaction"] = self.conn is not None and self.conn.in_transaction
+        if not response["in_transaction"]:
+            self._end_write()
+        self._reply(200, response)
+        # A client that goes quiet inside a write transaction is dropped when
+        # its time is up, which rolls the transaction back in finish()
+        self.connection.settimeout(max(self.write_deadline - time.monotonic(), 0.001) if self.writing
+                                   else SESSION_TIMEOUT)
+
+    # Write transactions queue on the server. SQLite's busy handler polls
+    # with growing sleeps, and with every statement a network round trip
+    # the waiters would keep missing the short gaps between transactions.
+    def _begin_write(self):
+        if not self.writing:
+            if not self.server.write_lock.acquire(timeout=db.BUSY_TIMEOUT):
+                raise sqlite3.OperationalError("database is locked")
+            self.writing = True
+            self.write_deadline = time.monotonic() + WRITE_TIMEOUT
+
+    def _end_write(self):
+        if self.writing:
+            self.writing = False
+            self.server.write_lock.release()
+
+    def _reply(self, status, response):
+        body = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _result(self, cursor, cursor_id=None):
+        rows = cursor.fetchmany(FETCH_SIZE) if cursor.description else []
+        if len(rows) == FETCH_SIZE:
+            if cursor_id is None:
+                cursor_id = next(self.cursor_ids)
+                self.cursors[cursor_id] = cursor
+                while len(self.cursors) > MAX_CURSORS:
+                    self.cursors.pop(next(iter(self.cursors)))
+        else:
+            self.cursors.pop(cursor_id, None)
+            cursor_id = None
+        return {"rows": _encode_rows(rows), "cursor": cursor_id}
+
+    def execute(self, request):
+        if request["sql"].lstrip().upper().startswith(("BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")):
+            self._begin_write()
+        if request.get("many"):
+            cursor = self.conn.executemany(request["sql"], [_decode_params(params) for params in request["params"]])
+        else:
+            cursor = self.conn.execute(request["sql"], _decode_params(request["params"]))
+        return {**self._result(cursor),
+                "columns": [column[0] for column in cursor.description] if cursor.description else None,
+                "lastrowid": cursor.lastrowid, "rowcount": cursor.rowcount}
+
+    def fetch(self, request):
+        cursor = self.cursors.get(request["cursor"])
+        if cursor is None:
+            raise sqlite3.ProgrammingError("Result set is no longer open")
+        return self._result(cursor, request["cursor"])
+
+    def commit(self, request):
+        # An open result set ends with its transaction
+        self.cursors.clear()
+        self.conn.commit()
+        return {}
+
+    def rollback(self, request):
+        self.cursors.clear()
+        self.conn.rollback()
+        return {}
+
+
+OPERATIONS = {"execute": Session.execute, "fetch": Session.fetch, "commit": Session.commit,
+              "rollback": Session.rollback}
+
+
+def serve(path, host=HOST, port=PORT):
+    # The server for one database file, with its migrations applied (clients
+    # cannot change user_version); call serve_forever() on it
+    auth.check_listen(host, TOKEN, "HEALTHCARE_DB_TOKEN")
+    previous = db.DB_PATH
+    db.configure(path)
+    try:
+        migrations.migrate()
+    finally:
+        db.configure(previous)
+    server = ThreadingHTTPServer((host, port), Session)
+    server.daemon_threads = True
+    server.path = path
+    server.write_lock = threading.Lock()
+    return server
+
+
+def start(path, host="127.0.0.1", port=0):
+    # Local stand-in for tests and benchmarks: a server on a background
+    # thread of this process. Returns the server and the URL to configure.
+    server = serve(path, host, port)
+    threading.Thread(target=server.serve_forever, name="healthcare-dbserver", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+# Client
+
+class RemoteCursor:
+    # The part of sqlite3.Cursor the package uses
+
+    def __init__(self, conn, result):
+        self.conn = conn
+        columns = result.get("columns")
+        self.description = tuple((name, None, None, None, None, None, None) for name in columns) if columns else None
+        self.lastrowid = result.get("lastrowid")
+        self.rowcount = result.get("rowcount", -1)
+        self.rows = [tuple(_decode(value) for value in row) for row in result["rows"]]
+        self.cursor_id = result["cursor"]
+
+    def _fetch(self):
+        result = self.conn._call({"op": "fetch", "cursor": self.cursor_id})
+        self.rows.extend(tuple(_decode(value) for value in row) for row in result["rows"])
+        self.cursor_id = result["cursor"]
+
+    def fetchmany(self, size=FETCH_SIZE):
+        while len(self.rows) < size and self.cursor_id is not None:
+            self._fetch()
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        while self.cursor_id is not None:
+            self._fetch()
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield from rows
+
+
+class RemoteConnection:
+    # Connection to a database server, used like a sqlite3 connection in
+    # autocommit mode. Errors are raised as the sqlite3 exception the server
+    # hit, so callers handle them as before.
+
+    def __init__(self, url, timeout=REQUEST_TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.http = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.path = parts.path or "/"
+        self.headers = {"Content-Type": "application/json"}
+        if TOKEN:
+            self.headers["Authorization"] = f"Bearer {TOKEN}"
+        self.in_transaction = False
+        self.last_used = time.monotonic()
+
+    def _call(self, request):
+        # A connection idle for most of the session timeout is replaced
+        # before the server drops it; only allowed outside a transaction,
+        # whose state the server keeps per connection
+        if not self.in_transaction and time.monotonic() - self.last_used > SESSION_TIMEOUT / 2:
+            self.http.close()
+        try:
+            self.http.request("POST", self.path, json.dumps(request).encode(), self.headers)
+            response = self.http.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as error:
+            self.http.close()
+            self.in_transaction = False
+            raise sqlite3.OperationalError(f"Lost the connection to the database server: {error}") from error
+        self.last_used = time.monotonic()
+        result = json.loads(body)
+        self.in_transaction = result.get("in_transaction", False)
+        if "error" in result:
+            name, message = result["error"]
+            raise getattr(sqlite3, name if name in ERRORS else "DatabaseError")(message)
+        return result
+
+    def execute(self, sql, params=()):
+        return RemoteCursor(self, self._call({"op": "execute", "sql": sql,
+                                              "params": _encode_params(params)}))
+
+    def executemany(self, sql, rows):
+        rows = iter(rows)
+        rowcount = 0
+        for chunk in iter(lambda: list(itertools.islice(rows, EXECUTEMANY_CHUNK)), []):
+            result = self._call({"op": "execute", "sql": sql, "many": True,
+                                 "params": [_encode_params(params) for params in chunk]})
+            rowcount += result["rowcount"]
+        return RemoteCursor(self, {"rows": [], "cursor": None, "rowcount": rowcount})
+
+    def commit(self):
+        if self.in_transaction:
+            self._call({"op": "commit"})
+
+    def rollback(self):
+        if self.in_transaction:
+            self._call({"op": "rollback"})
+
+    def close(self):
+        self.http.close()
+
+
+# python -m healthcare.dbserver [database] [--host HOST] [--port PORT]
+def main():
+    parser = argparse.ArgumentParser(description="Serve a healthcare database to app replicas")
+    parser.add_argument("database", nargs="?", default=db.DB_PATH)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    server = serve(args.database, args.host, args.port)
+    print(f"Serving {args.database} on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
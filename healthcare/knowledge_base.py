@@ -0,0 +1,451 @@
+import csv
+import json
+import os
+import sys
+import threading
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from healthcare import db, metrics, migrations
+
+# Where the index snapshot is persisted between app restarts
+INDEX_PATH = os.environ.get("KB_INDEX_PATH", "kb_index.joblib")
+
+# Built-in question-answer pairs put in an empty knowledge base
+SEED_PATH = os.environ.get("KB_SEED_PATH", os.path.join(os.path.dirname(__file__), "knowledge_base.csv"))
+
+# Hashed feature space, large enough that collisions are negligible
+N_FEATURES = 2 ** 18
+
+# Rows are buffered and merged into the main matrix in blocks
+MERGE_THRESHOLD = 1024
+
+# Bumped whenever the pickled index layout changes
+FORMAT_VERSION = 2
+
+# Number of answers returned and the similarity below which a match is dropped
+DEFAULT_K = 3
+MIN_SCORE = float(os.environ.get("KB_MIN_SCORE", "0.1"))
+
+# Query terms present in more than this fraction of questions ("what", "the")
+# carry almost no IDF weight but have the longest postings lists, so they are
+# skipped when scoring large corpora
+MAX_DF_RATIO = 0.5
+MIN_DOCS_FOR_PRUNING = 1000
+
+IMPORT_BATCH_SIZE = 1000
+
+_vectorizer = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None)
+# Text to the lower-cased words the vectorizer hashes
+analyze = _vectorizer.build_analyzer()
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Knowledge base writes
+def add_entry(question, answer):
+    cursor = db.execute("INSERT INTO knowledge_base (question, answer) VALUES (?, ?)",
+                        (question, answer))
+    return cursor.lastrowid
+
+
+def update_entry(entry_id, question, answer):
+    db.execute("UPDATE knowledge_base SET question = ?, answer = ? WHERE id = ?",
+               (question, answer, entry_id))
+
+
+def delete_entry(entry_id):
+    db.execute("DELETE FROM knowledge_base WHERE id = ?", (entry_id,))
+
+
+def add_entries(rows, batch_size=IMPORT_BATCH_SIZE):
+    # Insert (question, answer) pairs from any iterable in batched transactions
+    count = 0
+    batch = []
+    for question, answer in rows:
+        batch.append((question, answer))
+        if len(batch) >= batch_size:
+            count += _insert_batch(batch)
+            batch = []
+    if batch:
+        count += _insert_batch(batch)
+    return count
+
+
+def _insert_batch(batch):
+    db.executemany("INSERT INTO knowledge_base (question, answer) VALUES (?, ?)", batch)
+    return len(batch)
+
+
+def seed(rows):
+    # Populate an empty knowledge base, e.g. with read_csv(SEED_PATH)
+    if db.query_one("SELECT 1 FROM knowledge_base LIMIT 1") is None:
+        add_entries(rows)
+
+
+# Streamed readers for bulk imports
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            yield row["question"], row["answer"]
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                row = json.loads(line)
+                yield row["question"], row["answer"]
+
+
+def import_file(path, batch_size=IMPORT_BATCH_SIZE):
+    if path.endswith(".csv"):
+        rows = read_csv(path)
+    elif path.endswith(".jsonl"):
+        rows = read_jsonl(path)
+    else:
+        raise ValueError(f"Unsupported file type: {path}")
+    return add_entries(rows, batch_size)
+
+
+def vectorize(texts):
+    # Sublinear term frequencies; IDF is applied on the query side only, so
+    # document vectors never need re-weighting as the corpus grows
+    vectors = _vectorizer.transform(texts).tocsr()
+    vectors.data = 1.0 + np.log(vectors.data)
+    return vectors
+
+
+class Segment:
+    # A block of question vectors with their entry ids and a deletion mask
+
+    def __init__(self, matrix=None, ids=None):
+        self.matrix = matrix if matrix is not None else sp.csr_matrix((0, N_FEATURES), dtype=np.float64)
+        self.ids = ids if ids is not None else np.zeros(0, dtype=np.int64)
+        self.alive = np.ones(len(self.ids), dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, matrix, ids):
+        self.matrix = sp.vstack([self.matrix, matrix], format="csr")
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+        self._postings = None
+
+    def live(self):
+        keep = np.flatnonzero(self.alive)
+        return self.matrix[keep], self.ids[keep]
+
+    def postings(self):
+        # Column-major copy of the matrix, i.e. an inverted index from term
+        # to the rows containing it; built lazily since segments are immutable
+        # once merged
+        if getattr(self, "_postings", None) is None:
+            self._postings = self.matrix.tocsc()
+        return self._postings
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_postings", None)
+        return state
+
+    def score(self, terms, weights):
+        # Accumulate scores over the postings of the query terms only, so the
+        # cost grows with the matched rows rather than the segment size
+        postings = self.postings()
+        starts = postings.indptr[terms]
+        ends = postings.indptr[terms + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        rows = postings.indices[offsets]
+        contributions = postings.data[offsets] * np.repeat(weights, lengths)
+
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions)
+        live = self.alive[candidates]
+        return candidates[live], scores[live]
+
+
+class KnowledgeBaseIndex:
+    # Incrementally maintained vectors for every question in the knowledge base.
+    # New rows go to a small delta segment that is folded into the main
+    # segment once it grows past MERGE_THRESHOLD.
+
+    def __init__(self):
+        self.main = Segment()
+        self.delta = Segment()
+        self.positions = {}
+        self.doc_freq = np.zeros(N_FEATURES, dtype=np.int64)
+        self.n_docs = 0
+        self.last_seq = 0
+        self.format_version = FORMAT_VERSION
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, batch_size=IMPORT_BATCH_SIZE):
+        index = cls()
+        blocks = []
+        ids = []
+        with db.connection() as conn:
+            # Read the change log position and the corpus from one snapshot
+            conn.execute("BEGIN")
+            try:
+                index.last_seq = _max_seq(conn)
+
+                # Stream the corpus so it is never held in memory as text
+                cursor = conn.execute("SELECT id, question FROM knowledge_base ORDER BY id")
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    vectors = vectorize([row[1] for row in rows])
+                    index.doc_freq += np.bincount(vectors.indices, minlength=N_FEATURES)
+                    blocks.append(normalize(vectors))
+                    ids.extend(row[0] for row in rows)
+            finally:
+                conn.rollback()
+
+        if blocks:
+            index.main = Segment(sp.vstack(blocks, format="csr"), np.asarray(ids, dtype=np.int64))
+            index.positions = {entry_id: (index.main, position) for position, entry_id in enumerate(ids)}
+            index.n_docs = len(ids)
+        return index
+
+    @classmethod
+    def load_or_build(cls, path=INDEX_PATH):
+        index = None
+        if path and os.path.exists(path):
+            try:
+                index = joblib.load(path)
+            except Exception:
+                index = None
+            if not isinstance(index, cls) or getattr(index, "format_version", None) != FORMAT_VERSION:
+                index = None
+
+        if index is None:
+            index = cls.build()
+            index.save(path)
+        elif index.refresh():
+            index.save(path)
+        return index
+
+    def save(self, path=INDEX_PATH):
+        if not path:
+            return
+        with self.lock:
+            self._merge()
+            tmp_path = f"{path}.tmp"
+            joblib.dump(self, tmp_path)
+            os.replace(tmp_path, path)
+            # The snapshot covers the change log up to last_seq. The row at
+            # last_seq is kept so refresh() can tell the log was pruned.
+            db.execute("DELETE FROM knowledge_base_changes WHERE seq < ?", (self.last_seq,))
+
+    def refresh(self):
+        # Apply inserts, updates and deletes logged since the last refresh
+        with self.lock, db.connection() as conn:
+            changes = conn.execute("SELECT seq, entry_id FROM knowledge_base_changes WHERE seq > ? ORDER BY seq",
+                                   (self.last_seq,)).fetchall()
+            if not changes:
+                return 0
+            if changes[0][0] > self.last_seq + 1:
+                # Another process saved a newer snapshot and pruned changes
+                # this index never saw, so start again from the table
+                self.__dict__.update(type(self).build().__getstate__())
+                return len(changes)
+
+            entry_ids = sorted({entry_id for _, entry_id in changes})
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+
+            for start in range(0, len(entry_ids), 500):
+                chunk = entry_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT id, question FROM knowledge_base WHERE id IN ({placeholders})",
+                                    chunk).fetchall()
+                if rows:
+                    self._add([row[0] for row in rows], [row[1] for row in rows])
+
+            self.last_seq = changes[-1][0]
+            if len(self.delta) >= MERGE_THRESHOLD:
+                self._merge()
+            return len(changes)
+
+    def _add(self, entry_ids, questions):
+        vectors = vectorize(questions)
+        self.doc_freq += np.bincount(vectors.indices, minlength=N_FEATURES)
+        self.n_docs += len(entry_ids)
+
+        offset = len(self.delta)
+        self.delta.append(normalize(vectors), entry_ids)
+        for i, entry_id in enumerate(entry_ids):
+            self.positions[entry_id] = (self.delta, offset + i)
+
+    def _remove(self, entry_id):
+        if entry_id not in self.positions:
+            return
+        segment, position = self.positions.pop(entry_id)
+        segment.alive[position] = False
+        self.doc_freq[segment.matrix[position].indices] -= 1
+        self.n_docs -= 1
+
+    def _merge(self):
+        # Fold the delta into the main segment, dropping deleted rows
+        if not len(self.delta) and self.main.alive.all():
+            return
+        main_matrix, main_ids = self.main.live()
+        delta_matrix, delta_ids = self.delta.live()
+        self.main = Segment(sp.vstack([main_matrix, delta_matrix], format="csr"),
+                            np.concatenate([main_ids, delta_ids]))
+        self.delta = Segment()
+        self.positions = {int(entry_id): (self.main, position) for position, entry_id in enumerate(self.main.ids)}
+
+    def idf(self, terms):
+        return np.log((1 + self.n_docs) / (1 + self.doc_freq[terms])) + 1
+
+    def query_matrix(self, queries):
+        # One row per query, IDF-weighted and L2-normalised. Both search
+        # paths build their queries here so they score alike. Terms in most
+        # documents are dropped after normalising, so they only lower the
+        # score instead of being spread over the remaining terms.
+        matrix = vectorize(queries)
+        matrix.data *= self.idf(matrix.indices)
+        matrix = normalize(matrix)
+        if self.n_docs >= MIN_DOCS_FOR_PRUNING:
+            matrix.data[self.doc_freq[matrix.indices] > MAX_DF_RATIO * self.n_docs] = 0.0
+            matrix.eliminate_zeros()
+        return matrix
+
+    def search_ids(self, query, k=DEFAULT_K, min_score=MIN_SCORE):
+        # Return up to k (entry_id, score) pairs, best first
+        with self.lock:
+            vector = self.query_matrix([query])
+            terms, weights = vector.indices.astype(np.int64), vector.data
+
+            candidate_ids = []
+            candidate_scores = []
+            for segment in (self.main, self.delta):
+                if len(segment):
+                    rows, scores = segment.score(terms, weights)
+                    candidate_ids.append(segment.ids[rows])
+                    candidate_scores.append(scores)
+
+        if not candidate_ids:
+            return []
+        return top_k(np.concatenate(candidate_ids), np.concatenate(candidate_scores), k, min_score)
+
+    def search_ids_batch(self, queries, k=DEFAULT_K, min_score=MIN_SCORE):
+        # Score a whole list of queries with one sparse product per segment
+        with self.lock:
+            query_matrix = self.query_matrix(queries)
+            scores = []
+            ids = []
+            for segment in (self.main, self.delta):
+                if len(segment):
+                    segment_scores = (query_matrix @ segment.matrix.T).tocsr()
+                    segment_scores.data[~segment.alive[segment_scores.indices]] = 0.0
+                    scores.append(segment_scores)
+                    ids.append(segment.ids)
+
+        if not scores:
+            return [[] for _ in queries]
+        scores = sp.hstack(scores, format="csr")
+        ids = np.concatenate(ids)
+
+        results = []
+        for row in range(len(queries)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            results.append(top_k(ids[scores.indices[start:end]], scores.data[start:end], k, min_score))
+        return results
+
+    def search(self, query, k=DEFAULT_K, min_score=MIN_SCORE):
+        with metrics.span("kb.search"):
+            top_ids = [entry_id for entry_id, _ in self.search_ids(query, k, min_score)]
+        return _fetch_entries(top_ids)
+
+    def search_batch(self, queries, k=DEFAULT_K, min_score=MIN_SCORE):
+        # Answers for every query, fetched from the database in one lookup
+        with metrics.span("kb.search_batch"):
+            matches = self.search_ids_batch(queries, k, min_score)
+        entries = _fetch_entry_map({entry_id for match in matches for entry_id, _ in match})
+        return [[entries[entry_id] for entry_id, _ in match if entry_id in entries] for match in matches]
+
+
+def top_k(ids, scores, k, min_score):
+    # Select the k best scores above the threshold without sorting every
+    # candidate; equal scores are ordered by entry id
+    if k <= 0:
+        return []
+    keep = scores >= max(min_score, 1e-12)
+    ids, scores = ids[keep], scores[keep]
+    if len(scores) > k:
+        # Everything tied with the k-th best stays in, so ties are broken below
+        keep = scores >= np.partition(scores, len(scores) - k)[len(scores) - k]
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))[:k]
+    return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def _max_seq(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM knowledge_base_changes").fetchone()[0]
+
+
+def _fetch_entry_map(entry_ids):
+    by_id = {}
+    entry_ids = list(entry_ids)
+    for start in range(0, len(entry_ids), 500):
+        chunk = entry_ids[start:start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = db.query(f"SELECT id, question, answer FROM knowledge_base WHERE id IN ({placeholders})",
+                        chunk)
+        by_id.update((row[0], (row[1], row[2])) for row in rows)
+    return by_id
+
+
+def _fetch_entries(entry_ids):
+    # Look up the text for the matched entries, preserving rank order
+    by_id = _fetch_entry_map(entry_ids)
+    return [by_id[entry_id] for entry_id in entry_ids if entry_id in by_id]
+
+
+# Process-wide index shared by every Streamlit session
+def get_index(path=INDEX_PATH):
+    global _index
+    with metrics.span("kb.load_index"), _index_lock:
+        if _index is None:
+            seed(read_csv(SEED_PATH))
+            _index = KnowledgeBaseIndex.load_or_build(path)
+        elif _index.refresh() >= MERGE_THRESHOLD:
+            # Keep the snapshot close enough that restarts catch up quickly
+            _index.save(path)
+        return _index
+
+
+# python -m healthcare.knowledge_base import <file.csv|file.jsonl> [database]
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "import":
+        sys.exit("usage: python -m healthcare.knowledge_base import <file.csv|file.jsonl> [database]")
+
+    if len(sys.argv) > 3:
+        db.configure(sys.argv[3])
+    migrations.migrate()
+    count = import_file(sys.argv[2])
+    print(f"Imported {count} entries into {db.DB_PATH}")
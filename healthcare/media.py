@@ -0,0 +1,184 @@
+import base64
+import functools
+import hashlib
+import io
+import os
+import re
+import sys
+
+from PIL import Image, ImageOps
+
+from healthcare import cache, consultations, db, storage
+
+# Where recorded consultation videos are kept
+VIDEO_DIR = os.environ.get("HEALTHCARE_VIDEO_DIR", ".")
+
+# Profile pictures are stored once per distinct upload, under its content hash
+AVATAR_DIR = os.environ.get("HEALTHCARE_AVATAR_DIR", os.path.join("media", "avatars"))
+AVATAR_SIZES = (64, 128, 256)
+AVATAR_QUALITY = 80
+
+
+def video_path(consultation_id, role):
+    # Where a recording is written, and its name in the media store; role is
+    # "doctor" or "patient"
+    return os.path.join(VIDEO_DIR, f"consultation_{consultation_id}_{role}.mp4")
+
+
+RECORDING_COLUMNS = ("consultation_id", "role", "path", "preview_path", "thumbnail_path", "duration",
+                     "size", "preview_size", "width", "height")
+
+
+def list_recordings(consultation_ids):
+    # Transcoded recordings of a page of consultations, keyed by
+    # (consultation_id, role); chunked like consultations.recent_messages
+    return _list_recordings(tuple(consultation_ids))
+
+
+@cache.cached("recordings")
+def _list_recordings(consultation_ids):
+    recordings = {}
+    for start in range(0, len(consultation_ids), consultations.CHUNK_SIZE):
+        chunk = consultation_ids[start:start + consultations.CHUNK_SIZE]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = db.query(f"SELECT {', '.join(RECORDING_COLUMNS)} FROM recordings WHERE consultation_id IN ({placeholders})",
+                        chunk)
+        for row in rows:
+            recordings[row[0], row[1]] = dict(zip(RECORDING_COLUMNS, row))
+    return recordings
+
+
+# Cached like the queries: with a shared media store each lookup is a round
+# trip, and a page shows several videos. Writes through this package
+# invalidate "media"; the TTL bounds how long another replica's recording
+# takes to show up.
+@cache.cached("media")
+def video_version(path):
+    # Changes whenever the file is re-recorded, so stale cache entries are
+    # never served; None when there is no video yet
+    return storage.get_store().version(path)
+
+
+def video_exists(path):
+    return video_version(path) is not None
+
+
+# The player is given the file, or a signed link to the object server,
+# rather than the video's bytes, so no video is held in this process
+def video_source(path):
+    if video_version(path) is None:
+        return None
+    return storage.get_store().source(path)
+
+
+@functools.lru_cache(maxsize=256)
+def _load_thumbnail(path, version):
+    return storage.get_store().get(path)
+
+
+def load_thumbnail(path):
+    version = video_version(path)
+    if version is None:
+        return None
+    return _load_thumbnail(path, version)
+
+
+def save_avatar(data):
+    # Decode an uploaded picture once, crop it square and store each
+    # thumbnail size as WebP. Returns the path kept in users.profile_picture
+    # (the largest size); the same upload is only ever processed once.
+    store = storage.get_store()
+    digest = hashlib.sha256(data).hexdigest()
+    directory = os.path.join(AVATAR_DIR, digest[:2])
+    paths = {size: os.path.join(directory, f"{digest}_{size}.webp") for size in AVATAR_SIZES}
+    if all(store.exists(path) for path in paths.values()):
+        return paths[AVATAR_SIZES[-1]]
+
+    try:
+        with Image.open(io.BytesIO(data)) as upload:
+            # Let the JPEG decoder downscale while decoding large photos
+            upload.draft("RGB", (AVATAR_SIZES[-1] * 2, AVATAR_SIZES[-1] * 2))
+            image = ImageOps.exif_transpose(upload).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as error:
+        raise ValueError("Not a readable image") from error
+    image = ImageOps.fit(image, (AVATAR_SIZES[-1], AVATAR_SIZES[-1]), Image.LANCZOS)
+
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        image = image.resize((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, "WEBP", quality=AVATAR_QUALITY, method=6)
+        store.put(paths[size], buffer.getvalue())
+    return paths[AVATAR_SIZES[-1]]
+
+
+# Thumbnail paths written by save_avatar; anything else in
+# users.profile_picture is an original saved before the avatar store existed
+AVATAR_NAME = re.compile(r"[0-9a-f]{64}_\d+\.webp$")
+
+
+@functools.lru_cache(maxsize=1024)
+def legacy_avatar(profile_picture):
+    # Makes the thumbnails of an original picture on first use and points
+    # its users rows at them; None when the original cannot be read
+    data = storage.get_store().get(profile_picture)
+    if data is None:
+        return None
+    try:
+        path = save_avatar(data)
+    except ValueError:
+        return None
+    db.execute("UPDATE users SET profile_picture = ? WHERE profile_picture = ?", (path, profile_picture))
+    cache.invalidate("users")
+    return path
+
+
+def avatar_path(profile_picture, size=AVATAR_SIZES[-1]):
+    # Path of one thumbnail size, None when there is no usable picture
+    if not profile_picture:
+        return None
+    if not AVATAR_NAME.search(profile_picture):
+        profile_picture = legacy_avatar(profile_picture)
+        if profile_picture is None:
+            return None
+    path = re.sub(r"_\d+\.webp$", f"_{size}.webp", profile_picture)
+    return path if storage.get_store().exists(path) else None
+
+
+@functools.lru_cache(maxsize=None)
+def placeholder_avatar(size):
+    # Plain square shown in place of a picture that cannot be read
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (200, 200, 200)).save(buffer, "WEBP", quality=AVATAR_QUALITY)
+    return buffer.getvalue()
+
+
+# Avatar paths are content addressed, so a cached thumbnail never goes stale
+@functools.lru_cache(maxsize=1024)
+def avatar_bytes(profile_picture, size=AVATAR_SIZES[-1]):
+    # None for users without a picture
+    if not profile_picture:
+        return None
+    path = avatar_path(profile_picture, size)
+    data = storage.get_store().get(path) if path else None
+    return data if data is not None else placeholder_avatar(size)
+
+
+@functools.lru_cache(maxsize=1024)
+def avatar_data_url(profile_picture, size=AVATAR_SIZES[0]):
+    # Inline thumbnail for table image columns
+    data = avatar_bytes(profile_picture, size)
+    if data is None:
+        return None
+    return f"data:image/webp;base64,{base64.b64encode(data).decode()}"
+
+
+# python -m healthcare.media [database]
+# Makes the thumbnails of every profile picture saved before the avatar
+# store ahead of time, instead of on first view
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        db.configure(sys.argv[1])
+
+    for (profile_picture,) in db.query("SELECT DISTINCT profile_picture FROM users WHERE profile_picture IS NOT NULL"):
+        if not AVATAR_NAME.search(profile_picture):
+            print(f"{profile_picture} -> {legacy_avatar(profile_picture) or 'unreadable, shown as a placeholder'}")
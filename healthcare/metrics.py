@@ -0,0 +1,217 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Where each app writes its aggregated timings, and how often
+METRICS_DIR = os.environ.get("HEALTHCARE_METRICS_DIR", "metrics")
+FLUSH_SECONDS = float(os.environ.get("HEALTHCARE_METRICS_FLUSH_SECONDS", "10"))
+# Profiles of single reruns, loadable with pstats or snakeviz
+PROFILE_DIR = os.environ.get("HEALTHCARE_PROFILE_DIR", "profiles")
+# Newest profiles kept there; older ones are deleted
+MAX_PROFILES = int(os.environ.get("HEALTHCARE_MAX_PROFILES", "20"))
+# Lets ?profile=1 profile a rerun for any visitor, not just a logged-in
+# admin (development only)
+PROFILE_FROM_URL = os.environ.get("HEALTHCARE_PROFILE_FROM_URL", "0") == "1"
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+
+# Spans recorded outside any page (fragments, background threads)
+NO_PAGE = "-"
+
+_lock = threading.Lock()
+_local = threading.local()
+_histograms = {}
+_app = None
+_last_flush = time.monotonic()
+last_profile = {}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, milliseconds):
+        for bucket, bound in enumerate(BUCKETS_MS):
+            if milliseconds <= bound:
+                self.counts[bucket] += 1
+                break
+        self.count += 1
+        self.total_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile (the max for the last one)
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(BUCKETS_MS[bucket], self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": dict(zip(map(str, BUCKETS_MS), self.counts)),
+        }
+
+
+def configure(app):
+    # Names the export file, metrics/<app>.json
+    global _app
+    _app = app
+
+
+def record(name, milliseconds, page=None):
+    key = (page or getattr(_local, "page", None) or NO_PAGE, name)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.add(milliseconds)
+
+
+@contextmanager
+def span(name):
+    # Time a block under the current page
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+@contextmanager
+def page(name, profile=False):
+    # Time a whole page render; spans inside it are grouped under the page.
+    # With profile=True the render also runs under cProfile.
+    if getattr(_local, "page", None) is not None:
+        with span(name):
+            yield
+        return
+
+    _local.page = name
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            _save_profile(name, profiler)
+        record("render", (time.perf_counter() - start) * 1000)
+        _local.page = None
+        maybe_flush()
+
+
+def timed(name):
+    # Decorator: a span inside a page, or a page of its own when called
+    # outside one (e.g. a fragment rerunning by itself)
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with page(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _save_profile(name, profiler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = "".join(char if char.isalnum() else "_" for char in name)
+    path = os.path.join(PROFILE_DIR, f"{safe_name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    profiler.dump_stats(path)
+
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(30)
+    last_profile[name] = {"path": path, "text": text.getvalue()}
+
+    profiles = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof")),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:-MAX_PROFILES]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def snapshot():
+    # {page: {span: summary}}
+    with _lock:
+        items = [(page_name, name, histogram.summary()) for (page_name, name), histogram in _histograms.items()]
+    pages = {}
+    for page_name, name, summary in sorted(items):
+        pages.setdefault(page_name, {})[name] = summary
+    return pages
+
+
+def flush():
+    if _app is None:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{_app}.json")
+    partial_path = f"{path}.{os.getpid()}.partial"
+    with open(partial_path, "w", encoding="utf-8") as file:
+        json.dump({"app": _app, "pid": os.getpid(), "written_at": time.time(), "pages": snapshot()}, file, indent=1)
+    os.replace(partial_path, path)
+
+
+def maybe_flush():
+    global _last_flush
+    now = time.monotonic()
+    if now - _last_flush >= FLUSH_SECONDS:
+        _last_flush = now
+        flush()
+
+
+def load_exported():
+    # {app: exported metrics} from every file in METRICS_DIR
+    exported = {}
+    if os.path.isdir(METRICS_DIR):
+        for name in sorted(os.listdir(METRICS_DIR)):
+            if name.endswith(".json"):
+                with open(os.path.join(METRICS_DIR, name), encoding="utf-8") as file:
+                    data = json.load(file)
+                exported[data["app"]] = data
+    return exported
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+# python -m healthcare.metrics [metrics/admin.json ...]
+# Prints the slowest spans of each page from exported metrics files
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        files = []
+        for path in sys.argv[1:]:
+            with open(path, encoding="utf-8") as file:
+                files.append(json.load(file))
+    else:
+        files = load_exported().values()
+    for exported in files:
+        for page_name, spans in exported["pages"].items():
+            print(f"{exported['app']} {page_name}")
+            for name, summary in sorted(spans.items(), key=lambda item: -item[1]["count"] * (item[1]["mean_ms"] or 0)):
+                print(f"  {name:28} count={summary['count']}  mean_ms={summary['mean_ms']}  "
+                      f"p95_ms={summary['p95_ms']}  p99_ms={summary['p99_ms']}  max_ms={summary['max_ms']}")
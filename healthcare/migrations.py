@@ -0,0 +1,407 @@
+import sys
+
+from healthcare import db
+
+# Age group of a users row in the patient_stats rollup
+AGE_GROUP = ("CASE WHEN {row}.age < 18 THEN '0-17' WHEN {row}.age < 30 THEN '18-29' WHEN {row}.age < 45 THEN '30-44' "
+             "WHEN {row}.age < 65 THEN '45-64' ELSE '65+' END")
+
+# Ordered schema changes; the applied version is kept in PRAGMA user_version.
+# Never edit a released migration, append a new one instead.
+MIGRATIONS = [
+    (1, "Core tables", [
+        '''CREATE TABLE IF NOT EXISTS users
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           username TEXT UNIQUE NOT NULL,
+           password TEXT NOT NULL,
+           name TEXT NOT NULL,
+           age INTEGER NOT NULL,
+           gender TEXT NOT NULL,
+           profile_picture TEXT,
+           address TEXT NOT NULL,
+           user_type TEXT NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS consultations
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           patient_id INTEGER NOT NULL,
+           consultation_type TEXT NOT NULL,
+           symptoms TEXT,
+           history_of_illness TEXT,
+           blood_group TEXT,
+           comments TEXT,
+           status TEXT NOT NULL,
+           doctor_comments TEXT,
+           FOREIGN KEY (patient_id) REFERENCES users (id))''',
+        '''CREATE TABLE IF NOT EXISTS chat_messages
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           consultation_id INTEGER NOT NULL,
+           sender TEXT NOT NULL,
+           message TEXT NOT NULL,
+           timestamp TEXT NOT NULL,
+           FOREIGN KEY (consultation_id) REFERENCES consultations (id))''',
+    ]),
+
+    (2, "Knowledge base and its change log", [
+        '''CREATE TABLE IF NOT EXISTS knowledge_base
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           question TEXT NOT NULL,
+           answer TEXT NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS knowledge_base_changes
+           (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+           entry_id INTEGER NOT NULL)''',
+        '''CREATE TRIGGER IF NOT EXISTS knowledge_base_ai AFTER INSERT ON knowledge_base
+           BEGIN INSERT INTO knowledge_base_changes (entry_id) VALUES (new.id); END''',
+        '''CREATE TRIGGER IF NOT EXISTS knowledge_base_au AFTER UPDATE OF question ON knowledge_base
+           BEGIN INSERT INTO knowledge_base_changes (entry_id) VALUES (new.id); END''',
+        '''CREATE TRIGGER IF NOT EXISTS knowledge_base_ad AFTER DELETE ON knowledge_base
+           BEGIN INSERT INTO knowledge_base_changes (entry_id) VALUES (old.id); END''',
+    ]),
+
+    # Logins look users up through the UNIQUE index on username, so only
+    # the listing paths need new indexes
+    (3, "Indexes for dashboard, consultation and chat queries", [
+        "CREATE INDEX IF NOT EXISTS idx_users_type ON users (user_type, id)",
+        "CREATE INDEX IF NOT EXISTS idx_consultations_type ON consultations (consultation_type, id)",
+        "CREATE INDEX IF NOT EXISTS idx_consultations_patient ON consultations (patient_id, consultation_type, id)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_consultation ON chat_messages (consultation_id, id)",
+    ]),
+
+    # idx_consultations_created serves the archive's age scan; date filters
+    # on the consultation lists use the indexes from migration 11
+    (4, "Consultation submission time and status filter", [
+        "ALTER TABLE consultations ADD COLUMN created_at TEXT",
+        "UPDATE consultations SET created_at = datetime('now') WHERE created_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_consultations_created ON consultations (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_consultations_status ON consultations (consultation_type, status, id)",
+    ]),
+
+    (5, "Transcoded consultation recordings", [
+        '''CREATE TABLE IF NOT EXISTS recordings
+           (consultation_id INTEGER NOT NULL,
+           role TEXT NOT NULL,
+           path TEXT NOT NULL,
+           preview_path TEXT NOT NULL,
+           thumbnail_path TEXT NOT NULL,
+           duration REAL NOT NULL,
+           size INTEGER NOT NULL,
+           preview_size INTEGER NOT NULL,
+           width INTEGER NOT NULL,
+           height INTEGER NOT NULL,
+           created_at TEXT NOT NULL,
+           PRIMARY KEY (consultation_id, role),
+           FOREIGN KEY (consultation_id) REFERENCES consultations (id))''',
+    ]),
+
+    # The partial index holds exactly the unclaimed queue in the order doctors
+    # take it, so claiming the next consultation is one index seek
+    (6, "Triage priority and doctor assignment", [
+        "ALTER TABLE consultations ADD COLUMN priority INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE consultations ADD COLUMN assigned_doctor_id INTEGER REFERENCES users (id)",
+        "ALTER TABLE consultations ADD COLUMN claimed_at TEXT",
+        '''CREATE INDEX IF NOT EXISTS idx_consultations_queue ON consultations (consultation_type, priority DESC, id)
+           WHERE status = 'Processing' AND assigned_doctor_id IS NULL''',
+        "CREATE INDEX IF NOT EXISTS idx_consultations_doctor ON consultations (assigned_doctor_id, consultation_type, id)",
+    ]),
+
+    # External-content FTS5 indexes: the text stays in the original tables and
+    # the triggers keep the indexes in step with every insert, update and delete
+    (7, "Full-text search over consultations and chat messages", [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS consultations_fts USING fts5
+           (symptoms, history_of_illness, comments, doctor_comments,
+           content='consultations', content_rowid='id', tokenize='porter unicode61')''',
+        '''CREATE TRIGGER IF NOT EXISTS consultations_fts_ai AFTER INSERT ON consultations BEGIN
+             INSERT INTO consultations_fts (rowid, symptoms, history_of_illness, comments, doctor_comments)
+             VALUES (new.id, new.symptoms, new.history_of_illness, new.comments, new.doctor_comments);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS consultations_fts_ad AFTER DELETE ON consultations BEGIN
+             INSERT INTO consultations_fts (consultations_fts, rowid, symptoms, history_of_illness, comments,
+                                            doctor_comments)
+             VALUES ('delete', old.id, old.symptoms, old.history_of_illness, old.comments, old.doctor_comments);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS consultations_fts_au
+           AFTER UPDATE OF symptoms, history_of_illness, comments, doctor_comments ON consultations BEGIN
+             INSERT INTO consultations_fts (consultations_fts, rowid, symptoms, history_of_illness, comments,
+                                            doctor_comments)
+             VALUES ('delete', old.id, old.symptoms, old.history_of_illness, old.comments, old.doctor_comments);
+             INSERT INTO consultations_fts (rowid, symptoms, history_of_illness, comments, doctor_comments)
+             VALUES (new.id, new.symptoms, new.history_of_illness, new.comments, new.doctor_comments);
+           END''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5
+           (message, content='chat_messages', content_rowid='id', tokenize='porter unicode61')''',
+        '''CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+             INSERT INTO chat_messages_fts (rowid, message) VALUES (new.id, new.message);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+             INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF message ON chat_messages BEGIN
+             INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+             INSERT INTO chat_messages_fts (rowid, message) VALUES (new.id, new.message);
+           END''',
+        # Matches in the symptoms count most, then the doctor's comments
+        "INSERT INTO consultations_fts (consultations_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 1.0, 1.5)')",
+        # Index what is already there
+        "INSERT INTO consultations_fts (consultations_fts) VALUES ('rebuild')",
+        "INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')",
+    ]),
+
+    # Summary tables for the admin dashboard, kept current by triggers. The
+    # consultation, response and message rollups are history and are not
+    # reduced when rows are deleted; the patient mix follows the users table.
+    (8, "Analytics rollups", [
+        "ALTER TABLE consultations ADD COLUMN first_available_at TEXT",
+        '''CREATE TABLE IF NOT EXISTS consultation_stats
+           (day TEXT NOT NULL,
+           consultation_type TEXT NOT NULL,
+           status TEXT NOT NULL,
+           consultations INTEGER NOT NULL,
+           PRIMARY KEY (day, consultation_type, status)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS response_stats
+           (day TEXT NOT NULL,
+           consultation_type TEXT NOT NULL,
+           responses INTEGER NOT NULL,
+           total_seconds REAL NOT NULL,
+           max_seconds REAL NOT NULL,
+           PRIMARY KEY (day, consultation_type)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS message_stats
+           (day TEXT NOT NULL PRIMARY KEY,
+           messages INTEGER NOT NULL,
+           conversations INTEGER NOT NULL) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS patient_stats
+           (age_group TEXT NOT NULL,
+           gender TEXT NOT NULL,
+           patients INTEGER NOT NULL,
+           PRIMARY KEY (age_group, gender)) WITHOUT ROWID''',
+
+        # Consultations per submission day, type and current status
+        '''CREATE TRIGGER IF NOT EXISTS consultation_stats_ai AFTER INSERT ON consultations BEGIN
+             INSERT INTO consultation_stats VALUES (COALESCE(date(new.created_at), date('now')), new.consultation_type,
+                                                   new.status, 1)
+             ON CONFLICT DO UPDATE SET consultations = consultations + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS consultation_stats_au AFTER UPDATE OF status ON consultations
+           WHEN old.status IS NOT new.status BEGIN
+             INSERT INTO consultation_stats VALUES (COALESCE(date(old.created_at), date('now')), old.consultation_type,
+                                                   old.status, -1)
+             ON CONFLICT DO UPDATE SET consultations = consultations - 1;
+             INSERT INTO consultation_stats VALUES (COALESCE(date(new.created_at), date('now')), new.consultation_type,
+                                                   new.status, 1)
+             ON CONFLICT DO UPDATE SET consultations = consultations + 1;
+           END''',
+
+        # Time from submission until a doctor first made the consultation available
+        '''CREATE TRIGGER IF NOT EXISTS response_stats_au AFTER UPDATE OF status ON consultations
+           WHEN new.status = 'Available' AND old.status IS NOT 'Available' AND new.first_available_at IS NULL
+           AND new.created_at IS NOT NULL BEGIN
+             UPDATE consultations SET first_available_at = datetime('now') WHERE id = new.id;
+             INSERT INTO response_stats
+             VALUES (date('now'), new.consultation_type, 1, (julianday('now') - julianday(new.created_at)) * 86400,
+                     (julianday('now') - julianday(new.created_at)) * 86400)
+             ON CONFLICT DO UPDATE SET responses = responses + 1, total_seconds = total_seconds + excluded.total_seconds,
+                                       max_seconds = max(max_seconds, excluded.max_seconds);
+           END''',
+
+        # Messages per day, and conversations by the day of their first message
+        '''CREATE TRIGGER IF NOT EXISTS message_stats_ai AFTER INSERT ON chat_messages BEGIN
+             INSERT INTO message_stats
+             VALUES (COALESCE(date(new.timestamp), date('now')), 1,
+                     NOT EXISTS (SELECT 1 FROM chat_messages WHERE consultation_id = new.consultation_id AND id < new.id))
+             ON CONFLICT DO UPDATE SET messages = messages + 1, conversations = conversations + excluded.conversations;
+           END''',
+
+        # Patients by age group and gender
+        f'''CREATE TRIGGER IF NOT EXISTS patient_stats_ai AFTER INSERT ON users WHEN new.user_type = 'patient' BEGIN
+             INSERT INTO patient_stats VALUES ({AGE_GROUP.format(row="new")}, new.gender, 1)
+             ON CONFLICT DO UPDATE SET patients = patients + 1;
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS patient_stats_ad AFTER DELETE ON users WHEN old.user_type = 'patient' BEGIN
+             UPDATE patient_stats SET patients = patients - 1
+             WHERE age_group = {AGE_GROUP.format(row="old")} AND gender = old.gender;
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS patient_stats_au AFTER UPDATE OF age, gender, user_type ON users BEGIN
+             UPDATE patient_stats SET patients = patients - 1
+             WHERE old.user_type = 'patient' AND age_group = {AGE_GROUP.format(row="old")} AND gender = old.gender;
+             INSERT INTO patient_stats SELECT {AGE_GROUP.format(row="new")}, new.gender, 1 WHERE new.user_type = 'patient'
+             ON CONFLICT DO UPDATE SET patients = patients + 1;
+           END''',
+
+        # Counts for the rows already there
+        '''INSERT INTO consultation_stats
+           SELECT COALESCE(date(created_at), date('now')), consultation_type, status, COUNT(*)
+           FROM consultations GROUP BY 1, 2, 3''',
+        '''INSERT INTO message_stats
+           SELECT COALESCE(date(timestamp), date('now')), COUNT(*), SUM(first)
+           FROM (SELECT timestamp, id = MIN(id) OVER (PARTITION BY consultation_id) AS first FROM chat_messages)
+           GROUP BY 1''',
+        f'''INSERT INTO patient_stats
+           SELECT {AGE_GROUP.format(row="users")}, gender, COUNT(*) FROM users WHERE user_type = 'patient' GROUP BY 1, 2''',
+    ]),
+
+    # One row per consultation moved to the Parquet archive, so lists stay
+    # cheap and the partition holding its details is known without a search
+    (9, "Archived consultation index", [
+        '''CREATE TABLE IF NOT EXISTS archived_consultations
+           (id INTEGER PRIMARY KEY,
+           patient_id INTEGER NOT NULL,
+           consultation_type TEXT NOT NULL,
+           status TEXT NOT NULL,
+           created_at TEXT,
+           partition TEXT NOT NULL,
+           archived_at TEXT NOT NULL)''',
+        "CREATE INDEX IF NOT EXISTS idx_archived_patient ON archived_consultations (patient_id, consultation_type, id)",
+    ]),
+
+    # The consultation type is indexed too, so a search by type is filtered
+    # inside the FTS query rather than after ranking
+    (10, "Consultation type in the consultation search index", [
+        "DROP TRIGGER IF EXISTS consultations_fts_ai",
+        "DROP TRIGGER IF EXISTS consultations_fts_ad",
+        "DROP TRIGGER IF EXISTS consultations_fts_au",
+        "DROP TABLE IF EXISTS consultations_fts",
+        '''CREATE VIRTUAL TABLE consultations_fts USING fts5
+           (symptoms, history_of_illness, comments, doctor_comments, consultation_type,
+           content='consultations', content_rowid='id', tokenize='porter unicode61')''',
+        '''CREATE TRIGGER consultations_fts_ai AFTER INSERT ON consultations BEGIN
+             INSERT INTO consultations_fts (rowid, symptoms, history_of_illness, comments, doctor_comments,
+                                            consultation_type)
+             VALUES (new.id, new.symptoms, new.history_of_illness, new.comments, new.doctor_comments,
+                     new.consultation_type);
+           END''',
+        '''CREATE TRIGGER consultations_fts_ad AFTER DELETE ON consultations BEGIN
+             INSERT INTO consultations_fts (consultations_fts, rowid, symptoms, history_of_illness, comments,
+                                            doctor_comments, consultation_type)
+             VALUES ('delete', old.id, old.symptoms, old.history_of_illness, old.comments, old.doctor_comments,
+                     old.consultation_type);
+           END''',
+        '''CREATE TRIGGER consultations_fts_au
+           AFTER UPDATE OF symptoms, history_of_illness, comments, doctor_comments, consultation_type
+           ON consultations BEGIN
+             INSERT INTO consultations_fts (consultations_fts, rowid, symptoms, history_of_illness, comments,
+                                            doctor_comments, consultation_type)
+             VALUES ('delete', old.id, old.symptoms, old.history_of_illness, old.comments, old.doctor_comments,
+                     old.consultation_type);
+             INSERT INTO consultations_fts (rowid, symptoms, history_of_illness, comments, doctor_comments,
+                                            consultation_type)
+             VALUES (new.id, new.symptoms, new.history_of_illness, new.comments, new.doctor_comments,
+                     new.consultation_type);
+           END''',
+        # The type only filters; it adds nothing to a match's score
+        "INSERT INTO consultations_fts (consultations_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 1.0, 1.5, 0.0)')",
+        "INSERT INTO consultations_fts (consultations_fts) VALUES ('rebuild')",
+    ]),
+
+    # Date filters compare created_at directly, since rows imported by
+    # transfer or backfilled are not numbered in submission order
+    (11, "Consultation list date filters", [
+        '''CREATE INDEX IF NOT EXISTS idx_consultations_patient_created
+           ON consultations (patient_id, consultation_type, created_at)''',
+        "CREATE INDEX IF NOT EXISTS idx_consultations_type_created ON consultations (consultation_type, created_at)",
+    ]),
+]
+
+# Queries run on every page render; none of them may fall back to a table scan
+HOT_QUERIES = {
+    "login": ("SELECT * FROM users WHERE username = ?", ("user",)),
+    "admin patient list": ("SELECT * FROM users WHERE user_type = 'patient'", ()),
+    "admin consultations": ("SELECT * FROM consultations WHERE consultation_type = ?", ("chat",)),
+    "patient consultations": ("SELECT * FROM consultations WHERE patient_id = ? AND consultation_type = ?",
+                              (1, "chat")),
+    "admin patient page": ("SELECT id, name FROM users WHERE user_type = 'patient' AND id > ? ORDER BY id LIMIT ?",
+                           (0, 51)),
+    "admin consultation page": ("""SELECT id, status FROM consultations
+                                   WHERE consultation_type = ? AND status = ?
+                                   AND created_at >= ? AND created_at < date(?, '+1 day')
+                                   AND id < ? ORDER BY id DESC LIMIT ?""",
+                                ("chat", "Processing", "2024-01-01", "2024-01-31", 100, 21)),
+    # The admin list filtered to one patient (consultations.list_consultations)
+    "admin consultation page for a patient": ("""SELECT id, status FROM consultations
+                                                 WHERE consultation_type = ? AND patient_id = ?
+                                                 AND created_at >= ? AND created_at < date(?, '+1 day')
+                                                 AND id < ? ORDER BY id DESC LIMIT ?""",
+                                              ("chat", 1, "2024-01-01", "2024-01-31", 100, 21)),
+    "chat history": ("SELECT * FROM chat_messages WHERE consultation_id = ?", (1,)),
+    "chat poll": ("SELECT id FROM chat_messages WHERE consultation_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                  (1, 0, 50)),
+    "chat history page": ("""SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY consultation_id ORDER BY id DESC) AS rank
+                                            FROM chat_messages WHERE consultation_id IN (?, ?))
+                             WHERE rank <= ?""", (1, 2, 50)),
+    "recordings page": ("SELECT * FROM recordings WHERE consultation_id IN (?, ?)", (1, 2)),
+    "triage queue": ("""SELECT id FROM consultations
+                        WHERE consultation_type = ? AND status = 'Processing' AND assigned_doctor_id IS NULL
+                        ORDER BY priority DESC, id LIMIT ?""", ("chat", 20)),
+    "claim next": ("""UPDATE consultations SET assigned_doctor_id = ?, claimed_at = datetime('now')
+                      WHERE id = (SELECT id FROM consultations
+                                  WHERE consultation_type = ? AND status = 'Processing' AND assigned_doctor_id IS NULL
+                                  ORDER BY priority DESC, id LIMIT 1)
+                      RETURNING id""", (1, "chat")),
+    "consultation search": ("""SELECT c.id FROM consultations_fts JOIN consultations c ON c.id = consultations_fts.rowid
+                               WHERE consultations_fts MATCH ? AND consultations_fts.rowid <= ?
+                               AND consultations_fts.rowid > ? ORDER BY rank LIMIT ?""",
+                            ('{symptoms history_of_illness comments doctor_comments} : ("fever") '
+                             'AND consultation_type : "chat"', 2 ** 63 - 1, 0, 21)),
+    "message search": ("""SELECT m.id FROM chat_messages_fts JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+                          WHERE chat_messages_fts MATCH ? ORDER BY rank LIMIT ?""", ('"fever"', 21)),
+    "patient archive": ("SELECT * FROM archived_consultations WHERE patient_id = ? AND consultation_type = ?",
+                        (1, "chat")),
+    "doctor consultations": ("SELECT id FROM consultations WHERE assigned_doctor_id = ? AND consultation_type = ?",
+                             (1, "chat")),
+}
+
+_migrated = set()
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    # Apply pending migrations once per database per process
+    if db.DB_PATH in _migrated:
+        return
+    with db.connection() as conn:
+        if current_version(conn) < MIGRATIONS[-1][0]:
+            for version, _, statements in MIGRATIONS:
+                with db.transaction():
+                    # Re-check under the write lock in case another app got there first
+                    if current_version(conn) >= version:
+                        continue
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {version}")
+    _migrated.add(db.DB_PATH)
+
+
+def query_plan(sql, params=()):
+    with db.connection() as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def full_scans():
+    # Hot queries whose plan scans a table instead of searching an index
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for detail in query_plan(sql, params):
+            # "SCAN (subquery-N)" reads an already-filtered intermediate result
+            if detail.startswith("SCAN") and not detail.startswith("SCAN (") and "INDEX" not in detail:
+                problems.append((name, detail))
+    return problems
+
+
+# python -m healthcare.migrations [--check] [database]
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    check = "--check" in args
+    args = [arg for arg in args if arg != "--check"]
+    if args:
+        db.configure(args[0])
+
+    migrate()
+    with db.connection() as conn:
+        print(f"{db.DB_PATH} is at schema version {current_version(conn)}")
+
+    if check:
+        problems = full_scans()
+        for name, detail in problems:
+            print(f"{name}: {detail}")
+        if problems:
+            sys.exit("Hot queries are not using an index")
+        print("All hot queries use an index")
@@ -0,0 +1,208 @@
+import os
+import queue
+import sys
+import threading
+import time
+
+# Recording defaults, overridable per deployment
+RECORD_SECONDS = float(os.environ.get("HEALTHCARE_RECORD_SECONDS", "60"))
+RECORD_FPS = float(os.environ.get("HEALTHCARE_RECORD_FPS", "20"))
+RECORD_WIDTH = int(os.environ.get("HEALTHCARE_RECORD_WIDTH", "640"))
+RECORD_HEIGHT = int(os.environ.get("HEALTHCARE_RECORD_HEIGHT", "480"))
+CAMERA_INDEX = int(os.environ.get("HEALTHCARE_CAMERA_INDEX", "0"))
+# "camera", or "synthetic" to record a test pattern on machines without one
+VIDEO_SOURCE = os.environ.get("HEALTHCARE_VIDEO_SOURCE", "camera")
+
+# Frames buffered between capture and encoding; when the encoder falls this
+# far behind, new frames are dropped instead of stalling the camera
+FRAME_QUEUE_SIZE = 64
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+# OpenCV is imported by the functions that need it, so pages that only show
+# recording controls do not pay for it
+
+def camera_source(index=CAMERA_INDEX):
+    # Frames from a local camera; the camera is released when the recorder stops
+    import cv2
+
+    cap = cv2.VideoCapture(index)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+
+def synthetic_source(width=RECORD_WIDTH, height=RECORD_HEIGHT):
+    # Endless moving test pattern, for trying the pipeline without a camera
+    import cv2
+    import numpy as np
+
+    frame_number = 0
+    while True:
+        frame = np.zeros((height, width, 3), np.uint8)
+        x = frame_number * 8 % width
+        frame[:, x:x + 16] = (0, 255, 0)
+        cv2.putText(frame, str(frame_number), (16, height - 16), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        yield frame
+        frame_number += 1
+
+
+def default_source():
+    return synthetic_source() if VIDEO_SOURCE == "synthetic" else camera_source()
+
+
+class Recorder:
+    # Records frames from a source to an mp4 file on background threads: one
+    # thread captures at a fixed frame rate, the other encodes. The file only
+    # appears at `path` once it is complete.
+
+    def __init__(self, path, source=None, seconds=RECORD_SECONDS, fps=RECORD_FPS,
+                 width=RECORD_WIDTH, height=RECORD_HEIGHT, realtime=True, on_complete=None):
+        self.path = path
+        # Called with the path once the file is in place
+        self.on_complete = on_complete
+        self.source = source if source is not None else default_source()
+        self.total_frames = max(1, int(seconds * fps))
+        self.fps = fps
+        self.size = (width, height)
+        self.realtime = realtime
+
+        self.frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.frames_captured = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.error = None
+        self.started_at = None
+        self.threads = []
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.threads = [threading.Thread(target=self._capture, name=f"capture {self.path}", daemon=True),
+                        threading.Thread(target=self._encode, name=f"encode {self.path}", daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        # Ends the recording early; what was captured so far is kept
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+        return not self.running
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    @property
+    def elapsed(self):
+        return self.frames_captured / self.fps
+
+    def _capture(self):
+        frames = iter(self.source)
+        next_frame_at = time.monotonic()
+        try:
+            while self.frames_captured < self.total_frames and not self.stop_event.is_set():
+                if self.realtime:
+                    # Pace capture to the configured frame rate, whatever the source delivers
+                    delay = next_frame_at - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_frame_at += 1 / self.fps
+
+                frame = next(frames, None)
+                if frame is None:
+                    break
+                self.frames_captured += 1
+                try:
+                    self.frames.put_nowait(frame)
+                except queue.Full:
+                    self.frames_dropped += 1
+        except Exception as error:
+            self.error = error
+        finally:
+            close = getattr(frames, "close", None)
+            if close:
+                close()
+            # Tell the encoder there is nothing more to come. An encoder that
+            # failed no longer reads the queue, so stop waiting once it is gone.
+            while True:
+                try:
+                    self.frames.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    if not self.threads[1].is_alive():
+                        break
+
+    def _encode(self):
+        root, extension = os.path.splitext(self.path)
+        partial_path = f"{root}.recording{extension}"
+        out = None
+        try:
+            import cv2
+
+            out = cv2.VideoWriter(partial_path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, self.size)
+            if not out.isOpened():
+                raise OSError(f"Could not open {partial_path} for writing")
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                if (frame.shape[1], frame.shape[0]) != self.size:
+                    frame = cv2.resize(frame, self.size)
+                out.write(frame)
+                self.frames_written += 1
+        except Exception as error:
+            self.error = error
+            self.stop_event.set()
+        finally:
+            if out is not None:
+                out.release()
+
+        # Errors here are reported like encoding errors, not lost with the thread
+        try:
+            if self.frames_written and self.error is None:
+                os.replace(partial_path, self.path)
+                if self.on_complete:
+                    self.on_complete(self.path)
+        except Exception as error:
+            self.error = error
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def start_recording(path, **options):
+    # Start recording to `path` unless a recording to it is already running
+    with _recorders_lock:
+        recorder = _recorders.get(path)
+        if recorder is None or not recorder.running:
+            recorder = _recorders[path] = Recorder(path, **options).start()
+        return recorder
+
+
+def get_recording(path):
+    return _recorders.get(path)
+
+
+# python -m healthcare.recording [seconds] [output.mp4]
+# Records the synthetic test pattern and reports how the pipeline kept up
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    path = sys.argv[2] if len(sys.argv) > 2 else "recording_check.mp4"
+
+    recorder = Recorder(path, synthetic_source(), seconds=seconds).start()
+    recorder.join()
+    if recorder.error:
+        sys.exit(f"Recording failed: {recorder.error}")
+    print(f"{path}: {recorder.frames_written} frames written, {recorder.frames_dropped} dropped "
+          f"of {recorder.total_frames} in {time.monotonic() - recorder.started_at:.1f}s")
@@ -0,0 +1,146 @@
+import argparse
+import re
+
+from healthcare import cache, db, migrations
+
+# Results per page of the admin search
+PAGE_SIZE = 10
+
+# Words of context shown around the matches in a snippet
+SNIPPET_TOKENS = 16
+
+# Marks around matched words in snippets; the page turns them into bold
+# text after escaping the rest
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+# Ranking scores every match, so matches are ranked RANK_WINDOW at a time,
+# newest first: a word found in half the chat history then costs the same
+# per page as a rare one, and older matches follow on later pages
+RANK_WINDOW = 500
+
+# Searched columns of consultations_fts; consultation_type only filters
+CONSULTATION_TEXT_COLUMNS = "{symptoms history_of_illness comments doctor_comments}"
+
+CONSULTATION_COLUMNS = ("id", "patient_id", "consultation_type", "status", "created_at", "snippet")
+MESSAGE_COLUMNS = ("id", "consultation_id", "sender", "timestamp", "snippet")
+
+# Upper bound of the first window: the largest possible rowid
+MAX_ROWID = 2 ** 63 - 1
+
+
+def match_expression(text):
+    # FTS5 query for what the user typed: every word has to match, a word
+    # ending in * as a prefix. Each word is quoted, so punctuation and FTS5
+    # keywords in the input are searched for rather than parsed.
+    words = re.findall(r"(\w+)(\*?)", text or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"{star}' for word, star in words)
+
+
+def _ranked(table, select, expression, params, cursor, limit):
+    # One page of `select` results, best match first within each window of
+    # RANK_WINDOW matches. The cursor is (newest rowid of the window, offset
+    # into it); the next page's cursor is returned with the rows, None on the
+    # last page. FTS5 walks the matches by rowid and stops at the window's end.
+    upto, offset = cursor or (MAX_ROWID, 0)
+    rows = []
+    while True:
+        # The newest match older than this window, None when it is the last
+        boundary = db.query_one(f"SELECT rowid FROM {table} WHERE {table} MATCH ? AND rowid <= ? "
+                                f"ORDER BY rowid DESC LIMIT 1 OFFSET ?", (expression, upto, RANK_WINDOW))
+        needed = limit - len(rows)
+        page = db.query(f"{select} AND {table}.rowid <= ? AND {table}.rowid > ? ORDER BY rank LIMIT ? OFFSET ?",
+                        (*params, upto, boundary[0] if boundary else 0, needed + 1, offset))
+        rows.extend(page[:needed])
+        if len(page) > needed:
+            return rows, (upto, offset + needed)
+        if boundary is None:
+            return rows, None
+        if len(rows) == limit:
+            return rows, (boundary[0], 0)
+        upto, offset = boundary[0], 0
+
+
+@cache.cached("consultations")
+def search_consultations(text, consultation_type=None, cursor=None, limit=PAGE_SIZE):
+    # One page of consultations matching `text`, returned with the cursor of
+    # the next page (None on the last page)
+    expression = match_expression(text)
+    if expression is None:
+        return [], None
+    # The type is part of the FTS query, so windows only count matches of that type
+    expression = f"{CONSULTATION_TEXT_COLUMNS} : ({expression})"
+    if consultation_type:
+        quoted = consultation_type.replace('"', '""')
+        expression += f' AND consultation_type : "{quoted}"'
+
+    rows, next_cursor = _ranked("consultations_fts", '''SELECT c.id, c.patient_id, c.consultation_type, c.status,
+                                                             c.created_at, snippet(consultations_fts, -1, ?, ?, '...', ?)
+                                                      FROM consultations_fts
+                                                      JOIN consultations c ON c.id = consultations_fts.rowid
+                                                      WHERE consultations_fts MATCH ?''',
+                                expression, (MATCH_START, MATCH_END, SNIPPET_TOKENS, expression), cursor, limit)
+    return [dict(zip(CONSULTATION_COLUMNS, row)) for row in rows], next_cursor
+
+
+@cache.cached("chat_messages")
+def search_messages(text, cursor=None, limit=PAGE_SIZE):
+    # Same as search_consultations() over the chat history
+    expression = match_expression(text)
+    if expression is None:
+        return [], None
+
+    rows, next_cursor = _ranked("chat_messages_fts", '''SELECT m.id, m.consultation_id, m.sender, m.timestamp,
+                                                             snippet(chat_messages_fts, 0, ?, ?, '...', ?)
+                                                      FROM chat_messages_fts
+                                                      JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+                                                      WHERE chat_messages_fts MATCH ?''',
+                                expression, (MATCH_START, MATCH_END, SNIPPET_TOKENS, expression), cursor, limit)
+    return [dict(zip(MESSAGE_COLUMNS, row)) for row in rows], next_cursor
+
+
+def rebuild():
+    # Re-index both tables from scratch, e.g. after editing the database by hand
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO consultations_fts (consultations_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('rebuild')")
+
+
+def optimize():
+    # Merge the index segments the triggers leave behind into one
+    with db.transaction() as conn:
+        conn.execute("INSERT INTO consultations_fts (consultations_fts) VALUES ('optimize')")
+        conn.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('optimize')")
+
+
+# python -m healthcare.search [--rebuild] [--optimize] [--database path] [words ...]
+def main():
+    parser = argparse.ArgumentParser(description="Search consultations and chat messages")
+    parser.add_argument("words", nargs="*")
+    parser.add_argument("--database", help="defaults to HEALTHCARE_DB")
+    parser.add_argument("--rebuild", action="store_true", help="re-index both tables first")
+    parser.add_argument("--optimize", action="store_true", help="merge the index segments first")
+    args = parser.parse_args()
+
+    if args.database:
+        db.configure(args.database)
+    migrations.migrate()
+    if args.rebuild:
+        rebuild()
+    if args.optimize:
+        optimize()
+    if not args.words:
+        return
+
+    text = " ".join(args.words)
+    for label, (rows, _) in (("consultations", search_consultations(text)), ("messages", search_messages(text))):
+        print(f"{label}:")
+        for row in rows:
+            snippet = row.pop("snippet").replace(MATCH_START, "[").replace(MATCH_END, "]")
+            print(f"  {row}\n    {snippet}")
+
+
+if __name__ == "__main__":
+    main()
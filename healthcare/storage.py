@@ -0,0 +1,456 @@
+import argparse
+import http.client
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from healthcare import auth
+
+# Where media files live: recordings, thumbnails, avatars and archive parts.
+# A directory (the default keeps them next to the app, as before), or the
+# http:// or https:// URL of an object server that app replicas share, such
+# as `python -m healthcare.storage serve`. Objects are named by the relative
+# paths the app always used, e.g. media/avatars/ab/<hash>_256.webp.
+MEDIA_STORE = os.environ.get("HEALTHCARE_MEDIA_STORE", ".")
+# Shared secret for the object server. Required unless the server only
+# listens on a loopback address.
+TOKEN = os.environ.get("HEALTHCARE_MEDIA_TOKEN")
+HOST = os.environ.get("HEALTHCARE_MEDIA_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("HEALTHCARE_MEDIA_SERVER_PORT", "8766"))
+REQUEST_TIMEOUT = 60
+# Where browsers reach the object server to play videos straight from it,
+# e.g. through the load balancer; defaults to the address of the store
+PUBLIC_URL = os.environ.get("HEALTHCARE_MEDIA_PUBLIC_URL")
+# Signed links to objects are valid for one to two of these periods. A link
+# stays the same for a whole period, so reruns do not reload the player.
+URL_SECONDS = int(os.environ.get("HEALTHCARE_MEDIA_URL_SECONDS", "3600"))
+# Bytes read or sent at a time when a whole file is copied, so a video never
+# has to fit in memory on either side
+CHUNK_SIZE = 1024 * 1024
+
+
+def normalize(key):
+    # "./consultation_1_doctor.mp4" and "consultation_1_doctor.mp4" are one object
+    return os.path.normpath(key).replace(os.sep, "/")
+
+
+class FileStore:
+    # Objects as files under a directory, which may be a shared mount
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, normalize(key))
+
+    def source(self, key):
+        # What a media player reads the object from: the file itself
+        return self.path(key)
+
+    def get(self, key):
+        # The object's bytes, None when there is no such object
+        try:
+            with open(self.path(key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def open(self, key):
+        # The object as an open binary file, None when there is no such object
+        try:
+            return open(self.path(key), "rb")
+        except FileNotFoundError:
+            return None
+
+    def get_file(self, key, destination):
+        # Copy an object to a local file
+        shutil.copyfile(self.path(key), destination)
+
+    def put(self, key, data):
+        self.put_stream(key, io.BytesIO(data), len(data))
+
+    def put_stream(self, key, stream, size):
+        # Written aside in chunks and renamed, so readers never see half an object
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial_path = f"{path}.{uuid.uuid4().hex[:8]}.partial"
+        try:
+            with open(partial_path, "wb") as file:
+                while size > 0:
+                    chunk = stream.read(min(size, CHUNK_SIZE))
+                    if not chunk:
+                        raise OSError(f"{key}: {size} bytes missing from the upload")
+                    file.write(chunk)
+                    size -= len(chunk)
+            os.replace(partial_path, path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    def put_file(self, key, source_path):
+        # Store a copy of a local file; nothing to do when it already is the object
+        if os.path.abspath(self.path(key)) == os.path.abspath(source_path):
+            return
+        with open(source_path, "rb") as file:
+            self.put_stream(key, file, os.fstat(file.fileno()).st_size)
+
+    def move_file(self, key, source_path):
+        # Store a local file; it is gone from source_path afterwards
+        self.put_file(key, source_path)
+        if os.path.abspath(self.path(key)) != os.path.abspath(source_path):
+            os.remove(source_path)
+
+    def version(self, key):
+        # Changes whenever the object is replaced; None when it is missing
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def copy(self, key, destination):
+        if not self.exists(key):
+            raise FileNotFoundError(key)
+        self.put_file(destination, self.path(key))
+
+    def keys(self, prefix):
+        # Names of the objects under a directory-like prefix, sorted
+        directory = self.path(prefix)
+        found = []
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.endswith(".partial"):
+                    found.append(normalize(os.path.join(prefix, os.path.relpath(os.path.join(root, name), directory))))
+        return sorted(found)
+
+
+class HTTPStore:
+    # Objects on an object server: GET, PUT, HEAD and DELETE /<key>, and
+    # GET /?prefix= for a JSON list of names
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.strip("/")
+        self.headers = {"Authorization": f"Bearer {TOKEN}"} if TOKEN else {}
+        self.public_url = (PUBLIC_URL or f"{parts.scheme}://{parts.netloc}").rstrip("/")
+        # One keep-alive connection per thread
+        self.local = threading.local()
+
+    def _name(self, key):
+        return "/".join(part for part in (self.prefix, normalize(key).lstrip("/")) if part)
+
+    def _send(self, method, path, body=None):
+        # The response, with its body still to be read before the next
+        # request. Every request is idempotent, so one retry covers a
+        # keep-alive connection the server has closed in the meantime. A file
+        # body is sent in blocks rather than read into memory.
+        headers = dict(self.headers)
+        if hasattr(body, "fileno"):
+            headers["Content-Length"] = str(os.fstat(body.fileno()).st_size)
+        for attempt in range(2):
+            conn = getattr(self.local, "conn", None)
+            if conn is None:
+                conn = self.local.conn = self.connection_class(self.host, self.port, timeout=REQUEST_TIMEOUT,
+                                                               blocksize=CHUNK_SIZE)
+            try:
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+                continue
+            if response.status >= 300 and response.status != 404:
+                response.read()
+                raise OSError(f"Object store: {method} {path} failed with {response.status} {response.reason}")
+            return response
+
+    def _request(self, method, path, body=None):
+        response = self._send(method, path, body)
+        data = response.read()
+        return (None if response.status == 404 else data), response
+
+    def _path(self, key):
+        return "/" + urllib.parse.quote(self._name(key))
+
+    def source(self, key):
+        # What a media player reads the object from: a link to the object
+        # server, which answers the browser's Range requests itself
+        name = self._name(key)
+        url = f"{self.public_url}/{urllib.parse.quote(name)}"
+        if not TOKEN:
+            return url
+        expires = (int(time.time()) // URL_SECONDS + 2) * URL_SECONDS
+        return f"{url}?" + urllib.parse.urlencode({"expires": expires, "signature": auth.sign(TOKEN, name, expires)})
+
+    def get(self, key):
+        # Whole objects, for what is used from memory anyway: thumbnails,
+        # avatars and archive parts
+        return self._request("GET", self._path(key))[0]
+
+    def get_file(self, key, destination):
+        # Copy an object to a local file in chunks
+        response = self._send("GET", self._path(key))
+        if response.status == 404:
+            response.read()
+            raise FileNotFoundError(key)
+        with open(destination, "wb") as file:
+            shutil.copyfileobj(response, file, CHUNK_SIZE)
+
+    def put(self, key, data):
+        self._request("PUT", self._path(key), data)
+
+    def put_file(self, key, source_path):
+        with open(source_path, "rb") as file:
+            self._request("PUT", self._path(key), file)
+
+    def move_file(self, key, source_path):
+        self.put_file(key, source_path)
+        os.remove(source_path)
+
+    def version(self, key):
+        _, response = self._request("HEAD", self._path(key))
+        return None if response.status == 404 else response.getheader("ETag")
+
+    def exists(self, key):
+        return self.version(key) is not None
+
+    def delete(self, key):
+        self._request("DELETE", self._path(key))
+
+    def copy(self, key, destination):
+        # Through a local temporary file, so a video is never held in memory
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "object")
+            self.get_file(key, path)
+            self.put_file(destination, path)
+
+    def keys(self, prefix):
+        data, _ = self._request("GET", "/?" + urllib.parse.urlencode({"prefix": self._name(prefix)}))
+        offset = len(self.prefix) + 1 if self.prefix else 0
+        return [name[offset:] for name in json.loads(data)]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def configure(location=None):
+    # Point the app at another store (used by tools and benchmarks)
+    global _store, MEDIA_STORE
+    with _store_lock:
+        _store = None
+        if location:
+            MEDIA_STORE = location
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HTTPStore(MEDIA_STORE) if MEDIA_STORE.startswith(("http://", "https://")) else FileStore(MEDIA_STORE)
+    return _store
+
+
+# Object server, a local stand-in for a shared object store
+
+# A single "Range: bytes=first-last" request; suffix ranges leave out first
+BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class ObjectRequest(BaseHTTPRequestHandler):
+    # Replies are written in pieces, see dbserver.Session
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _key(self):
+        # None for names that would leave the served directory
+        key = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/")
+        return None if not key or key.startswith("/") or ".." in key.split("/") else key
+
+    def _reply(self, status, body=b"", headers=None, send_body=True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _authorized(self, signed=False):
+        # The shared token, or for reads a link from HTTPStore.source
+        if not TOKEN or auth.bearer_matches(self.headers.get("Authorization"), TOKEN):
+            return True
+        if signed:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            key = self._key()
+            expires = query.get("expires", [""])[0]
+            if (key and expires.isdigit() and int(expires) >= time.time()
+                    and auth.signature_matches(TOKEN, key, expires, query.get("signature", [""])[0])):
+                return True
+        self._reply(401)
+        return False
+
+    def _range(self, size):
+        # (first, last) byte to send and whether that is a partial reply;
+        # None when the requested range is past the end of the object
+        match = BYTE_RANGE.match(self.headers.get("Range") or "")
+        if not match or not any(match.groups()):
+            return 0, size - 1, False
+        first, last = match.groups()
+        if first:
+            span = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            span = max(size - int(last), 0), size - 1
+        return (*span, True) if span[0] <= span[1] else None
+
+    def do_GET(self):
+        if not self._authorized(signed=True):
+            return
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path == "/":
+            prefix = urllib.parse.parse_qs(parts.query).get("prefix", [""])[0]
+            if ".." in prefix.split("/"):
+                self._reply(400)
+                return
+            self._reply(200, json.dumps(self.server.store.keys(prefix)).encode(), {"Content-Type": "application/json"})
+            return
+        key = self._key()
+        file = self.server.store.open(key) if key else None
+        if file is None:
+            self._reply(404)
+            return
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            span = self._range(size)
+            if span is None:
+                self._reply(416, headers={"Content-Range": f"bytes */{size}"})
+                return
+            first, last, partial = span
+            self.send_response(206 if partial else 200)
+            self.send_header("ETag", self.server.store.version(key))
+            self.send_header("Content-Type", mimetypes.guess_type(key)[0] or "application/octet-stream")
+            self.send_header("Accept-Ranges", "bytes")
+            if partial:
+                self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+            self.send_header("Content-Length", str(last - first + 1))
+            self.end_headers()
+            file.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = file.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def do_HEAD(self):
+        if not self._authorized(signed=True):
+            return
+        key = self._key()
+        version = self.server.store.version(key) if key else None
+        self._reply(404 if version is None else 200, headers={"ETag": version} if version else None, send_body=False)
+
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        key = self._key()
+        if key is None:
+            self.close_connection = True
+            self._reply(400)
+            return
+        self.server.store.put_stream(key, self.rfile, int(self.headers["Content-Length"]))
+        self._reply(201)
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        key = self._key()
+        if key is None:
+            self._reply(400)
+            return
+        self.server.store.delete(key)
+        self._reply(204)
+
+
+def serve(directory, host=HOST, port=PORT):
+    # Object server for a directory; call serve_forever() on it
+    auth.check_listen(host, TOKEN, "HEALTHCARE_MEDIA_TOKEN")
+    server = ThreadingHTTPServer((host, port), ObjectRequest)
+    server.daemon_threads = True
+    server.store = FileStore(directory)
+    return server
+
+
+def start(directory, host="127.0.0.1", port=0):
+    # Local stand-in for tests and benchmarks: an object server on a
+    # background thread of this process. Returns the server and its URL.
+    server = serve(directory, host, port)
+    threading.Thread(target=server.serve_forever, name="healthcare-objects", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+# python -m healthcare.storage serve [directory] [--host HOST] [--port PORT]
+# python -m healthcare.storage upload path...   (copies local media into HEALTHCARE_MEDIA_STORE)
+def main():
+    parser = argparse.ArgumentParser(description="Media object store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="serve a directory as an object store")
+    serve_parser.add_argument("directory", nargs="?", default=".")
+    serve_parser.add_argument("--host", default=HOST)
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    upload_parser = commands.add_parser("upload", help="copy files or directories into the media store")
+    upload_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = serve(args.directory, args.host, args.port)
+        print(f"Serving {args.directory} on http://{args.host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    store = get_store()
+    count = 0
+    for path in args.paths:
+        files = [path] if os.path.isfile(path) else [os.path.join(root, name) for root, _, names in os.walk(path)
+                                                     for name in names]
+        for file_path in files:
+            store.put_file(file_path, file_path)
+            count += 1
+    print(f"Uploaded {count} files to {MEDIA_STORE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import glob
+import logging
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from healthcare import cache, db, storage
+
+# Worker processes shared by every session of the app
+TRANSCODE_WORKERS = int(os.environ.get("HEALTHCARE_TRANSCODE_WORKERS", "2"))
+
+# VP9 in WebM is what OpenCV's bundled encoder can write that browsers play
+WEB_FOURCC = "VP90"
+WEB_EXTENSION = ".webm"
+PREVIEW_WIDTH = 320
+PREVIEW_FPS = 10
+THUMBNAIL_WIDTH = 320
+# Take the thumbnail a little way in, past any black first frames
+THUMBNAIL_SECONDS = 1.0
+
+_executor = None
+_logger = logging.getLogger(__name__)
+
+
+def output_paths(source_path):
+    root = os.path.splitext(source_path)[0]
+    return {
+        "path": root + WEB_EXTENSION,
+        "preview_path": f"{root}.preview{WEB_EXTENSION}",
+        "thumbnail_path": f"{root}.jpg",
+    }
+
+
+def _writer(path, fourcc, fps, size):
+    writer = cv2.VideoWriter(path, fourcc, fps, size)
+    if not writer.isOpened():
+        writer.release()
+        raise OSError(f"Could not open {path} for writing")
+    return writer
+
+
+def _scaled(frame, width):
+    height = round(frame.shape[0] * width / frame.shape[1] / 2) * 2
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def transcode(source_path):
+    # Runs in a worker process: writes the web copy, the low-bitrate preview
+    # and the thumbnail next to the source, and returns their metadata
+    paths = output_paths(source_path)
+    cap = cv2.VideoCapture(source_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+    preview_step = max(1, round(fps / PREVIEW_FPS))
+    thumbnail_frame = int(fps * THUMBNAIL_SECONDS)
+
+    fourcc = cv2.VideoWriter_fourcc(*WEB_FOURCC)
+    web = preview = thumbnail = None
+    frame_count = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if web is None:
+                height, width = frame.shape[:2]
+                web = _writer(paths["path"], fourcc, fps, (width, height))
+                preview_frame = _scaled(frame, PREVIEW_WIDTH)
+                preview = _writer(paths["preview_path"], fourcc, fps / preview_step,
+                                  (preview_frame.shape[1], preview_frame.shape[0]))
+
+            web.write(frame)
+            if frame_count % preview_step == 0:
+                preview.write(_scaled(frame, PREVIEW_WIDTH))
+            if thumbnail is None or frame_count == thumbnail_frame:
+                thumbnail = frame
+            frame_count += 1
+    finally:
+        cap.release()
+        for writer in (web, preview):
+            if writer is not None:
+                writer.release()
+
+    if not frame_count:
+        raise ValueError(f"{source_path} has no readable frames")
+    if not cv2.imwrite(paths["thumbnail_path"], _scaled(thumbnail, THUMBNAIL_WIDTH)):
+        raise OSError(f"Could not write {paths['thumbnail_path']}")
+
+    return {
+        **paths,
+        "duration": frame_count / fps,
+        "size": os.path.getsize(paths["path"]),
+        "preview_size": os.path.getsize(paths["preview_path"]),
+        "width": width,
+        "height": height,
+    }
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # Spawned rather than forked: the app process holds threads and
+        # open database connections that must not be copied
+        _executor = ProcessPoolExecutor(TRANSCODE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def save_recording(consultation_id, role, recording):
+    db.execute('''INSERT OR REPLACE INTO recordings
+                  (consultation_id, role, path, preview_path, thumbnail_path, duration, size,
+                   preview_size, width, height, created_at)
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))''',
+               (consultation_id, role, recording["path"], recording["preview_path"],
+                recording["thumbnail_path"], recording["duration"], recording["size"],
+                recording["preview_size"], recording["width"], recording["height"]))
+    cache.invalidate("recordings")
+
+
+def submit(consultation_id, role, source_path):
+    # Transcode a finished recording in the background. The original is
+    # stored at once, so every replica can play it, and replaced by the web
+    # copy once that is stored and its metadata saved; if anything fails the
+    # original stays and is played as before.
+    store = storage.get_store()
+    store.put_file(source_path, source_path)
+    cache.invalidate("media")
+
+    def finished(future):
+        try:
+            recording = future.result()
+            for column in ("path", "preview_path", "thumbnail_path"):
+                store.move_file(recording[column], recording[column])
+            save_recording(consultation_id, role, recording)
+            store.delete(source_path)
+            cache.invalidate("media")
+            if os.path.exists(source_path):
+                os.remove(source_path)
+        except Exception:
+            _logger.exception("Transcoding %s failed", source_path)
+
+    future = get_executor().submit(transcode, source_path)
+    future.add_done_callback(finished)
+    return future
+
+
+# python -m healthcare.transcode [video directory] [database]
+# Transcodes recordings made before this stage existed
+if __name__ == "__main__":
+    from healthcare import migrations
+
+    video_dir = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("HEALTHCARE_VIDEO_DIR", ".")
+    if len(sys.argv) > 2:
+        db.configure(sys.argv[2])
+    migrations.migrate()
+
+    futures = []
+    for path in sorted(glob.glob(os.path.join(video_dir, "consultation_*_*.mp4"))):
+        match = re.fullmatch(r"consultation_(\d+)_(doctor|patient)\.mp4", os.path.basename(path))
+        if match:
+            futures.append((path, submit(int(match[1]), match[2], path)))
+    for path, future in futures:
+        try:
+            recording = future.result()
+            print(f"{path}: {recording['duration']:.1f}s, {recording['size']} bytes, "
+                  f"preview {recording['preview_size']} bytes")
+        except Exception as error:
+            print(f"{path}: failed ({error})")
+    get_executor().shutdown()
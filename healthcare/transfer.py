@@ -0,0 +1,185 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+
+from healthcare import analytics, cache, db, migrations
+
+# Tables that can be exported and imported
+TABLES = ("users", "consultations", "chat_messages")
+# The dashboard rollups can be exported as well, they are rebuilt rather than imported
+EXPORT_TABLES = TABLES + analytics.ROLLUP_TABLES
+FORMATS = (".csv", ".jsonl", ".parquet")
+BATCH_SIZE = 10000
+
+
+def table_columns(table):
+    return [row[1] for row in db.query(f"PRAGMA table_info({table})")]
+
+
+def primary_key(table):
+    # Column names, in key order; the rollup tables have no rowid to sort by
+    return [row[1] for row in sorted(db.query(f"PRAGMA table_info({table})"), key=lambda row: row[5]) if row[5]]
+
+
+def file_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"{path}: expected a {', '.join(FORMATS)} file")
+    return extension
+
+
+# Export. Rows are read from one snapshot of the database in batches, so
+# memory stays flat whatever the table size.
+
+def export_table(table, path, batch_size=BATCH_SIZE):
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table {table!r}")
+    extension = file_format(path)
+    columns = table_columns(table)
+    count = 0
+
+    with db.connection() as conn:
+        conn.execute("BEGIN")
+        try:
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {', '.join(primary_key(table))}")
+            batches = iter(lambda: cursor.fetchmany(batch_size), [])
+            if extension == ".csv":
+                count = _write_csv(path, columns, batches)
+            elif extension == ".jsonl":
+                count = _write_jsonl(path, columns, batches)
+            else:
+                count = _write_parquet(path, table, columns, batches)
+        finally:
+            conn.rollback()
+    return count
+
+
+def _write_csv(path, columns, batches):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_jsonl(path, columns, batches):
+    count = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for rows in batches:
+            file.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+def parquet_schema(table, columns):
+    import pyarrow as pa
+
+    declared = {row[1]: row[2].upper() for row in db.query(f"PRAGMA table_info({table})")}
+    types = {"INTEGER": pa.int64(), "REAL": pa.float64()}
+    return pa.schema([(column, types.get(declared[column], pa.string())) for column in columns])
+
+
+def _write_parquet(path, table, columns, batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema(table, columns)
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in batches:
+            # One row group per batch
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)], schema=schema))
+            count += len(rows)
+    return count
+
+
+# Import. Files are read as a stream of batches and each batch is inserted
+# with executemany in its own short transaction.
+
+def read_rows(path, batch_size=BATCH_SIZE):
+    # Yields lists of dicts
+    extension = file_format(path)
+    if extension == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield batch.to_pylist()
+        return
+
+    with open(path, newline="", encoding="utf-8") as file:
+        if extension == ".csv":
+            # CSV has no NULL, so empty fields are read back as NULL
+            rows = ({key: value if value != "" else None for key, value in row.items()}
+                    for row in csv.DictReader(file))
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+def import_table(table, path, batch_size=BATCH_SIZE, on_conflict="abort"):
+    # on_conflict: "abort" stops at the first duplicate id or username (the
+    # batches before it stay imported), "ignore" skips such rows and
+    # "replace" overwrites them. Rows without an id get a new one.
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}")
+    verb = {"abort": "INSERT", "ignore": "INSERT OR IGNORE", "replace": "INSERT OR REPLACE"}[on_conflict]
+    known_columns = set(table_columns(table))
+    count = 0
+
+    try:
+        for batch in read_rows(path, batch_size):
+            columns = list(batch[0])
+            unknown = set(columns) - known_columns
+            if unknown:
+                raise ValueError(f"{path}: {table} has no column(s) {', '.join(sorted(unknown))}")
+            sql = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            with db.transaction() as conn:
+                conn.executemany(sql, ([row.get(column) for column in columns] for row in batch))
+            count += len(batch)
+    finally:
+        cache.invalidate(table)
+    return count
+
+
+# python -m healthcare.transfer export|import <table> <file> [--database path]
+def main():
+    parser = argparse.ArgumentParser(description="Bulk export and import of healthcare data")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("table", choices=EXPORT_TABLES)
+    parser.add_argument("path", help="a .csv, .jsonl or .parquet file")
+    parser.add_argument("--database", help="defaults to HEALTHCARE_DB")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--on-conflict", choices=["abort", "ignore", "replace"], default="abort",
+                        help="what to do with rows whose id or username already exists (import only)")
+    args = parser.parse_args()
+
+    if args.database:
+        db.configure(args.database)
+    migrations.migrate()
+
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            count = export_table(args.table, args.path, args.batch_size)
+        else:
+            count = import_table(args.table, args.path, args.batch_size, args.on_conflict)
+    except (ValueError, OSError, db.sqlite3.Error) as error:
+        sys.exit(f"{args.command} failed: {error}")
+    seconds = time.perf_counter() - start
+    print(f"{args.command}ed {count} {args.table} rows in {seconds:.1f}s ({count / max(seconds, 1e-9):.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
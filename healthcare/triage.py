@@ -0,0 +1,153 @@
+import os
+import re
+import sys
+
+from healthcare import cache, db, writer
+
+# Scoring new consultations from their symptoms can be switched off, in which
+# case everything is queued first come, first served
+URGENCY_SCORING = os.environ.get("HEALTHCARE_URGENCY_SCORING", "1") == "1"
+
+# Symptom phrases that move a consultation up the queue, with their weight.
+# A phrase counts when all of its words appear in the symptoms, in any order.
+URGENT_SYMPTOMS = {
+    "chest pain": 5,
+    "difficulty breathing": 5,
+    "shortness of breath": 5,
+    "unconscious": 5,
+    "seizure": 5,
+    "stroke": 5,
+    "anaphylaxis": 5,
+    "suicidal": 5,
+    "severe bleeding": 5,
+    "coughing blood": 4,
+    "vomiting blood": 4,
+    "face drooping": 4,
+    "fainting": 3,
+    "confusion": 3,
+    "severe headache": 3,
+    "high fever": 3,
+    "severe pain": 3,
+    "swelling": 1,
+    "vomiting": 1,
+    "dizziness": 1,
+    "fever": 1,
+}
+MAX_PRIORITY = 10
+
+# Rows shown from the top of the queue
+QUEUE_LIMIT = 20
+
+QUEUE_COLUMNS = ("id", "patient_id", "priority", "created_at", "symptoms")
+
+# Words of two or more letters, as the knowledge base vectorizer splits
+# them; a plain regex so scoring symptoms does not load scikit-learn
+WORD = re.compile(r"\b\w\w+\b")
+
+
+def _words(text):
+    return set(WORD.findall(text.lower()))
+
+
+_phrases = [(frozenset(_words(phrase)), weight) for phrase, weight in URGENT_SYMPTOMS.items()]
+
+
+def urgency_batch(texts):
+    # Priority of each symptom text: the summed weight of the urgent phrases
+    # it contains, capped at MAX_PRIORITY
+    priorities = []
+    for text in texts:
+        words = _words(text or "")
+        priorities.append(min(sum(weight for terms, weight in _phrases if terms <= words), MAX_PRIORITY))
+    return priorities
+
+
+def urgency(symptoms):
+    if not URGENCY_SCORING or not symptoms:
+        return 0
+    return urgency_batch([symptoms])[0]
+
+
+@cache.cached("consultations")
+def queue(consultation_type, limit=QUEUE_LIMIT):
+    # Unclaimed consultations in the order they will be handed out
+    rows = db.query(f'''SELECT {", ".join(QUEUE_COLUMNS)} FROM consultations
+                        WHERE consultation_type = ? AND status = 'Processing' AND assigned_doctor_id IS NULL
+                        ORDER BY priority DESC, id LIMIT ?''', (consultation_type, limit))
+    return [dict(zip(QUEUE_COLUMNS, row)) for row in rows]
+
+
+@cache.cached("consultations")
+def queue_length(consultation_type):
+    return db.query_one('''SELECT COUNT(*) FROM consultations
+                           WHERE consultation_type = ? AND status = 'Processing' AND assigned_doctor_id IS NULL''',
+                        (consultation_type,))[0]
+
+
+def claim_next(doctor_id, consultation_type):
+    # Assign the most urgent unclaimed consultation to this doctor and return
+    # its id, or None when the queue is empty. The pick and the assignment
+    # are one statement under the write lock, so two doctors never get the
+    # same consultation. Queued like the other consultation writes.
+    rows = writer.execute('''UPDATE consultations SET assigned_doctor_id = ?, claimed_at = datetime('now')
+                             WHERE id = (SELECT id FROM consultations
+                                         WHERE consultation_type = ? AND status = 'Processing'
+                                         AND assigned_doctor_id IS NULL
+                                         ORDER BY priority DESC, id LIMIT 1)
+                             RETURNING id''', (doctor_id, consultation_type), tags=("consultations",))
+    return rows[0][0] if rows else None
+
+
+def assign(consultation_id, doctor_id):
+    # Hand a consultation to a doctor directly; doctor_id None puts it back in the queue
+    writer.execute("UPDATE consultations SET assigned_doctor_id = ?, claimed_at = CASE WHEN ? IS NULL THEN NULL "
+                   "ELSE datetime('now') END WHERE id = ?", (doctor_id, doctor_id, consultation_id),
+                   tags=("consultations",))
+
+
+def release(consultation_id):
+    assign(consultation_id, None)
+
+
+def set_priority(consultation_id, priority):
+    writer.execute("UPDATE consultations SET priority = ? WHERE id = ?", (priority, consultation_id),
+                   tags=("consultations",))
+
+
+@cache.cached("consultations")
+def doctor_consultations(doctor_id, consultation_type):
+    # Consultations this doctor has claimed that are not closed yet
+    rows = db.query(f'''SELECT {", ".join(QUEUE_COLUMNS)}, status FROM consultations
+                        WHERE assigned_doctor_id = ? AND consultation_type = ? AND status != 'Unavailable'
+                        ORDER BY id''', (doctor_id, consultation_type))
+    return [dict(zip((*QUEUE_COLUMNS, "status"), row)) for row in rows]
+
+
+def rescore(batch_size=1000):
+    # Score the symptoms of every waiting consultation again, e.g. after
+    # URGENT_SYMPTOMS changed; returns the number of consultations updated
+    count = 0
+    last_id = 0
+    while True:
+        rows = db.query('''SELECT id, symptoms, priority FROM consultations
+                           WHERE id > ? AND status = 'Processing' ORDER BY id LIMIT ?''', (last_id, batch_size))
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        changed = [(priority, row[0]) for row, priority in zip(rows, urgency_batch([row[1] for row in rows]))
+                   if priority != row[2]]
+        if changed:
+            db.executemany("UPDATE consultations SET priority = ? WHERE id = ?", changed)
+            count += len(changed)
+    cache.invalidate("consultations")
+    return count
+
+
+# python -m healthcare.triage [database]
+if __name__ == "__main__":
+    from healthcare import migrations
+
+    if len(sys.argv) > 1:
+        db.configure(sys.argv[1])
+    migrations.migrate()
+    print(f"Rescored {rescore()} waiting consultations")
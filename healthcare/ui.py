@@ -0,0 +1,212 @@
+from contextlib import contextmanager
+
+import streamlit as st
+
+from healthcare import archive, consultations, media, metrics, recording
+
+# Seconds between background checks for new chat messages
+CHAT_POLL_SECONDS = 3
+
+
+# Times a page render for the metrics. Picking the page on the Diagnostics
+# page, or adding ?profile=1 to the URL as a logged-in admin, also profiles
+# this one rerun.
+@contextmanager
+def page(name):
+    profile = st.session_state.get("profile_next_rerun") == name
+    if profile:
+        del st.session_state["profile_next_rerun"]
+    user = st.session_state.get("user") if st.session_state.get("logged_in") else None
+    may_profile = metrics.PROFILE_FROM_URL or (user is not None and user[8] == "admin")
+    if may_profile and st.query_params.get("profile") == "1":
+        del st.query_params["profile"]
+        profile = True
+    with metrics.page(name, profile=profile):
+        yield
+
+
+# Dashboard greeting with the user's small avatar
+def welcome(user):
+    avatar = media.avatar_bytes(user[6], media.AVATAR_SIZES[0])
+    if avatar:
+        avatar_column, greeting_column = st.columns([1, 9])
+        avatar_column.image(avatar, width=media.AVATAR_SIZES[0])
+        greeting_column.subheader(f"Welcome, {user[3]}!")
+    else:
+        st.subheader(f"Welcome, {user[3]}!")
+
+
+# Form a patient fills in to request a chat or video consultation
+def new_consultation_form(patient_id, consultation_type):
+    st.subheader(f"New {consultation_type.capitalize()} Consultation")
+    symptoms = st.text_area("Symptoms")
+    history_of_illness = st.text_area("History of Illness")
+    blood_group = st.text_input("Blood Group")
+    comments = st.text_area("Comments")
+
+    if st.button("Submit"):
+        consultations.add_consultation(patient_id, consultation_type, symptoms, history_of_illness, blood_group,
+                                       comments)
+        st.success(f"{consultation_type.capitalize()} consultation submitted successfully!")
+
+
+# Details of one of the patient's consultations (a consultations row)
+def consultation_details(consultation):
+    st.write(f"Consultation ID: {consultation[0]}")
+    st.write(f"Symptoms: {consultation[3]}")
+    st.write(f"History of Illness: {consultation[4]}")
+    st.write(f"Blood Group: {consultation[5]}")
+    st.write(f"Comments: {consultation[6]}")
+    st.write(f"Status: {consultation[7]}")
+    st.write(f"Doctor Comments: {consultation[8]}")
+
+
+# Status and comment controls a doctor uses on a consultation; returns the
+# selected status
+def consultation_actions(consultation_id):
+    new_status = st.selectbox("Update Status", ["Processing", "Available", "Unavailable"], key=f"status_{consultation_id}")
+    doctor_comments = st.text_area("Doctor Comments", key=f"comments_{consultation_id}")
+
+    if st.button("Update", key=f"update_{consultation_id}"):
+        consultations.update_status(consultation_id, new_status, doctor_comments)
+        st.success("Consultation updated successfully!")
+    return new_status
+
+
+# Live chat thread for one consultation. Runs as a fragment, so polling and
+# sending only rerun this thread, and each tick asks the database for
+# messages newer than the last one already shown.
+@st.experimental_fragment(run_every=CHAT_POLL_SECONDS)
+@metrics.timed("render.chat_thread")
+def chat_thread(consultation_id, sender, initial_messages=None):
+    history_key = f"chat_history_{consultation_id}"
+    if history_key not in st.session_state:
+        st.session_state[history_key] = list(initial_messages or [])
+    history = st.session_state[history_key]
+
+    # Fetch only what arrived since the last tick
+    last_id = history[-1][0] if history else 0
+    history.extend(consultations.messages_since(consultation_id, last_id))
+
+    # Send chat message
+    with st.form(f"chat_form_{consultation_id}", clear_on_submit=True):
+        message_input = st.text_input("Enter your message", key=f"message_{consultation_id}")
+        send_button = st.form_submit_button("Send")
+    if send_button and message_input:
+        consultations.add_message(consultation_id, sender, message_input)
+        history.extend(consultations.messages_since(consultation_id, history[-1][0] if history else 0))
+
+    del history[:-consultations.MESSAGE_HISTORY_LIMIT]
+
+    # Display chat messages
+    for message in history:
+        st.write(f"{message[2]}: {message[3]} ({message[4]})")
+
+
+# Recorded videos of one consultation: thumbnails up front, the videos
+# themselves only handed to the player when the user asks to watch them.
+# `recordings` comes from media.list_recordings for the whole page.
+@metrics.timed("render.videos")
+def consultation_videos(consultation_id, recordings, roles=("doctor", "patient")):
+    videos = []
+    for role in roles:
+        recorded = recordings.get((consultation_id, role))
+        if recorded is not None:
+            videos.append((role, recorded))
+        elif media.video_exists(media.video_path(consultation_id, role)):
+            # Not transcoded yet, or recorded before transcoding existed
+            videos.append((role, {"path": media.video_path(consultation_id, role), "preview_path": None}))
+    if not videos:
+        return
+
+    for column, (role, video) in zip(st.columns(len(videos)), videos):
+        with column:
+            thumbnail = media.load_thumbnail(video["thumbnail_path"]) if video.get("thumbnail_path") else None
+            if video["preview_path"] and thumbnail is not None:
+                minutes, seconds = divmod(round(video["duration"]), 60)
+                st.image(thumbnail, width=160, caption=f"{role.capitalize()}'s video, "
+                         f"{minutes}:{seconds:02d}, {video['size'] / 1e6:.1f} MB")
+            else:
+                st.caption(f"{role.capitalize()}'s video")
+
+    if st.toggle("Show videos", key=f"videos_{consultation_id}"):
+        full_quality = False
+        if any(video["preview_path"] for _, video in videos):
+            full_quality = st.toggle("Full quality", key=f"full_quality_{consultation_id}")
+        for role, video in videos:
+            path = video["path"] if full_quality or not video["preview_path"] else video["preview_path"]
+            source = media.video_source(path)
+            if source is not None:
+                st.caption(f"{role.capitalize()}'s video")
+                st.video(source, format="video/webm" if path.endswith(".webm") else "video/mp4")
+
+
+# A patient's archived consultations, listed from the archive index. The
+# details are only read from the Parquet archive when one is opened.
+def archived_consultations(patient_id, consultation_type, roles=("doctor", "patient")):
+    archived = archive.archived_consultations(patient_id, consultation_type)
+    if not archived:
+        return
+    with st.expander(f"Archived consultations ({len(archived)})"):
+        for entry in archived:
+            if st.toggle(f"Consultation {entry['id']} ({entry['status']}, submitted {entry['created_at']})",
+                         key=f"archived_{entry['id']}"):
+                archived_consultation(entry["id"], roles)
+
+
+# Details, chat history and videos of one archived consultation
+def archived_consultation(consultation_id, roles=("doctor", "patient")):
+    archived = archive.load(consultation_id)
+    if archived is None or archived["consultation"] is None:
+        st.warning(f"Consultation {consultation_id} is not in the archive.")
+        return
+    consultation = archived["consultation"]
+    st.write(f"Symptoms: {consultation['symptoms']}")
+    st.write(f"History of Illness: {consultation['history_of_illness']}")
+    st.write(f"Blood Group: {consultation['blood_group']}")
+    st.write(f"Comments: {consultation['comments']}")
+    st.write(f"Status: {consultation['status']}")
+    st.write(f"Doctor Comments: {consultation['doctor_comments']}")
+    for message in archived["messages"]:
+        st.write(f"{message['sender']}: {message['message']} ({message['timestamp']})")
+    consultation_videos(consultation_id, archived["recordings"], roles)
+
+
+# Record button for one participant's video. Recording runs in the
+# background, so the page stays usable while it is in progress.
+def recording_controls(consultation_id, role):
+    path = media.video_path(consultation_id, role)
+    recorder = recording.get_recording(path)
+    if recorder is not None and recorder.running:
+        recording_status(path)
+    elif st.button("Record Video", key=f"record_{consultation_id}"):
+        # Once the file is written it is transcoded in a worker process
+        recording.start_recording(path, on_complete=lambda path: _transcode(consultation_id, role, path))
+        recording_status(path)
+
+
+def _transcode(consultation_id, role, path):
+    # Imported here so pages that never record do not load OpenCV
+    from healthcare import transcode
+
+    transcode.submit(consultation_id, role, path)
+
+
+# Progress of a background recording, refreshed every second
+@st.experimental_fragment(run_every=1)
+@metrics.timed("render.recording_status")
+def recording_status(path):
+    recorder = recording.get_recording(path)
+    if recorder is None:
+        return
+
+    if recorder.running:
+        st.progress(min(recorder.frames_captured / recorder.total_frames, 1.0),
+                    text=f"Recording... {recorder.elapsed:.0f}s")
+        st.button("Stop", key=f"stop_{path}", on_click=recorder.stop)
+    elif recorder.error:
+        st.error(f"Recording failed: {recorder.error}")
+    elif recorder.frames_written:
+        st.success("Video recorded successfully!")
+    else:
+        st.error("No frames were captured from the camera.")
@@ -0,0 +1,26 @@
+from healthcare import auth, cache, db
+
+# Rows per page in the admin patient list
+PAGE_SIZE = 50
+
+PATIENT_COLUMNS = ("id", "profile_picture", "name", "age", "gender", "address")
+
+
+@cache.cached("users")
+def list_patients(after_id=None, limit=PAGE_SIZE):
+    # One keyset page of patients ordered by id, with the cursor for the next page
+    rows = db.query(f'''SELECT {", ".join(PATIENT_COLUMNS)} FROM users
+                        WHERE user_type = 'patient' AND id > ?
+                        ORDER BY id LIMIT ?''', (after_id or 0, limit + 1))
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return [dict(zip(PATIENT_COLUMNS, row)) for row in rows[:limit]], next_cursor
+
+
+def add_user(username, password, name, age, gender, profile_picture, address, user_type):
+    # Only the salted hash of the password is stored
+    cursor = db.execute("INSERT INTO users (username, password, name, age, gender, profile_picture, address, user_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (username, auth.hash_password(password), name, age, gender, profile_picture, address,
+                         user_type))
+    cache.invalidate("users")
+    return cursor.lastrowid
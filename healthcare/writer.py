@@ -0,0 +1,189 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from healthcare import cache, db, metrics
+
+# Form submissions, status updates and chat messages are queued for one
+# writer thread, which commits whatever is waiting as a single transaction.
+# HEALTHCARE_WRITE_BEHIND=0 makes each of them its own transaction again.
+ENABLED = os.environ.get("HEALTHCARE_WRITE_BEHIND", "1") == "1"
+
+# Most writes grouped into one transaction
+MAX_BATCH = int(os.environ.get("HEALTHCARE_WRITE_BATCH", "256"))
+# Seconds the writer waits for more writes to join a batch. With 0 a batch is
+# whatever queued up while the previous one committed, so a lone write is
+# not held back.
+MAX_DELAY = float(os.environ.get("HEALTHCARE_WRITE_DELAY", "0"))
+# synchronous setting of the writer's connection. FULL syncs the WAL before
+# every commit is acknowledged, so an acknowledged write survives a power
+# cut; batching keeps that to one sync per batch.
+SYNCHRONOUS = os.environ.get("HEALTHCARE_WRITE_SYNCHRONOUS", "FULL")
+# Seconds a caller waits for its write to be committed
+WAIT_TIMEOUT = float(os.environ.get("HEALTHCARE_WRITE_TIMEOUT", "30"))
+
+
+class Writer:
+    # Single thread that owns a connection and commits queued writes in batches
+
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY, synchronous=SYNCHRONOUS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self.pending = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.conn = None
+        self.path = None
+        self.stats = {"batches": 0, "writes": 0, "failed": 0, "max_batch": 0}
+
+    def submit(self, sql, params=(), tags=()):
+        # Queue a write; the future resolves to its lastrowid (or the rows of
+        # its RETURNING clause) once the batch holding it has committed, after
+        # the cache tags were invalidated
+        future = Future()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="healthcare-writer", daemon=True)
+                self.thread.start()
+        self.pending.put((sql, params, tags, future))
+        return future
+
+    def close(self):
+        # Commit what is queued and stop the thread
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.pending.put(None)
+            thread.join()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.pending.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _connection(self):
+        # Reopened when db.configure() pointed the app at another file
+        if self.conn is None or self.path != db.DB_PATH:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = db.connect()
+            self.conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+            self.path = db.DB_PATH
+        return self.conn
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with metrics.span("sql.write_batch"), db.using(self._connection()), db.transaction() as conn:
+                if len(batch) == 1:
+                    # A lone write has nothing to be isolated from
+                    results.append(_run(conn, batch[0][0], batch[0][1]))
+                else:
+                    for sql, params, _, _ in batch:
+                        # A write that fails only fails its own request
+                        conn.execute("SAVEPOINT queued_write")
+                        try:
+                            results.append(_run(conn, sql, params))
+                        except sqlite3.Error as error:
+                            conn.execute("ROLLBACK TO queued_write")
+                            results.append(error)
+                        conn.execute("RELEASE queued_write")
+        except BaseException as error:
+            self.stats["failed"] += len(batch)
+            for _, _, _, future in batch:
+                future.set_exception(error)
+            return
+
+        cache.invalidate(*{tag for _, _, tags, _ in batch for tag in tags})
+        self.stats["batches"] += 1
+        self.stats["writes"] += len(batch)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        for (_, _, _, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.stats["failed"] += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def _run(conn, sql, params):
+    # Rows of a RETURNING clause, otherwise the new rowid
+    cursor = conn.execute(sql, params)
+    return cursor.fetchall() if cursor.description else cursor.lastrowid
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure(enabled=None, max_batch=None, max_delay=None, synchronous=None):
+    # Change the settings above, after committing what is queued (used by
+    # tools and benchmarks)
+    global _writer, ENABLED, MAX_BATCH, MAX_DELAY, SYNCHRONOUS
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+        if enabled is not None:
+            ENABLED = enabled
+        if max_batch:
+            MAX_BATCH = max_batch
+        if max_delay is not None:
+            MAX_DELAY = max_delay
+        if synchronous:
+            SYNCHRONOUS = synchronous
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = Writer(MAX_BATCH, MAX_DELAY, SYNCHRONOUS)
+                atexit.register(_writer.close)
+    return _writer
+
+
+def execute(sql, params=(), tags=()):
+    # Run one write and return what submit() resolves to once it is
+    # committed. Inside an open transaction it runs right there, as the
+    # writer would otherwise wait for the lock this thread holds.
+    if not ENABLED or db.in_transaction():
+        with db.transaction() as conn:
+            result = _run(conn, sql, params)
+        cache.invalidate(*tags)
+        return result
+    return get_writer().submit(sql, params, tags).result(timeout=WAIT_TIMEOUT)
+
+
+def stats():
+    writer = _writer
+    if writer is None:
+        return {}
+    numbers = dict(writer.stats, queued=writer.pending.qsize())
+    numbers["mean_batch"] = round(numbers["writes"] / numbers["batches"], 2) if numbers["batches"] else 0
+    return numbers
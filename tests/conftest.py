@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Read when the knowledge base module is imported, so set before any test imports it
+os.environ.setdefault("KB_INDEX_PATH", os.path.join(tempfile.mkdtemp(prefix="healthcare-tests-"), "kb_index.joblib"))
+
+from healthcare import cache, db, dbserver, migrations, storage, writer  # noqa: E402
+
+
+@pytest.fixture(params=["local", "remote"])
+def backend(request, tmp_path, monkeypatch):
+    # A fresh, migrated database and media store: local files, or a database
+    # server and object server as the replicas of a multi-node deployment see them
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "healthcare.db")
+    media = str(tmp_path / "media")
+    servers = []
+    if request.param == "remote":
+        server, path = dbserver.start(path)
+        objects, media = storage.start(str(tmp_path / "objects"))
+        servers = [server, objects]
+    previous = db.DB_PATH, storage.MEDIA_STORE
+    db.configure(path)
+    storage.configure(media)
+    migrations.migrate()
+    cache.clear()
+    yield path
+
+    writer.configure()
+    db.configure(previous[0])
+    storage.configure(previous[1])
+    cache.clear()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,66 @@
+import pytest
+
+from healthcare import analytics, consultations, db
+
+
+def rollups():
+    # Rows that count something; the triggers leave zero rows behind
+    tables = {}
+    for table in analytics.ROLLUP_TABLES:
+        rows = db.query(f"SELECT * FROM {table} ORDER BY 1, 2")
+        tables[table] = [row for row in rows if row[-1 if table != "response_stats" else 2]]
+    return tables
+
+
+def test_rollups_match_a_fresh_count(backend):
+    db.executemany("INSERT INTO users (username, password, name, age, gender, profile_picture, address, user_type) "
+                   "VALUES (?, 'x', 'Name', ?, ?, NULL, 'Address', ?)",
+                   [("p1", 12, "Female", "patient"), ("p2", 29, "Male", "patient"), ("p3", 29, "Male", "patient"),
+                    ("p4", 70, "Other", "patient"), ("d1", 45, "Female", "doctor")])
+    db.execute("UPDATE users SET age = 30 WHERE username = 'p2'")
+    db.execute("UPDATE users SET gender = 'Female' WHERE username = 'p3'")
+    db.execute("UPDATE users SET user_type = 'doctor' WHERE username = 'p4'")
+    db.execute("UPDATE users SET user_type = 'patient' WHERE username = 'd1'")
+    db.execute("DELETE FROM users WHERE username = 'p1'")
+
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (2, ?, 'Symptoms', 'Processing', ?)",
+                   [("chat", "2024-03-01 09:00:00"), ("chat", "2024-03-01 23:59:59"), ("video", "2024-03-02 00:00:00"),
+                    ("chat", "2024-03-02 10:00:00")])
+    consultations.add_consultation(2, "video", "Fever", "", "", "")
+    for consultation_id, statuses in {1: ["Available", "Unavailable", "Available"], 2: ["Unavailable"],
+                                      3: ["Available"], 5: ["Available", "Available"]}.items():
+        for status in statuses:
+            consultations.update_status(consultation_id, status, "Comments")
+    db.execute("UPDATE consultations SET status = 'Processing' WHERE id = 3")
+
+    db.executemany("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) VALUES (?, ?, 'Text', ?)",
+                   [(1, "Patient", "2024-03-01 09:01:00"), (1, "Doctor", "2024-03-02 08:00:00"),
+                    (2, "Patient", "2024-03-02 08:30:00"), (4, "Patient", "2024-03-02 10:01:00")])
+    consultations.add_message(5, "Patient", "Hello")
+    consultations.add_message(1, "Patient", "Thanks")
+
+    maintained = rollups()
+    analytics.rebuild()
+    recounted = rollups()
+
+    for table in ("consultation_stats", "message_stats", "patient_stats"):
+        assert maintained[table] == recounted[table], table
+    # Response times: the triggers time from julianday('now'), the recount
+    # from first_available_at, which is stored to the second
+    assert [row[:3] for row in maintained["response_stats"]] == [row[:3] for row in recounted["response_stats"]]
+    for kept, fresh in zip(maintained["response_stats"], recounted["response_stats"]):
+        assert kept[3:] == pytest.approx(fresh[3:], abs=2)
+
+
+def test_deleted_consultations_stay_counted(backend):
+    # Archiving deletes consultations and messages; the dashboard keeps counting them
+    db.execute("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+               "VALUES (1, 'chat', 'Symptoms', 'Unavailable', '2024-03-01 09:00:00')")
+    db.execute("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) "
+               "VALUES (1, 'Patient', 'Text', '2024-03-01 09:01:00')")
+    before = rollups()
+    db.execute("DELETE FROM chat_messages")
+    db.execute("DELETE FROM consultations")
+    assert rollups() == before
+    assert before["consultation_stats"] == [("2024-03-01", "chat", "Unavailable", 1)]
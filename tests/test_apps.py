@@ -0,0 +1,68 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from conftest import ROOT
+from healthcare import consultations, metrics, users
+
+ADMIN_PAGES = ["Dashboard", "Triage", "Chat Consultation", "Video Consultation", "Search", "Archive", "Diagnostics"]
+PATIENT_PAGES = ["Chat Consultations", "Video Consultations", "Knowledge Base"]
+
+
+def seed():
+    users.add_user("doctor", "password", "Doctor", 40, "Female", None, "Address", "admin")
+    users.add_user("patient", "password", "Patient", 30, "Male", None, "Address", "patient")
+    for consultation_type in ("chat", "video"):
+        consultation_id = consultations.add_consultation(2, consultation_type, "fever and cough", "Two days",
+                                                         "O+", "None")
+        consultations.add_message(consultation_id, "Patient", "Still feverish")
+
+
+def render(app, page, user):
+    at = AppTest.from_file(os.path.join(ROOT, f"{app}.py.py"), default_timeout=60)
+    at.session_state.logged_in = True
+    at.session_state.user = user
+    at.run()
+    at.sidebar.selectbox[0].select(page).run()
+    return at
+
+
+@pytest.mark.parametrize("page", ADMIN_PAGES)
+def test_admin_pages(backend, page):
+    seed()
+    at = render("admin", page, (1, "doctor", "", "Doctor", 40, "Female", None, "Address", "admin"))
+    assert not at.exception, [exception.message for exception in at.exception]
+
+
+@pytest.mark.parametrize("page", PATIENT_PAGES)
+def test_patient_pages(backend, page):
+    seed()
+    at = render("patient", page, (2, "patient", "", "Patient", 30, "Male", None, "Address", "patient"))
+    assert not at.exception, [exception.message for exception in at.exception]
+
+
+@pytest.mark.parametrize("app, user, profiled", [
+    ("patient", None, False),
+    ("patient", (2, "patient", "", "Patient", 30, "Male", None, "Address", "patient"), False),
+    ("admin", (1, "doctor", "", "Doctor", 40, "Female", None, "Address", "admin"), True),
+])
+def test_only_admins_profile_from_the_url(tmp_path, monkeypatch, app, user, profiled):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path / "profiles"))
+    at = AppTest.from_file(os.path.join(ROOT, f"{app}.py.py"), default_timeout=60)
+    at.session_state.logged_in = user is not None
+    if user is not None:
+        at.session_state.user = user
+    at.query_params["profile"] = "1"
+    at.run()
+    assert os.path.isdir(tmp_path / "profiles") == profiled
+
+
+def test_old_profiles_are_deleted(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "MAX_PROFILES", 3)
+    for number in range(5):
+        with metrics.page(f"page{number}", profile=True):
+            pass
+    assert len(os.listdir(tmp_path)) == 3
@@ -0,0 +1,70 @@
+import pytest
+
+from healthcare import archive, consultations, db, media, storage
+
+
+def seed_closed(count):
+    # Closed consultations old enough to archive, each with a message and a recorded video
+    store = storage.get_store()
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, 'video', 'Symptoms', 'Unavailable', datetime('now', '-90 days'))", ((),) * count)
+    consultation_ids = [row[0] for row in db.query("SELECT id FROM consultations ORDER BY id")]
+    for consultation_id in consultation_ids:
+        consultations.add_message(consultation_id, "Patient", f"Message {consultation_id}")
+        store.put(media.video_path(consultation_id, "patient"), b"video")
+    return consultation_ids
+
+
+def stored(prefix):
+    return storage.get_store().keys(prefix)
+
+
+def test_archive_moves_rows_and_videos(backend):
+    consultation_ids = seed_closed(3)
+    totals = archive.run(compact_after=False)
+
+    assert totals["consultations"] == 3 and totals["messages"] == 3 and totals["videos"] == 3
+    assert db.query_one("SELECT COUNT(*) FROM consultations")[0] == 0
+    assert not any(storage.get_store().exists(media.video_path(consultation_id, "patient"))
+                   for consultation_id in consultation_ids)
+    assert len(stored(archive.COLD_VIDEO_DIR)) == 3
+    loaded = archive.load(consultation_ids[0])
+    assert loaded["messages"][0]["message"] == f"Message {consultation_ids[0]}"
+
+
+def test_consultation_changed_while_archiving_stays_hot(backend, monkeypatch):
+    consultation_ids = seed_closed(2)
+    write_part = archive._write_part
+
+    def write_part_and_reply(*args):
+        # A doctor answers while the videos and parts are being copied
+        if not db.query_one("SELECT COUNT(*) FROM chat_messages WHERE sender = 'Doctor'")[0]:
+            consultations.add_message(consultation_ids[0], "Doctor", "Late reply")
+        return write_part(*args)
+
+    monkeypatch.setattr(archive, "_write_part", write_part_and_reply)
+    totals = archive.archive_batch(consultation_ids)
+
+    assert totals["consultations"] == 1
+    assert [row[0] for row in db.query("SELECT id FROM consultations")] == [consultation_ids[0]]
+    assert db.query_one("SELECT COUNT(*) FROM chat_messages WHERE consultation_id = ?", (consultation_ids[0],))[0] == 2
+    # Its video stays where it was, without a stray cold copy
+    assert storage.get_store().exists(media.video_path(consultation_ids[0], "patient"))
+    cold = stored(archive.COLD_VIDEO_DIR)
+    assert len(cold) == 1 and f"consultation_{consultation_ids[1]}_" in cold[0]
+
+
+def test_failed_transaction_leaves_no_copies(backend, monkeypatch):
+    consultation_ids = seed_closed(2)
+
+    def failing_transaction():
+        raise db.sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(db, "transaction", failing_transaction)
+    with pytest.raises(db.sqlite3.OperationalError):
+        archive.archive_batch(consultation_ids)
+
+    assert db.query_one("SELECT COUNT(*) FROM consultations")[0] == 2
+    assert stored(archive.ARCHIVE_DIR) == []
+    assert all(storage.get_store().exists(media.video_path(consultation_id, "patient"))
+               for consultation_id in consultation_ids)
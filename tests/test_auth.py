@@ -0,0 +1,58 @@
+from healthcare import auth, db, users
+
+
+def add_legacy_user(username, password):
+    # A row saved before passwords were hashed
+    db.execute("INSERT INTO users (username, password, name, age, gender, profile_picture, address, user_type) "
+               "VALUES (?, ?, 'Ann', 30, 'Other', NULL, 'Street 1', 'patient')", (username, password))
+
+
+def stored_password(username):
+    return db.query_one("SELECT password FROM users WHERE username = ?", (username,))[0]
+
+
+def test_a_legacy_password_logs_in_and_is_rehashed(backend):
+    add_legacy_user("ann", "secret")
+    user = auth.authenticate("ann", "secret", "patient")
+
+    assert user is not None and user[2] == stored_password("ann")
+    assert stored_password("ann").startswith(f"{auth.PREFIX}${auth.SCRYPT_N}$")
+    assert auth.verify_password("secret", stored_password("ann")) == (True, False)
+    assert auth.authenticate("ann", "secret", "patient") is not None
+
+
+def test_a_weaker_hash_is_upgraded(backend):
+    users.add_user("bob", "secret", "Bob", 40, "Male", None, "Street 2", "patient")
+    db.execute("UPDATE users SET password = ? WHERE username = 'bob'", (auth.hash_password("secret", n=2 ** 10),))
+
+    assert auth.authenticate("bob", "secret", "patient") is not None
+    assert auth.verify_password("secret", stored_password("bob")) == (True, False)
+
+
+def test_a_wrong_password_or_user_type_is_refused(backend):
+    add_legacy_user("ann", "secret")
+    assert auth.authenticate("ann", "Secret", "patient") is None
+    assert auth.authenticate("ann", "secret", "admin") is None
+    # Nothing is rehashed for a failed login
+    assert stored_password("ann") == "secret"
+
+
+def test_an_unknown_user_is_checked_against_a_dummy_hash(backend, monkeypatch):
+    checked = []
+    verify = auth.verify_password
+
+    def spy(password, stored):
+        checked.append(stored)
+        return verify(password, stored)
+
+    monkeypatch.setattr(auth, "verify_password", spy)
+
+    assert auth.authenticate("nobody", "secret", "patient") is None
+    assert checked == [auth._dummy_hash] and checked[0].startswith(auth.PREFIX)
+
+
+def test_bearer_matches():
+    assert auth.bearer_matches("Bearer token", "token")
+    assert not auth.bearer_matches("Bearer other", "token")
+    assert not auth.bearer_matches("token", "token")
+    assert not auth.bearer_matches(None, "token")
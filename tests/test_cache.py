@@ -0,0 +1,51 @@
+import types
+
+from healthcare import cache, consultations, db
+
+
+def add_behind_the_cache(symptoms):
+    # A write the cache is not told about, like one made by the other app
+    db.execute("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+               "VALUES (1, 'chat', ?, 'Processing', datetime('now'))", (symptoms,))
+
+
+def listed():
+    return [row["symptoms"] for row in consultations.list_consultations("chat")[0]]
+
+
+def test_a_consultations_write_evicts_cached_lists(backend):
+    consultations.add_consultation(1, "chat", "cough", "", "", "")
+    assert listed() == ["cough"]
+    add_behind_the_cache("rash")
+    assert listed() == ["cough"]
+
+    consultations.add_consultation(1, "chat", "fever", "", "", "")
+    assert listed() == ["fever", "rash", "cough"]
+
+
+def test_a_chat_message_evicts_cached_history_only(backend):
+    consultations.add_consultation(1, "chat", "cough", "", "", "")
+    consultations.add_message(1, "Patient", "Hello")
+    assert [row[3] for row in consultations.recent_messages([1])[1]] == ["Hello"]
+    hits = consultations._recent_messages.cache.hits
+
+    # Other tables' writes leave the history cached
+    consultations.add_consultation(1, "chat", "fever", "", "", "")
+    consultations.recent_messages([1])
+    assert consultations._recent_messages.cache.hits == hits + 1
+
+    consultations.add_message(1, "Doctor", "Hi")
+    assert [row[3] for row in consultations.recent_messages([1])[1]] == ["Hello", "Hi"]
+
+
+def test_entries_expire_after_the_ttl(backend, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    ttl = consultations.list_consultations.cache.ttl
+
+    assert listed() == []
+    add_behind_the_cache("rash")
+    now[0] += ttl - 0.1
+    assert listed() == []
+    now[0] += 0.2
+    assert listed() == ["rash"]
@@ -0,0 +1,18 @@
+from healthcare import consultations, db
+
+
+def test_date_filters_do_not_assume_ids_follow_submission_time(backend):
+    # Imported rows: the newest id holds the oldest consultation
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, 'chat', 'Symptoms', 'Processing', ?)",
+                   (("2024-03-10 09:00:00",), ("2024-01-05 09:00:00",), ("2024-02-20 23:59:59",),
+                    ("2023-12-31 12:00:00",)))
+
+    def ids(**filters):
+        rows, _ = consultations.list_consultations("chat", **filters)
+        return [row["id"] for row in rows]
+
+    assert ids(since="2024-01-01") == [3, 2, 1]
+    assert ids(until="2024-02-20") == [4, 3, 2]
+    assert ids(since="2024-01-01", until="2024-02-20", patient_id=1) == [3, 2]
+    assert ids(since="2024-04-01") == []
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from healthcare import db, knowledge_base
+
+TOPICS = ["fever", "cough", "rash", "headache", "nausea", "dizziness", "fatigue", "insomnia"]
+
+
+@pytest.fixture
+def index(backend):
+    # Large enough for the common-term pruning to apply
+    knowledge_base.add_entries((f"what should I do about {TOPICS[number % len(TOPICS)]} number {number}",
+                                f"Answer {number}") for number in range(1200))
+    return knowledge_base.KnowledgeBaseIndex.build()
+
+
+def test_single_and_batch_queries_score_alike(index):
+    queries = ["what should I do about a fever", "number 17 cough", "headache what", "something else"]
+    assert index.n_docs >= knowledge_base.MIN_DOCS_FOR_PRUNING
+    for query, batch in zip(queries, index.search_ids_batch(queries, k=5, min_score=0.0)):
+        single = index.search_ids(query, k=5, min_score=0.0)
+        assert [entry_id for entry_id, _ in single] == [entry_id for entry_id, _ in batch]
+        assert [score for _, score in single] == pytest.approx([score for _, score in batch])
+
+
+def test_ties_are_ordered_by_entry_id():
+    ids = np.array([9, 4, 7, 1, 8, 3], dtype=np.int64)
+    scores = np.array([0.5, 0.5, 0.9, 0.5, 0.2, 0.5])
+    assert knowledge_base.top_k(ids, scores, 3, 0.1) == [(7, 0.9), (1, 0.5), (3, 0.5)]
+    assert knowledge_base.top_k(ids[::-1], scores[::-1], 3, 0.1) == [(7, 0.9), (1, 0.5), (3, 0.5)]
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_no_answers_are_asked_for(index, k):
+    queries = ["what should I do about a fever", "cough"]
+    assert index.search_ids(queries[0], k=k) == []
+    assert index.search_ids_batch(queries, k=k) == [[], []]
+    assert index.search(queries[0], k=k) == []
+    assert index.search_batch(queries, k=k) == [[], []]
+
+
+def test_saving_prunes_the_change_log(backend, tmp_path):
+    knowledge_base.add_entries([("fever", "Rest"), ("cough", "Honey"), ("rash", "Cream")])
+    stale = knowledge_base.KnowledgeBaseIndex.build()
+    knowledge_base.add_entry("headache", "Water")
+
+    index = knowledge_base.KnowledgeBaseIndex.build()
+    index.save(str(tmp_path / "kb_index.joblib"))
+    assert db.query("SELECT seq FROM knowledge_base_changes") == [(4,)]
+
+    # An index from before the pruned changes notices and rebuilds
+    knowledge_base.add_entry("nausea", "Ginger")
+    assert stale.refresh()
+    assert stale.last_seq == 5 and stale.n_docs == 5
+    assert [entry_id for entry_id, _ in stale.search_ids("headache")] == [4]
+
+
+def test_the_first_load_seeds_an_empty_knowledge_base(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(knowledge_base, "_index", None)
+    path = str(tmp_path / "kb_index.joblib")
+    index = knowledge_base.get_index(path)
+    count = len(list(knowledge_base.read_csv(knowledge_base.SEED_PATH)))
+    assert index.n_docs == count == db.query_one("SELECT COUNT(*) FROM knowledge_base")[0]
+    assert index.search("symptoms of diabetes", k=1)[0][0] == "What are the symptoms of diabetes?"
+
+    # Later loads only apply changes
+    knowledge_base.delete_entry(1)
+    assert knowledge_base.get_index(path) is index and index.n_docs == count - 1
@@ -0,0 +1,55 @@
+import base64
+import io
+import os
+import urllib.request
+
+import pytest
+from PIL import Image
+
+from healthcare import cache, db, media, storage, users
+
+
+@pytest.fixture(autouse=True)
+def fresh_avatars():
+    # Thumbnails are cached by path, which repeats between backends
+    for function in (media.legacy_avatar, media.avatar_bytes, media.avatar_data_url):
+        function.cache_clear()
+
+
+def test_videos_are_handed_to_the_player_by_path_or_link(backend):
+    path = media.video_path(1, "doctor")
+    assert media.video_source(path) is None
+
+    data = os.urandom(1000)
+    storage.get_store().put(path, data)
+    cache.invalidate("media")
+    source = media.video_source(path)
+    if source.startswith("http"):
+        with urllib.request.urlopen(source) as response:
+            assert response.read() == data
+    else:
+        with open(source, "rb") as file:
+            assert file.read() == data
+
+
+def test_legacy_pictures_get_thumbnails_instead_of_being_inlined(backend):
+    buffer = io.BytesIO()
+    Image.new("RGB", (1200, 900), (10, 120, 200)).save(buffer, "JPEG", quality=95)
+    storage.get_store().put("profile_ann.jpg", buffer.getvalue())
+    users.add_user("ann", "secret", "Ann", 30, "Female", "profile_ann.jpg", "Street 1", "patient")
+
+    url = media.avatar_data_url("profile_ann.jpg")
+    assert url.startswith("data:image/webp;base64,")
+    with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as thumbnail:
+        assert thumbnail.format == "WEBP" and thumbnail.size == (64, 64)
+
+    (profile_picture,) = db.query("SELECT profile_picture FROM users WHERE username = 'ann'")[0]
+    assert media.AVATAR_NAME.search(profile_picture)
+    assert all(storage.get_store().exists(media.avatar_path(profile_picture, size)) for size in media.AVATAR_SIZES)
+
+
+def test_unreadable_pictures_show_a_placeholder(backend):
+    storage.get_store().put("profile_bob.jpg", b"not an image")
+    for profile_picture in ("profile_bob.jpg", "profile_missing.jpg"):
+        assert media.avatar_bytes(profile_picture, 64) == media.placeholder_avatar(64)
+    assert media.avatar_bytes(None) is None
@@ -0,0 +1,11 @@
+from healthcare import db, migrations
+
+
+def test_hot_queries_use_an_index(backend):
+    assert migrations.full_scans() == []
+
+
+def test_a_fresh_database_is_at_the_latest_version(backend):
+    with db.connection() as conn:
+        assert migrations.current_version(conn) == migrations.MIGRATIONS[-1][0]
+    assert [version for version, _, _ in migrations.MIGRATIONS] == list(range(1, len(migrations.MIGRATIONS) + 1))
@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import ROOT
+from healthcare import auth, dbserver, storage
+
+REPLICAS = 4
+CONSULTATIONS = 3000
+
+# One app replica: claims until the queue is empty and prints what it got
+CLAIM_SCRIPT = """
+import json
+from healthcare import triage
+claimed = []
+while (consultation_id := triage.claim_next({doctor_id}, "chat")) is not None:
+    claimed.append(consultation_id)
+print(json.dumps(claimed))
+"""
+
+
+@pytest.fixture
+def server(tmp_path):
+    server, url = dbserver.start(str(tmp_path / "healthcare.db"))
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_replicas_never_claim_the_same_consultation(server):
+    conn = dbserver.RemoteConnection(server)
+    conn.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                     "VALUES (1, 'chat', 'Symptoms', 'Processing', datetime('now'))", ((),) * CONSULTATIONS)
+    conn.close()
+
+    env = dict(os.environ, HEALTHCARE_DB=server, PYTHONPATH=ROOT)
+    replicas = [subprocess.Popen([sys.executable, "-c", CLAIM_SCRIPT.format(doctor_id=number + 1)], env=env,
+                                 stdout=subprocess.PIPE, text=True)
+                for number in range(REPLICAS)]
+    claimed = []
+    for replica in replicas:
+        output, _ = replica.communicate(timeout=300)
+        assert replica.returncode == 0
+        claimed.extend(json.loads(output))
+
+    assert len(claimed) == CONSULTATIONS
+    assert len(set(claimed)) == CONSULTATIONS
+
+
+def test_clients_cannot_open_files_or_change_settings(server, tmp_path):
+    conn = dbserver.RemoteConnection(server)
+    for sql in (f"ATTACH DATABASE '{tmp_path / 'other.db'}' AS other", f"VACUUM INTO '{tmp_path / 'copy.db'}'",
+                "PRAGMA journal_mode = DELETE", "PRAGMA user_version = 1"):
+        with pytest.raises(sqlite3.DatabaseError):
+            conn.execute(sql)
+    assert not os.path.exists(tmp_path / "other.db") and not os.path.exists(tmp_path / "copy.db")
+    assert conn.execute("PRAGMA table_info(users)").fetchall()
+    conn.close()
+
+
+def test_stalled_write_transaction_is_rolled_back(server, monkeypatch):
+    monkeypatch.setattr(dbserver, "WRITE_TIMEOUT", 0.5)
+    stalled = dbserver.RemoteConnection(server)
+    stalled.execute("BEGIN IMMEDIATE")
+    stalled.execute("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) "
+                    "VALUES (1, 'Patient', 'Lost', datetime('now'))")
+
+    # Gets the write lock once the stalled transaction has been dropped
+    other = dbserver.RemoteConnection(server)
+    other.execute("BEGIN IMMEDIATE")
+    other.commit()
+    with pytest.raises(sqlite3.OperationalError):
+        stalled.commit()
+    assert other.execute("SELECT COUNT(*) FROM chat_messages").fetchone() == (0,)
+
+
+def test_servers_need_a_token_off_loopback(tmp_path):
+    with pytest.raises(ValueError):
+        dbserver.serve(str(tmp_path / "healthcare.db"), "0.0.0.0", 0)
+    with pytest.raises(ValueError):
+        storage.serve(str(tmp_path), "0.0.0.0", 0)
+
+
+def test_object_store_round_trip(tmp_path):
+    server, url = storage.start(str(tmp_path / "objects"))
+    store = storage.HTTPStore(url)
+    source = tmp_path / "video.mp4"
+    source.write_bytes(os.urandom(3 * storage.CHUNK_SIZE + 1))
+
+    store.put_file("./consultation_1_doctor.mp4", str(source))
+    store.copy("consultation_1_doctor.mp4", "cold/consultation_1_doctor.mp4")
+    store.get_file("cold/consultation_1_doctor.mp4", str(tmp_path / "copy.mp4"))
+    assert (tmp_path / "copy.mp4").read_bytes() == source.read_bytes()
+    assert store.keys("cold") == ["cold/consultation_1_doctor.mp4"]
+    assert store.get("missing.mp4") is None and store.version("missing.mp4") is None
+    assert store.get("../healthcare.db") is None
+    server.shutdown()
+    server.server_close()
+
+
+def test_players_read_videos_through_signed_range_links(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "TOKEN", "secret")
+    server, url = storage.start(str(tmp_path / "objects"))
+    store = storage.HTTPStore(url)
+    data = os.urandom(storage.CHUNK_SIZE + 100)
+    store.put("consultation_1_doctor.webm", data)
+
+    def fetch(link, **headers):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(link, headers=headers)) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, b""
+
+    link = store.source("consultation_1_doctor.webm")
+    status, headers, body = fetch(link)
+    assert (status, headers["Content-Type"], body) == (200, "video/webm", data)
+    status, headers, body = fetch(link, Range="bytes=100-199")
+    assert (status, headers["Content-Range"], body) == (206, f"bytes 100-199/{len(data)}", data[100:200])
+    assert fetch(link, Range="bytes=-10")[2] == data[-10:]
+    assert fetch(link, Range=f"bytes={len(data)}-")[0] == 416
+
+    # The link is for this object only, and only until it expires
+    assert fetch(link.split("?")[0])[0] == 401
+    assert fetch(link.replace("consultation_1_doctor", "consultation_2_doctor"))[0] == 401
+    expired = f"{link.split('?')[0]}?expires=1&signature={auth.sign('secret', 'consultation_1_doctor.webm', 1)}"
+    assert fetch(expired)[0] == 401
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,73 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from healthcare import recording
+
+
+def test_records_the_synthetic_source(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    recorder = recording.Recorder(path, recording.synthetic_source(64, 48), seconds=2, fps=10, width=64, height=48,
+                                  realtime=False).start()
+    assert recorder.join(timeout=30)
+    assert recorder.error is None
+    assert recorder.frames_captured == recorder.total_frames == 20
+    assert recorder.frames_written + recorder.frames_dropped == 20
+    assert (tmp_path / "video.mp4").stat().st_size > 0
+    assert [entry.name for entry in tmp_path.iterdir()] == ["video.mp4"]
+
+
+def test_encoder_failure_with_a_full_queue_ends_the_recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(recording, "FRAME_QUEUE_SIZE", 1)
+    recorders = []
+
+    def source():
+        yield "not a frame"
+        # Only deliver the next frame once the encoder has failed on the first,
+        # so the queue is full when capture finishes
+        deadline = time.monotonic() + 10
+        while recorders[0].error is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        while True:
+            yield np.zeros((48, 64, 3), np.uint8)
+
+    path = str(tmp_path / "video.mp4")
+    recorders.append(recording.Recorder(path, source(), seconds=10, fps=10, width=64, height=48, realtime=False))
+    recorder = recorders[0].start()
+    assert recorder.join(timeout=10)
+    assert not recorder.running
+    assert isinstance(recorder.error, AttributeError)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_a_writer_that_cannot_open_fails_the_recording(tmp_path):
+    path = str(tmp_path / "missing" / "video.mp4")
+    recorder = recording.Recorder(path, recording.synthetic_source(64, 48), seconds=1, fps=10, width=64, height=48,
+                                  realtime=False).start()
+    assert recorder.join(timeout=10)
+    assert isinstance(recorder.error, OSError)
+    assert recorder.frames_written == 0
+
+
+def test_a_failed_rename_fails_the_recording(tmp_path):
+    # Something else is in the way of the finished file
+    (tmp_path / "video.mp4").mkdir()
+    recorder = recording.Recorder(str(tmp_path / "video.mp4"), recording.synthetic_source(64, 48), seconds=1, fps=10,
+                                  width=64, height=48, realtime=False).start()
+    assert recorder.join(timeout=10)
+    assert isinstance(recorder.error, OSError)
+    assert [entry.name for entry in tmp_path.iterdir()] == ["video.mp4"]
+
+
+def test_transcode_fails_when_it_cannot_write_the_web_copy(tmp_path):
+    from healthcare import transcode
+
+    path = str(tmp_path / "video.mp4")
+    recorder = recording.Recorder(path, recording.synthetic_source(64, 48), seconds=1, fps=10, width=64, height=48,
+                                  realtime=False).start()
+    assert recorder.join(timeout=10) and recorder.error is None
+    os.mkdir(transcode.output_paths(path)["path"])
+    with pytest.raises(OSError):
+        transcode.transcode(path)
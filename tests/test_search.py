@@ -0,0 +1,39 @@
+from healthcare import db, search
+
+
+def add(consultation_type, symptoms, count=1):
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, ?, ?, 'Processing', datetime('now'))", ((consultation_type, symptoms),) * count)
+
+
+def every_page(search_function, *args):
+    rows, cursor = search_function(*args)
+    while cursor is not None:
+        page, cursor = search_function(*args, cursor=cursor)
+        rows.extend(page)
+    return rows
+
+
+def test_type_filter_reaches_matches_older_than_the_window(backend):
+    add("video", "fever and rash")
+    add("chat", "fever", search.RANK_WINDOW + 100)
+
+    rows, _ = search.search_consultations("fever", "video")
+    assert [row["id"] for row in rows] == [1]
+    assert "**" not in rows[0]["snippet"] and search.MATCH_START in rows[0]["snippet"]
+
+
+def test_pages_go_past_the_window(backend):
+    add("chat", "fever", search.RANK_WINDOW + 25)
+    add("chat", "fever fever")
+
+    rows = every_page(search.search_consultations, "fever")
+    assert len(rows) == search.RANK_WINDOW + 26
+    assert len({row["id"] for row in rows}) == len(rows)
+    # Ranked within the newest window first
+    assert rows[0]["id"] == search.RANK_WINDOW + 26
+
+
+def test_type_words_are_not_searched(backend):
+    add("video", "headache")
+    assert search.search_consultations("video") == ([], None)
@@ -0,0 +1,36 @@
+import pytest
+
+from healthcare import cache, db, migrations, transfer
+
+
+def seed():
+    db.executemany("INSERT INTO users (username, password, name, age, gender, profile_picture, address, user_type) "
+                   "VALUES (?, 'scrypt$hash', ?, ?, 'Other', ?, 'Straße 1, Zürich', ?)",
+                   [("ann", "Ann", 30, None, "patient"), ("doc", "Dr. Ünal", 52, "avatars/ab12", "doctor")])
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, history_of_illness, "
+                   "blood_group, comments, status, doctor_comments, created_at, priority, assigned_doctor_id) "
+                   "VALUES (1, ?, ?, 'None', 'A+', ?, ?, ?, ?, ?, ?)",
+                   [("chat", 'Chest pain, "sharp"\nsince Monday', "n/a", "Processing", None, "2024-02-01 08:00:00",
+                     5, None),
+                    ("video", "Rash", "Itchy", "Available", "Cream twice a day", "2024-01-15 17:30:00", 0, 2)])
+    db.executemany("INSERT INTO chat_messages (consultation_id, sender, message, timestamp) VALUES (1, ?, ?, ?)",
+                   [("Patient", "Hello 👋", "2024-02-01 08:01:00"), ("Doctor", "How long?", "2024-02-01 08:02:00")])
+
+
+def contents():
+    return {table: db.query(f"SELECT * FROM {table} ORDER BY 1") for table in transfer.TABLES}
+
+
+@pytest.mark.parametrize("extension", transfer.FORMATS)
+def test_export_and_import_round_trip(backend, tmp_path, extension):
+    seed()
+    exported = contents()
+    for table in transfer.TABLES:
+        assert transfer.export_table(table, str(tmp_path / f"{table}{extension}")) == len(exported[table])
+
+    db.configure(str(tmp_path / "copy.db"))
+    migrations.migrate()
+    cache.clear()
+    for table in transfer.TABLES:
+        assert transfer.import_table(table, str(tmp_path / f"{table}{extension}")) == len(exported[table])
+    assert contents() == exported
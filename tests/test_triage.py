@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+from healthcare import db, triage
+
+
+def test_urgency_does_not_load_scikit_learn():
+    script = ("import sys; from healthcare import triage; "
+              "print(triage.urgency('Sudden CHEST pain, shortness of breath'), 'sklearn' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", script], env=dict(os.environ, PYTHONPATH=ROOT),
+                            capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["10", "False"]
+
+
+def test_assign_release_and_priority_are_queued_writes(backend):
+    db.executemany("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+                   "VALUES (1, 'chat', ?, 'Processing', datetime('now'))", (("cough",), ("rash",)))
+    assert [row["id"] for row in triage.queue("chat")] == [1, 2]
+
+    triage.set_priority(2, 5)
+    assert [row["id"] for row in triage.queue("chat")] == [2, 1]
+    triage.assign(2, 7)
+    assert [row["id"] for row in triage.doctor_consultations(7, "chat")] == [2]
+    assert triage.queue_length("chat") == 1
+    triage.release(2)
+    assert triage.doctor_consultations(7, "chat") == []
+    assert triage.claim_next(7, "chat") == 2
@@ -0,0 +1,60 @@
+import sqlite3
+from concurrent.futures import Future
+
+import pytest
+
+from healthcare import consultations, db, writer
+
+INSERT = ("INSERT INTO consultations (patient_id, consultation_type, symptoms, status, created_at) "
+          "VALUES (1, 'chat', ?, 'Processing', datetime('now'))")
+
+
+def run_batch(queued, on_done=None):
+    # Queue every write before the writer runs, so they commit as one batch
+    queue_writer = writer.Writer()
+    futures = []
+    for sql, params, tags in queued:
+        futures.append(Future())
+        if on_done:
+            futures[-1].add_done_callback(on_done)
+        queue_writer.pending.put((sql, params, tags, futures[-1]))
+    queue_writer.pending.put(None)
+    queue_writer._run()
+    queue_writer.close()
+    return queue_writer, futures
+
+
+def test_a_failing_write_only_fails_its_own_request(backend):
+    queue_writer, futures = run_batch([
+        (INSERT, ("first",), ("consultations",)),
+        ("INSERT INTO consultations (patient_id, consultation_type, status) VALUES (NULL, 'chat', 'Processing')",
+         (), ("consultations",)),
+        (INSERT, ("second",), ("consultations",)),
+    ])
+
+    assert futures[0].result() == 1
+    assert isinstance(futures[1].exception(), sqlite3.IntegrityError)
+    assert futures[2].result() == 2
+    assert db.query("SELECT id, symptoms FROM consultations ORDER BY id") == [(1, "first"), (2, "second")]
+    assert queue_writer.stats == {"batches": 1, "writes": 3, "failed": 1, "max_batch": 3}
+
+
+def test_writes_apply_in_order_and_invalidate_before_returning(backend):
+    assert consultations.list_consultations("chat") == ([], None)
+    # What each caller would read as soon as its write returns
+    seen = []
+    _, futures = run_batch([
+        (INSERT, ("cough",), ("consultations",)),
+        ("UPDATE consultations SET status = 'Available' WHERE id = 1", (), ("consultations",)),
+        ("UPDATE consultations SET status = 'Unavailable' WHERE id = 1 RETURNING status", (), ("consultations",)),
+    ], on_done=lambda _: seen.append([row["status"] for row in consultations.list_consultations("chat")[0]]))
+
+    assert futures[0].result() == 1 and futures[2].result() == [("Unavailable",)]
+    assert seen == [["Unavailable"]] * 3
+
+
+def test_a_lone_write_reports_its_error(backend):
+    writer.configure()
+    with pytest.raises(sqlite3.OperationalError):
+        writer.execute("INSERT INTO no_such_table VALUES (1)", tags=("consultations",))
+    assert writer.execute(INSERT, ("fever",), tags=("consultations",)) == 1